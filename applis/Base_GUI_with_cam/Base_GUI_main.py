@@ -11,7 +11,7 @@ complete 5 areas GUI: 1 main menu on the left and 4 equivalent area on the right
 Creation : oct/2024
 """
 from lensepy import load_dictionary, translate, dictionary
-import sys
+import sys, os
 from PyQt6.QtWidgets import (
     QWidget, QPushButton,
     QMainWindow, QApplication, QMessageBox)
@@ -29,6 +29,9 @@ from lensecam.camera_thread import CameraThread
 from lensepy.pyqt6.widget_image_display import ImageDisplayWidget
 ## Camera settings Widget for IDS
 from widgets.camera import *
+## Conversion to 8 bits (lense_common, modules shared by the applications)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from lense_common.display_mapping import DisplayMapping
 
 
 def load_default_dictionary(language: str) -> bool:
@@ -62,6 +65,7 @@ class MainWindow(QMainWindow):
         self.raw_image = None
         self.displayed_image = None
         self.image_bits_depth = 8
+        self.display_mapping = DisplayMapping(self.image_bits_depth)
 
         # Initialization of the camera
         # ----------------------------
@@ -102,8 +106,8 @@ class MainWindow(QMainWindow):
         if image_array is not None:
             if self.image_bits_depth > 8:
                 self.raw_image = image_array.view(np.uint16)
-                self.displayed_image = self.raw_image >> (self.image_bits_depth-8)
-                self.displayed_image = self.displayed_image.astype(np.uint8)
+                self.display_mapping.set_bits_depth(self.image_bits_depth)
+                self.displayed_image = self.display_mapping.apply(self.raw_image)
             else:
                 self.raw_image = image_array.view(np.uint8)
                 self.displayed_image = self.raw_image
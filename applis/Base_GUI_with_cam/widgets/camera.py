@@ -399,6 +399,8 @@ class CameraInfosWidget(QWidget):
 class ImagesDisplayWidget(QWidget):
     """
     Widget to display an image.
+    Images larger than the widget are reduced by an integer box filter before
+    their conversion to QImage (the remaining ratio is applied by QPixmap.scaled).
     """
 
     def __init__(self, parent=None):
@@ -410,11 +412,16 @@ class ImagesDisplayWidget(QWidget):
         self.parent = parent
         self.width = 0
         self.height = 0
+        # Objects
+        self.image = None
+        # Downsampling buffers, for the last (image shape, display size)
+        self.display_key = None
+        self.display_factor = 1
+        self.display_sum = None
+        self.display_image = None
         # GUI Structure
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
-        # Objects
-        self.image = None
         # GUI Elements
         self.image_display = QLabel('Image to display')
         self.image_display.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -428,12 +435,34 @@ class ImagesDisplayWidget(QWidget):
         self.width = width
         self.height = height
         if self.image is not None:
-            image_to_display = self.image
-            if self.image.shape[1] > self.width or self.image.shape[0] > self.height:
-                image_to_display = resize_image_ratio(self.image, self.height-30, self.width-20)
-            qimage = array_to_qimage(image_to_display)
-            pmap = QPixmap.fromImage(qimage)
-            self.image_display.setPixmap(pmap)
+            self.set_image_from_array(self.image, aoi)
+
+    def downsample(self, image: np.ndarray, width: int, height: int) -> np.ndarray:
+        """
+        Reduce an image by the largest integer factor keeping it larger than width x height.
+        :param image: 2D uint8 image.
+        :param width: Width of the display area, in pixels.
+        :param height: Height of the display area, in pixels.
+        :return: Reduced image (buffer reused by the next calls).
+        """
+        key = (image.shape, width, height)
+        if key != self.display_key:
+            self.display_key = key
+            ratio = 1
+            if width > 0 and height > 0:
+                ratio = max(image.shape[1] / width, image.shape[0] / height)
+            self.display_factor = max(int(ratio), 1)
+            f = self.display_factor
+            shape = (image.shape[0] // f, image.shape[1] // f)
+            self.display_sum = np.empty(shape, dtype=np.uint32)
+            self.display_image = np.empty(shape, dtype=np.uint8)
+        f = self.display_factor
+        if f == 1:
+            return image
+        h, w = self.display_image.shape
+        np.sum(image[:h * f, :w * f].reshape(h, f, w, f), axis=(1, 3), dtype=np.uint32, out=self.display_sum)
+        np.floor_divide(self.display_sum, f * f, out=self.display_image, casting='unsafe')
+        return self.display_image
 
     def set_image_from_array(self, pixels: np.ndarray, aoi: bool = False) -> None:
         """
@@ -441,14 +470,9 @@ class ImagesDisplayWidget(QWidget):
         :param pixels: Array of pixels to display.
         :param aoi: If True, print 'AOI' on the image.
         """
-        self.image = np.array(pixels, dtype='uint8')
-        image_to_display = self.image.copy()
-        image_to_display = np.squeeze(image_to_display)
-
-        print(image_to_display.shape)
-
-        if self.image.shape[1] > self.width or self.image.shape[0] > self.height:
-            image_to_display = resize_image_ratio(self.image, self.height-50, self.width-50)
+        self.image = np.squeeze(np.asarray(pixels, dtype=np.uint8))
+        width, height = self.width - 50, self.height - 50
+        image_to_display = np.ascontiguousarray(self.downsample(self.image, width, height))
         qimage = array_to_qimage(image_to_display)
 
         try:
@@ -459,6 +483,9 @@ class ImagesDisplayWidget(QWidget):
                 painter.drawText(20, 20, 'AOI')
                 painter.end()
             pmap = QPixmap.fromImage(qimage)
+            if pmap.width() > width > 0 or pmap.height() > height > 0:
+                pmap = pmap.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio,
+                                   Qt.TransformationMode.SmoothTransformation)
             self.image_display.setPixmap(pmap)
         except Exception as e:
             print(f'set_image : {e}')
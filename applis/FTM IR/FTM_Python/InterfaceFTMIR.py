@@ -6,16 +6,15 @@ from PySide6.QtGui import QIcon, QPixmap
 from pyparsing import PositionToken
 import pyqtgraph as pg
 import matplotlib.pyplot as plt
-import serial
 import os
 import ctypes
 import platform
-import socket
 from math import *
 import numpy
 import scipy as sp
 import scipy.signal
 from com import *
+from scan import ScanWorker, PARCOURS
 
 class MWindow(QtWidgets.QWidget):
     """
@@ -39,6 +38,7 @@ class MWindow(QtWidgets.QWidget):
 
         self.TC = 3                     #indice du temps de coupure de la Détection synchrone
         self.SEN = 16                   #indice de la sensibilité de la detection synchrone
+        self.parcours = 'raster'        #parcours de la grille x/z (voir scan.ordre_scan)
 
         # Couleurs des graphiques
         self.couleurs = ['#FF0000', '#00FF00', '#FFFF00', '#00FFFF', # Red, Green, Yellow, Cyan-Aqua
@@ -222,6 +222,13 @@ class MWindow(QtWidgets.QWidget):
         self.nb_echantillons.setAlignment(QtCore.Qt.AlignCenter)
         self.temps_acquisition.setAlignment(QtCore.Qt.AlignCenter)
         self.temps_refresh()
+        self.parcours_drop = QtWidgets.QComboBox()
+        self.parcours_drop.addItems(['x, ligne par ligne','x, en serpentin','z, colonne par colonne','x, adaptatif (transition)'])   #Même ordre que PARCOURS
+        self.parcours_drop.setCurrentIndex(PARCOURS.index(self.parcours))
+        self.parcours_drop.currentIndexChanged.connect(self.set_parcours)  #Quand la valeur change on lance set_parcours() qui met a jour le parcours
+        self.parcours_layout = QtWidgets.QFormLayout()
+        self.parcours_layout.addRow("Parcours:", self.parcours_drop)
+        self.temps_layout.addLayout(self.parcours_layout)
         self.temps_layout.addWidget(self.nb_echantillons)
         self.temps_layout.addWidget(self.temps_acquisition)
         self.p_temps.setLayout(self.temps_layout)
@@ -231,6 +238,9 @@ class MWindow(QtWidgets.QWidget):
         self.acq_button.setCheckable(True)
         self.acq_button.clicked.connect(self.acquire_btn)
         self.stop_acq = False
+        self.fermeture = False          #fermeture de la fenêtre demandée pendant une acquisition
+        self.scan_thread = None
+        self.scan_worker = None
         self.treat_button = QtWidgets.QPushButton("Traitement")     #Bouton de traitement qui lance treat_fct
         self.treat_button.clicked.connect(self.treat_fct)
 
@@ -309,6 +319,10 @@ class MWindow(QtWidgets.QWidget):
         self.TC = i
         self.temps_refresh()
 
+    def set_parcours(self,i):
+        #Mise à jour du parcours de la grille
+        self.parcours = PARCOURS[i]
+
     def temps_refresh(self):
         #Affichage de l'estimation de temps de l'acquisition
         self.nb_echantillons.setText(str(self.zn*self.xn)+' échantillons')
@@ -327,7 +341,6 @@ class MWindow(QtWidgets.QWidget):
     
     def acquire_btn(self):
         # Fonction qui gère l'action du bouton acquisition selon son état
-        QtCore.QCoreApplication.processEvents()
         if self.acq_button.isChecked():             #On appuie sur lancer l'acquisition
             self.acq_button.setText('Arrêter')      #Le bouton sert maintenant à arreter l'acquisition jusqu'à la fin de celle-ci
             self.acquire_fct()                      #L'acquisition est lancée
@@ -335,91 +348,92 @@ class MWindow(QtWidgets.QWidget):
             self.acq_button.setEnabled(False)       #Désactiver le bouton acquisition pendant l'arrêt (anti-spam)
             self.acq_button.setText('Arrêt en cours...')
             self.stop_acq = True                    #On arrête l'acquisition de façon non brutale (reinitialisation des moteurs puis sortie de la fonction acquisition)
-        QtCore.QCoreApplication.processEvents()
+            if self.scan_worker is not None:
+                self.scan_worker.arreter()          #Pris en compte à la prochaine entrée/sortie du scan
 
     def acquire_fct(self):
-        # Fonction d'acquisition
-        QtCore.QCoreApplication.processEvents()     #Force la mise à jour de la fenêtre
-        
+        # Fonction d'acquisition : le scan est exécuté par ScanWorker dans un QThread
         # Variables de stockage de l'acquisition
-        self.M = numpy.zeros((self.zn,self.xn))
+        self.M = numpy.full((self.zn,self.xn),numpy.nan)   #NaN: point non mesuré (parcours adaptatif)
         self.Z = numpy.linspace(self.zmin,self.zmax,self.zn)
         self.X = numpy.linspace(self.xmin,self.xmax,self.xn)
 
-        # Connexion
-        self.DS = serial.Serial('COM3',9600,timeout=5,parity="E",bytesize=7,stopbits=1,write_timeout=5)
-
-        self.moteurs = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.moteurs.connect((self.HOST, self.PORT))
-
-        self.ID = CheckID(self.DS)
-        print("ID de la détection synchrone: " + str(self.ID))
-        TC_write(self.DS,self.TC)
-
-        # Acquisition
-        self.moteurs.send(b'1MO')                       #allumage du moteur 1
-        time.sleep(1.5)
-        QtCore.QCoreApplication.processEvents()
-        
-        if self.SEN<16:                                 #si la sensibilité n'est pas en Auto
-            Sen_write(self.DS,self.SEN)                 #envoie de la sensibilité à la DS
-            for i in range(len(self.Z)):
-                if (not self.session_opened) or self.stop_acq:  #si on ferme la fenêtre ou on arrête l'acquisition
-                    Extinction(self)                            #on reinitialise les moteurs
-                    return                                      #on sort de la fonction acquisition
-                zGoTo(self.moteurs,self.Z[i])           #allumage + déplacement + extinction du moteur 2
-                self.bds.setFormat("Scan " + str(i+1) + "/" + str(self.zn) + " : 0%")
-                self.bds.setValue(0)
-                for j in range(len(self.X)):
-                    if (not self.session_opened) or self.stop_acq:
-                        Extinction(self)
-                        return
-                    xGoTo(self.moteurs,self.X[j])       #déplacement du moteur 1
-                    mag = DS_read(self.DS,self.TC)      #lecture de l'amplitude du signal
-                    self.M[i,j] = mag*(1 + 2*(self.SEN%2))*10**(self.SEN//2-7)/10000    #stockage de la valeur convertie en V (avec la sensibilité)
-                    self.bdc.setValue((i*self.xn+j+1)/(self.xn*self.zn)*100)            #mise à jour de la barre de chargement
-                    self.bdc.setFormat("Progression globale de l'acquisition : " + str(round((i*self.xn+j+1)/(self.xn*self.zn)*100,1)) + "%")
-                    self.bds.setFormat("Scan " + str(i+1) + "/" + str(self.zn) + " : " + str(round((j+1)/self.xn*100)) + "%")
-                    self.bds.setValue((j+1)/self.xn*100)
-                    QtCore.QCoreApplication.processEvents()     #Force la mise à jour de la fenêtre
-                    
-        else:                                           #si la sensibilité est en Auto
-            for i in range(len(self.Z)):
-                if (not self.session_opened) or self.stop_acq:
-                    Extinction(self)
-                    return
-                self.SEN = 15                                   #On prend la pire sensibilité
-                Sen_write(self.DS,self.SEN)
-                zGoTo(self.moteurs,self.Z[i])
-                self.bds.setFormat("Scan " + str(i+1) + "/" + str(self.zn) + " : 0%")
-                self.bds.setValue(0)
-                for j in range(len(self.X)):
-                    if (not self.session_opened) or self.stop_acq:
-                        Extinction(self)
-                        return
-                    xGoTo(self.moteurs,self.X[j])
-                    mag = DS_read(self.DS,self.TC)
-                    print(mag)
-                    
-                    #Mode Auto
-                    while mag<2500 and self.SEN>0 and (self.session_opened and not self.stop_acq):              #On vérifie si on peut mieux lire avec la sensibilité supérieure (mag<2500)
-                        self.SEN -=1                                                                            #et qu'on n'est pas arrivés à la meilleure sensibilité
-                        Sen_write(self.DS, self.SEN)
-                        mag = DS_read(self.DS,self.TC)          #On lit la nouvelle valeur
-                        print(mag)
-                        QtCore.QCoreApplication.processEvents() #Force la mise à jour de la fenêtre
-                    
-                    self.M[i,j] = mag*(1 + 2*(self.SEN%2))*10**(self.SEN//2-7)/10000
-                    self.bdc.setValue((i*self.xn+j+1)/(self.xn*self.zn)*100)
-                    self.bdc.setFormat("Progression globale de l'acquisition : " + str(round((i*self.xn+j+1)/(self.xn*self.zn)*100,1)) + "%")
-                    self.bds.setFormat("Scan " + str(i+1) + "/" + str(self.zn) + " : " + str(round((j+1)/self.xn*100)) + "%")
-                    self.bds.setValue((j+1)/self.xn*100)
-                    QtCore.QCoreApplication.processEvents() #Force la mise à jour de la fenêtre
-            self.SEN = 16       #reinitialisation du mode auto
-        
-        # Déconnexion
-        ## Reinitialisation des moteurs
-        Extinction(self)
+        self.scan_thread = QtCore.QThread()
+        self.n_mesures = 0              #nombre de mesures reçues
+        self.n_ligne = 0                #nombre de mesures reçues de la ligne en cours
+        self.scan_worker = ScanWorker(self.X, self.Z, self.TC, self.SEN, self.HOST, self.PORT, parcours=self.parcours)
+        self.nb_lignes = len(self.scan_worker.lignes)     #lignes lues avant le lancement du thread, puis mises à jour par les signaux
+        self.n_total = sum(len(ligne) for ligne in self.scan_worker.lignes)
+        self.m_ligne = 0                #nombre de points de la ligne en cours
+        self.scan_worker.moveToThread(self.scan_thread)
+        self.scan_thread.started.connect(self.scan_worker.run)
+        self.scan_worker.scan_debut.connect(self.scan_debut)
+        self.scan_worker.ligne_etendue.connect(self.ligne_etendue)
+        self.scan_worker.mesure.connect(self.nouvelle_mesure)
+        self.scan_worker.fini.connect(self.fin_acquisition)
+        self.scan_worker.erreur.connect(self.erreur_acquisition)
+        self.scan_thread.finished.connect(self.scan_worker.deleteLater)     #le worker et le thread sont détruits à la fin du thread
+        self.scan_thread.finished.connect(self.scan_thread.deleteLater)
+        self.scan_thread.start()
+
+    def scan_debut(self, k, m):
+        # Nouvelle ligne du parcours (position longitudinale, ou transversale pour le parcours z) de m points
+        self.ligne = k
+        self.n_ligne = 0
+        self.m_ligne = m
+        self.bds.setFormat("Scan " + str(k+1) + "/" + str(self.nb_lignes) + " : 0%")
+        self.bds.setValue(0)
+
+    def ligne_etendue(self, k, m):
+        # Points de la transition ajoutés à la ligne k (parcours adaptatif), qui a maintenant m points
+        self.n_total += m - self.m_ligne
+        self.m_ligne = m
+
+    def nouvelle_mesure(self, i, j, valeur):
+        # Stockage d'une mesure du scan (indices de M, quel que soit le parcours) et mise à jour des barres de chargement
+        self.M[i,j] = valeur
+        self.n_mesures += 1
+        self.n_ligne += 1
+        n = self.n_total                #les lignes du parcours adaptatif sont complétées pendant le scan (ligne_etendue)
+        k = self.n_mesures
+        m = self.m_ligne
+        self.bdc.setValue(k/n*100)
+        self.bdc.setFormat("Progression globale de l'acquisition : " + str(round(k/n*100,1)) + "%")
+        self.bds.setFormat("Scan " + str(self.ligne+1) + "/" + str(self.nb_lignes) + " : " + str(round(self.n_ligne/m*100)) + "%")
+        self.bds.setValue(self.n_ligne/m*100)
+
+    def erreur_acquisition(self, message):
+        # Erreur du scan (port de la DS, connexion aux moteurs, DS sans réponse...) : le scan est arrêté
+        if self.fermeture:
+            return
+        msg = QtWidgets.QMessageBox()
+        msg.setIcon(QtWidgets.QMessageBox.Warning)
+        msg.setText("L'acquisition a été interrompue.")
+        msg.setInformativeText(message)
+        msg.setWindowTitle("Erreur")
+        msg.exec()
+
+    def fin_acquisition(self, complet, SEN):
+        # Fin du scan (complet ou arrêté) : les moteurs sont réinitialisés par le worker
+        self.scan_thread.quit()
+        self.scan_thread.wait()             #fini est émis à la fin de run : attente de la sortie du thread uniquement
+        self.scan_worker = None
+        self.scan_thread = None
+        self.stop_acq = False
+        if self.fermeture:                  #la fenêtre a été fermée pendant l'acquisition : pas de fichier
+            self.close()
+            return
+
+        self.bdc.setValue(0)                #reinitialisation de la barre de chargement
+        self.bdc.setFormat("Progression globale de l'acquisition : 0%")
+        self.bds.setValue(0)
+        self.bds.setFormat("Scan 1/  : 0%")
+        self.acq_button.setEnabled(True)
+        self.acq_button.setChecked(False)
+        self.acq_button.setText('Acquisition')
+
+        if not complet or not self.session_opened:
+            return
 
         # Création du fichier d'acquisition
         self.nom_fichier, ok = QtWidgets.QInputDialog.getText(self, 'Nom du fichier', "Entrez nom du fichier d'acquisition:", QtWidgets.QLineEdit.Normal, 'acquisition')
@@ -429,13 +443,8 @@ class MWindow(QtWidgets.QWidget):
             self.menu1_nomfichierlbl.setText(self.nom_fichier)
         self.nom_fichier = os.getcwd() + '\\Acquisitions\\' + self.nom_fichier
         if ok:
-            creer_fichier(self.M,self.Z,self.X,self.nom_fichier,self.TC,self.SEN)
+            creer_fichier(self.M,self.Z,self.X,self.nom_fichier,self.TC,SEN)
         print(self.M)
-        
-        self.bdc.setValue(0)                #reinitialisation de la barre de chargement
-        self.bdc.setFormat("Progression globale de l'acquisition : 0%")
-        self.bds.setValue(0)
-        self.bds.setFormat("Scan 1/  : 0%")
 
     def treat_fct(self):
         # Reconfiguration de l'interface
@@ -641,6 +650,10 @@ class MWindow(QtWidgets.QWidget):
         self.Position_M1 = Tableau[1:,0]
         self.Position_M2 = np.transpose(Tableau[0,1:])
         self.Valeurs_scan = Tableau[1:,1:]
+        for i in range(self.Valeurs_scan.shape[1]):                     #Points non mesurés (parcours adaptatif) : interpolation
+            mesures = ~np.isnan(self.Valeurs_scan[:,i])                 #entre les points mesurés, pour garder un pas constant
+            if not mesures.all() and mesures.any():
+                self.Valeurs_scan[:,i] = np.interp(self.Position_M1, self.Position_M1[mesures], self.Valeurs_scan[mesures,i])
 
         self.temperature = self.menu1_temperature.value() #On lit la valeur de la température
         str_temperature = str(self.temperature)
@@ -905,6 +918,14 @@ class MWindow(QtWidgets.QWidget):
     
     def closeEvent(self, event):
         # arrête l'éxecution quand la fenêtre est fermée
+        if self.scan_worker is not None:
+            #le worker réinitialise les moteurs avant de s'arrêter : la fenêtre est fermée par fin_acquisition
+            self.fermeture = True
+            self.scan_worker.arreter()
+            self.acq_button.setEnabled(False)
+            self.acq_button.setText('Arrêt en cours...')
+            event.ignore()
+            return
         self.session_opened = False
         self.close()
 
@@ -1,7 +1,24 @@
 import time
 import pandas
 import numpy as np
-from PySide6 import QtWidgets, QtCore
+
+''' Arrêt du scan '''
+
+class ScanAnnule(Exception):
+    #Levée quand l'arrêt du scan est demandé
+    pass
+
+def verifie_arret(arret):
+    #Lève ScanAnnule si l'arrêt est demandé (arret: threading.Event ou None)
+    if arret is not None and arret.is_set():
+        raise ScanAnnule()
+
+def attente(duree,arret=None):
+    #Attente interrompue par une demande d'arrêt
+    if arret is None:
+        time.sleep(duree)
+    elif arret.wait(duree):
+        raise ScanAnnule()
 
 ''' Fonctions DS '''
 
@@ -11,108 +28,162 @@ def b2int(b):
     n = int(g)
     return n
 
+# Lecture stabilisée de l'amplitude (DS_read)
+DS_TOLERANCE = 0.01         #écart relatif maximal entre deux lectures espacées d'un temps de coupure
+DS_TOLERANCE_ABS = 10       #écart absolu maximal (en unités de mag), pour les faibles signaux
+DS_LECTURES_STABLES = 2     #nombre de comparaisons successives dans la tolérance
+
+def DS_commande(ser,commande,nb_lignes=1):
+    #Envoie une commande à la DS et renvoie la dernière ligne de sa réponse
+    #Pas d'attente fixe : readline attend l'arrivée de la réponse (timeout du port série)
+    ser.reset_input_buffer()
+    ser.write((commande+'\r\n').encode())
+    reponse = b''
+    for k in range(nb_lignes):
+        reponse = ser.readline()
+        if reponse == b'':
+            raise TimeoutError('Pas de réponse de la détection synchrone à ' + commande)
+    return reponse
+
 def CheckID(ser):
     #Demande son ID à la Détection Synchrone
-    ser.write(b'id\r\n')
-    time.sleep(0.1)
-    ser.readline()
-    ID = ser.readline()
-    ser.reset_output_buffer()
-    ser.reset_input_buffer()
-    return b2int(ID)
+    return b2int(DS_commande(ser,'id',2))
 
 def Sen_read(ser):
     #Demande sa sensibilité à la DS
-    ser.write(b'sen')
-    time.sleep(0.1)
-    ser.write(b'\r\n')
-    time.sleep(0.1)
-    ser.readline()
-    SEN = ser.readline()
-    ser.reset_output_buffer()
-    ser.reset_input_buffer()
-    return b2int(SEN)
+    return b2int(DS_commande(ser,'sen',2))
 
 def Sen_write(ser,SEN):
     #Change la sensibilité de la DS
     # SEN entre 0 et 15
-    ser.write(b'sen ')
-    time.sleep(0.1)
-    v = str(SEN)+'\r\n'
-    ser.write(v.encode())
-    time.sleep(0.1)
-    ser.readline()
-    ser.reset_output_buffer()
-    ser.reset_input_buffer()
+    DS_commande(ser,'sen '+str(SEN))
 
 def TC_read(ser):
     #Demande son temps de coupure à la DS
-    ser.write(b'tc')
-    time.sleep(0.1)
-    ser.write(b'\r\n')
-    time.sleep(0.1)
-    ser.readline()
-    TC = ser.readline()
-    ser.reset_output_buffer()
-    ser.reset_input_buffer()
-    return b2int(TC)
+    return b2int(DS_commande(ser,'tc',2))
 
 def TC_write(ser,TC):
     #Change le temps de coupure de la DS
     # TC entre 0 et 13
-    ser.write(b'tc ')
-    time.sleep(0.1)
-    v = str(TC)+'\r\n'
-    ser.write(v.encode())
-    time.sleep(0.1)
-    ser.readline()
-    ser.reset_output_buffer()
-    ser.reset_input_buffer()
+    DS_commande(ser,'tc '+str(TC))
 
-def DS_read(ser,TC):
-    #Lit la valeur de l'amplitude
-    time.sleep((1 + 2*(TC%2))*10**(TC//2-2))    #Attente de 10 fois le temps de coupure
-    ser.write(b'mag')
-    time.sleep(0.1)
-    ser.write(b'\r\n')
-    time.sleep(0.1)
-    ser.readline()
-    mag = ser.readline()
-    return b2int(mag)
+def temps_coupure(TC):
+    #Temps de coupure de la DS en s (TC = 0 : 1 ms, 1 : 3 ms, 2 : 10 ms...)
+    return (1 + 2*(TC%2))*10**(TC//2-3)
+
+def DS_mag(ser):
+    #Lit la valeur actuelle de l'amplitude
+    return b2int(DS_commande(ser,'mag',2))
+
+def DS_read(ser,TC,arret=None):
+    #Lit la valeur de l'amplitude une fois stabilisée
+    #Lectures espacées d'un temps de coupure, jusqu'à DS_LECTURES_STABLES écarts successifs dans la tolérance,
+    #sans dépasser l'ancienne attente fixe (10 temps de coupure + 0.2 s)
+    tc = temps_coupure(TC)
+    fin = time.perf_counter() + 10*tc + 0.2
+    t_lecture = time.perf_counter()
+    precedent = DS_mag(ser)
+    stables = 0
+    while True:
+        reste = fin - time.perf_counter()
+        if reste <= 0:
+            return precedent
+        attente(max(min(tc - (time.perf_counter() - t_lecture), reste), 0), arret)
+        t_lecture = time.perf_counter()
+        mag = DS_mag(ser)
+        if abs(mag - precedent) <= max(DS_TOLERANCE*abs(mag), DS_TOLERANCE_ABS):
+            stables += 1
+            if stables >= DS_LECTURES_STABLES:
+                return mag
+        else:
+            stables = 0
+        precedent = mag
 
 ''' Fonctions Moteurs '''
 
-def zGoTo(client,z):
-    #Déplace le moteur longitudinal
-    client.send(b'2MO') #Allumage
-    time.sleep(1.5)
-    u = '2PA'+str(z)
-    u = u.encode()
-    client.send(u)      #Déplacement
-    time.sleep(0.1)
-    c = 0
-    while c==0:         #Attente de fin de déplacement
-        QtCore.QCoreApplication.processEvents()
-        client.send(b'2MD?')
-        p = client.recv(3)
-        c = int(p.decode())
-        time.sleep(0.1)
-    time.sleep(0.1)
-    client.send(b'2MF') #Extinction
-
-def xGoTo(client,x):
-    #Déplace le moteur transversal
-    time.sleep(0.2)
-    u = '1PA'+str(x)    #Déplacement
-    u = u.encode()
-    client.send(u)
-    c = 0
-    while c==0:         #Attente de fin de déplacement
-        QtCore.QCoreApplication.processEvents()
-        client.send(b'1MD?')
-        p = client.recv(3)
-        c = int(p.decode())
-        time.sleep(0.1)
+class Moteurs:
+    #Contrôleur des moteurs (connexion TCP/IP) : 1 = moteur transversal, 2 = moteur longitudinal
+    #Les moteurs restent allumés pendant tout le scan (extinction seulement dans Extinction).
+    #deplacer envoie la consigne sans attendre : plusieurs axes se déplacent en même temps et l'attente
+    #de fin de déplacement (attendre) est faite seulement quand la position est nécessaire.
+    #Chaque commande est suivie d'une requête MD? : deux commandes ne sont jamais fusionnées dans un même paquet.
+    DUREE_ALLUMAGE = 1.5        #attente après l'allumage d'un moteur (s)
+    PERIODE_MIN = 0.005         #période de la première interrogation MD? (s), doublée à chaque interrogation
+    PERIODE_MAX = 0.1           #période maximale d'interrogation (s)
+    FRACTION_PREVUE = 0.8       #fraction de la durée prévue du déplacement attendue sans interrogation
+
+    def __init__(self,client,axes=(1,2)):
+        self.client = client
+        self.axes = axes
+        self.allumes = set()                            #axes allumés
+        self.positions = {axe: None for axe in axes}    #dernières consignes (None: inconnue)
+        self.durees = {axe: None for axe in axes}       #durée de déplacement par unité de distance (s), mesurée
+        self.en_cours = {}                              #axe: (début du déplacement, distance)
+
+    def fini(self,axe):
+        #Demande au contrôleur si le déplacement de l'axe est terminé
+        self.client.send((str(axe)+'MD?').encode())
+        p = self.client.recv(3)
+        return int(p.decode()) != 0
+
+    def allumer(self,arret=None):
+        #Allume les moteurs éteints, une seule attente pour tous les axes
+        eteints = [axe for axe in self.axes if axe not in self.allumes]
+        for axe in eteints:
+            self.client.send((str(axe)+'MO').encode())
+            self.fini(axe)
+            self.allumes.add(axe)
+        if eteints:
+            attente(self.DUREE_ALLUMAGE,arret)
+
+    def deplacer(self,axe,position):
+        #Envoie la consigne de position sans attendre la fin du déplacement
+        self.client.send((str(axe)+'PA'+str(position)).encode())
+        precedente = self.positions[axe]
+        distance = abs(position - precedente) if precedente is not None else None
+        self.positions[axe] = position
+        if not self.fini(axe):
+            self.en_cours[axe] = (time.perf_counter(), distance)
+
+    def attendre(self,arret=None):
+        #Attend la fin des déplacements en cours
+        #Attente sans interrogation d'une partie de la durée prévue, puis interrogation de plus en plus espacée
+        debut = time.perf_counter()
+        prevue = 0
+        for axe, (t0, distance) in self.en_cours.items():
+            if distance is not None and self.durees[axe] is not None:
+                prevue = max(prevue, t0 - debut + self.FRACTION_PREVUE*distance*self.durees[axe])
+        if prevue > 0:
+            attente(prevue,arret)
+        periode = self.PERIODE_MIN
+        while self.en_cours:
+            verifie_arret(arret)
+            for axe in list(self.en_cours):
+                if self.fini(axe):
+                    t0, distance = self.en_cours.pop(axe)
+                    if distance:
+                        duree = (time.perf_counter() - t0)/distance
+                        if self.durees[axe] is None:
+                            self.durees[axe] = duree
+                        else:
+                            self.durees[axe] = (self.durees[axe] + duree)/2
+            if self.en_cours:
+                attente(periode,arret)
+                periode = min(2*periode,self.PERIODE_MAX)
+
+    def aller(self,positions,arret=None):
+        #Déplace les axes ({axe: position}) en même temps et attend la fin des déplacements
+        self.allumer(arret)
+        for axe, position in positions.items():
+            self.deplacer(axe,position)
+        self.attendre(arret)
+
+    def eteindre(self):
+        #Extinction des moteurs
+        for axe in sorted(self.allumes):
+            self.client.send((str(axe)+'MF').encode())
+            self.fini(axe)
+        self.allumes.clear()
 
 def creer_fichier(M,Z,X,nom,TC,SEN):
     #Créer le fichier de mesure (.csv)
@@ -138,20 +209,12 @@ def creer_fichier(M,Z,X,nom,TC,SEN):
     df = pandas.DataFrame(T)
     df.to_csv(nom,sep=';', header=h, index=False)   #écriture du fichier
 
-def Extinction(self):
-    xGoTo(self.moteurs,0)
-    zGoTo(self.moteurs,0)
-    self.moteurs.send(b'1MF')
-    self.DS.close()
-    self.moteurs.close()
-    
-    self.stop_acq = False
-    
-    self.bdc.setValue(0)                #reinitialisation de la barre de chargement
-    self.bdc.setFormat("Progression globale de l'acquisition : 0%")
-    self.bds.setValue(0)
-    self.bds.setFormat("Scan 1/  : 0%")
-    self.acq_button.setEnabled(True)
-    self.acq_button.setChecked(False)
-    self.acq_button.setText('Acquisition')
+def Extinction(DS,moteurs):
+    #Retour des moteurs en 0, extinction et déconnexion (la réinitialisation de l'interface est faite par MWindow.fin_acquisition)
+    #moteurs: Moteurs
+    moteurs.aller({1: 0, 2: 0})
+    moteurs.eteindre()
+    if DS is not None:
+        DS.close()
+    moteurs.client.close()
     
@@ -0,0 +1,162 @@
+import threading
+import numpy as np
+import serial
+import socket
+from PySide6 import QtCore
+from com import *
+
+''' Acquisition du scan x/z '''
+
+PARCOURS = ['raster', 'serpentin', 'z', 'adaptatif']    #parcours de la grille (voir ordre_scan)
+
+# Parcours adaptatif
+PAS_GROSSIER = 4            #le passage grossier mesure 1 point sur PAS_GROSSIER de la grille
+SEUIL_TRANSITION = 0.1      #intervalles du passage grossier dont la variation dépasse SEUIL_TRANSITION * variation maximale
+
+def ordre_scan(zn,xn,parcours='raster'):
+    #Ordre de parcours de la grille : liste des lignes, chaque ligne est une liste d'indices (i,j) de M
+    # - raster : x de xmin à xmax pour chaque z
+    # - serpentin : sens de x alterné à chaque z (pas de retour du moteur 1 en fin de ligne)
+    # - z : z de zmin à zmax pour chaque x
+    # - adaptatif : passage grossier en x pour chaque z, complété pendant le scan autour de la transition (points_transition)
+    if parcours == 'raster':
+        return [[(i,j) for j in range(xn)] for i in range(zn)]
+    if parcours == 'serpentin':
+        return [[(i,j) for j in (range(xn) if i%2 == 0 else range(xn-1,-1,-1))] for i in range(zn)]
+    if parcours == 'z':
+        return [[(i,j) for i in range(zn)] for j in range(xn)]
+    if parcours == 'adaptatif':
+        grossier = list(range(0,xn,PAS_GROSSIER))
+        if grossier[-1] != xn-1:
+            grossier.append(xn-1)
+        return [[(i,j) for j in grossier] for i in range(zn)]
+    raise ValueError('Parcours inconnu : ' + str(parcours))
+
+def points_transition(valeurs,pas=PAS_GROSSIER,seuil=SEUIL_TRANSITION):
+    #Indices j de la grille à mesurer autour de la transition du couteau
+    #valeurs: {j: mesure} du passage grossier
+    #La transition est repérée par la variation entre deux points grossiers successifs,
+    #avec un intervalle grossier de marge de chaque côté
+    J = sorted(valeurs)
+    if len(J) < 2:
+        return []
+    G = np.abs(np.diff([valeurs[j] for j in J]))
+    if G.max() <= 0:
+        return []
+    points = set()
+    for k in np.nonzero(G >= seuil*G.max())[0]:
+        points.update(range(J[max(k-1,0)], J[min(k+2,len(J)-1)]+1))
+    return sorted(points - set(J))
+
+class ScanWorker(QtCore.QObject):
+    # Scan x/z exécuté dans un QThread : l'interface n'est mise à jour que par les signaux,
+    # les entrées/sorties (DS et moteurs) ne sont jamais entrecoupées de rafraîchissements de la fenêtre.
+    # Une demande d'arrêt est prise en compte à la prochaine entrée/sortie (ScanAnnule).
+    mesure = QtCore.Signal(int, int, float)     # indices (i,j) et valeur mesurée (en V)
+    scan_debut = QtCore.Signal(int, int)        # indice de la nouvelle ligne du parcours (voir ordre_scan) et nombre de points
+    ligne_etendue = QtCore.Signal(int, int)     # indice de la ligne complétée (parcours adaptatif) et nouveau nombre de points
+    fini = QtCore.Signal(bool, int)             # True si le scan est complet, indice de sensibilité du fichier
+    erreur = QtCore.Signal(str)
+
+    def __init__(self, X, Z, TC, SEN, host, port, port_DS='COM3', parcours='raster'):
+        super().__init__()
+        self.X = X                      #positions transversales
+        self.Z = Z                      #positions longitudinales
+        self.TC = TC                    #indice du temps de coupure
+        self.SEN = SEN                  #indice de la sensibilité (16: Auto)
+        self.host = host
+        self.port = port
+        self.port_DS = port_DS
+        self.adaptatif = parcours == 'adaptatif'
+        self.lignes = ordre_scan(len(Z),len(X),parcours)   #ordre de parcours de la grille (complété pendant le scan si adaptatif)
+        self.arret = threading.Event()  #demande d'arrêt (bouton ou fermeture de la fenêtre)
+
+    def arreter(self):
+        # Demande d'arrêt, appelée depuis l'interface
+        self.arret.set()
+
+    def run(self):
+        # Connexion, scan puis extinction (même si le scan est arrêté ou échoue)
+        DS = None
+        client = None
+        moteurs = None
+        complet = False
+        try:
+            DS = serial.Serial(self.port_DS,9600,timeout=5,parity="E",bytesize=7,stopbits=1,write_timeout=5)
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect((self.host, self.port))
+            moteurs = Moteurs(client)
+
+            ID = CheckID(DS)
+            print("ID de la détection synchrone: " + str(ID))
+            TC_write(DS,self.TC)
+
+            moteurs.allumer(self.arret)         #allumage des moteurs, jusqu'à l'extinction
+            self.scan(DS, moteurs)
+            complet = True
+        except ScanAnnule:
+            print("Acquisition arrêtée")
+        except Exception as e:
+            print(e)
+            self.erreur.emit(str(e))
+        finally:
+            if moteurs is not None:
+                try:
+                    Extinction(DS, moteurs)     #reinitialisation des moteurs
+                except Exception as e:
+                    print(e)
+            #fermeture des ports même si la connexion ou l'extinction a échoué (sans effet s'ils sont déjà fermés)
+            if DS is not None:
+                DS.close()
+            if client is not None:
+                client.close()
+            self.fini.emit(complet, self.SEN)
+
+    def scan(self, DS, moteurs):
+        # Parcours de la grille x/z dans l'ordre de self.lignes, chaque mesure est envoyée à l'interface
+        # La mesure (i,j) est toujours envoyée avec ses indices : M est identique quel que soit le parcours
+        # En parcours adaptatif, les points de la transition sont ajoutés à la ligne (envoyée par ligne_etendue) puis mesurés
+        if self.SEN < 16:
+            Sen_write(DS,self.SEN)              #envoie de la sensibilité à la DS
+        self.SEN_courante = self.SEN
+        self.position = (None, None)            #indices de la position actuelle
+        for k, ligne in enumerate(self.lignes):
+            self.scan_debut.emit(k, len(ligne))
+            valeurs = {}
+            for n, (i, j) in enumerate(ligne):
+                valeurs[j] = self.mesure_point(DS, moteurs, i, j, n == 0)
+            if self.adaptatif:
+                fins = [(i, j) for j in points_transition(valeurs)]
+                ligne.extend(fins)
+                self.ligne_etendue.emit(k, len(ligne))
+                for n, (i, j) in enumerate(fins):
+                    self.mesure_point(DS, moteurs, i, j, n == 0)
+
+    def mesure_point(self, DS, moteurs, i, j, nouvelle_sensibilite):
+        # Déplacement en (Z[i],X[j]) et mesure, renvoie la valeur en V
+        # nouvelle_sensibilite: en sensibilité Auto, on repart de la pire sensibilité
+        auto = self.SEN >= 16
+        i0, j0 = self.position
+        if i != i0:
+            moteurs.deplacer(2,self.Z[i])       #déplacement du moteur 2
+        if j != j0:
+            moteurs.deplacer(1,self.X[j])       #déplacement du moteur 1, en même temps
+        self.position = (i, j)
+        if nouvelle_sensibilite and auto:
+            self.SEN_courante = 15              #On prend la pire sensibilité
+            Sen_write(DS,self.SEN_courante)
+        moteurs.attendre(self.arret)
+        SEN = self.SEN_courante
+        mag = DS_read(DS,self.TC,self.arret)    #lecture de l'amplitude du signal
+        if auto:
+            print(mag)
+            while mag<2500 and SEN>0:           #On vérifie si on peut mieux lire avec la sensibilité supérieure (mag<2500)
+                verifie_arret(self.arret)       #et qu'on n'est pas arrivés à la meilleure sensibilité
+                SEN -= 1
+                Sen_write(DS,SEN)
+                mag = DS_read(DS,self.TC,self.arret)    #On lit la nouvelle valeur
+                print(mag)
+            self.SEN_courante = SEN
+        valeur = mag*(1 + 2*(SEN%2))*10**(SEN//2-7)/10000  #valeur convertie en V (avec la sensibilité)
+        self.mesure.emit(i, j, valeur)
+        return valeur
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""*sensor_settings_test.py* file.
+
+Check the AOI set by SensorSettings for each binning value, with the simulated
+camera (models/simulation.py) : the AOI must stay inside the binned sensor.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import sys, os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from models.simulation import SimulatedCamera, SENSOR_WIDTH, SENSOR_HEIGHT
+from models.camera_settings import SensorSettings, BINNING_VALUES
+
+
+def check_aoi(camera: SimulatedCamera, binning: int, expected: tuple = None):
+    """Check that the AOI of the camera is inside the binned sensor (and equal to expected if given)."""
+    x0, y0, width, height = camera.get_aoi()
+    max_width, max_height = SENSOR_WIDTH // binning, SENSOR_HEIGHT // binning
+    assert camera.get_sensor_size() == (max_width, max_height), camera.get_sensor_size()
+    assert 0 <= x0 and x0 + width <= max_width, (binning, camera.get_aoi())
+    assert 0 <= y0 and y0 + height <= max_height, (binning, camera.get_aoi())
+    if expected is not None:
+        assert (x0, y0, width, height) == expected, (binning, camera.get_aoi(), expected)
+    print(f'Binning {binning} : AOI {x0, y0, width, height} in {max_width} x {max_height}')
+
+
+if __name__ == '__main__':
+    camera = SimulatedCamera()
+    sensor = SensorSettings(camera)
+    # Sample region, in sensor pixels
+    region = (320, 256, 512, 384)
+    for binning in BINNING_VALUES + BINNING_VALUES[::-1]:
+        sensor.apply(binning=binning, full_sensor=True)
+        check_aoi(camera, binning, (0, 0, SENSOR_WIDTH // binning, SENSOR_HEIGHT // binning))
+        sensor.apply(binning=binning, aoi=region)
+        check_aoi(camera, binning, tuple(value // binning for value in region))
+    # Binning changed with an AOI set : the AOI is kept in sensor pixels
+    sensor.apply(binning=1, aoi=region)
+    for binning in BINNING_VALUES:
+        sensor.apply(binning=binning)
+        check_aoi(camera, binning, tuple(value // binning for value in region))
+    print('SensorSettings : OK')
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""*benchmark.py* file.
+
+*benchmark* file measures the speed of the live mode (ImageLive) and of the
+z-stack acquisition (ImageAcquisition) of the OCT Lab App, with simulated
+devices (see models/simulation.py). No hardware and no display are required.
+
+For each frame size, binning and averaging count, it reports the camera frames/s,
+the OCT images/s, the displayed images/s, the latency percentiles of each stage
+and the peak RSS. The stages are measured by the StageTimings of the application
+(models/timing.py), as in the performance overlay and the timings CSV export.
+
+Usage :
+    python benchmark.py --duration 5 --binning 1,2 --averaging 1,10,50 --csv bench.csv
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import sys, os
+import argparse
+import csv
+import tempfile
+import time
+
+if '--gui' not in sys.argv:
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+# Paths of the application are relative to its directory
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
+
+from PyQt6.QtWidgets import QApplication
+from oct_lab_app import MainWindow
+from models.camera_settings import SensorSettings
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident memory of the process, in MB (None if unknown)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024**2
+    except (ImportError, AttributeError):
+        return None
+
+
+class OCTBenchmark:
+    """Run the live and acquisition modes of the application with simulated devices."""
+
+    def __init__(self, app: QApplication, fps: float, display_rate: float = 30):
+        self.app = app
+        self.fps = fps
+        self.window = MainWindow({'SimulatedDevices': '1', 'DirImages': tempfile.mkdtemp(),
+                                  'DisplayMaxRate': str(display_rate)})
+        self.window.camera.set_frame_rate(fps)
+        self.controller = self.window.controller
+        self.timings = self.window.timings
+        self.acquisition_done = False
+        original_stop = self.controller.stop_acquisition
+
+        def stop_acquisition():
+            self.acquisition_done = True
+            original_stop()
+        self.controller.stop_acquisition = stop_acquisition
+
+    def wait(self, duration: float, condition=None):
+        """Run the Qt event loop during duration seconds (or until condition() is True)."""
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            self.app.processEvents()
+            if condition is not None and condition():
+                return True
+            time.sleep(0.001)
+        return False
+
+    def stop_worker(self):
+        controller = self.controller
+        if controller.worker is not None:
+            controller.worker.stop()
+            controller.thread.quit()
+            controller.thread.wait()
+
+    def configure(self, size: tuple, binning: int, averaging: int):
+        """
+        Stop the current worker and set the camera and averaging parameters.
+        The binning is applied by SensorSettings (full sensor AOI, frame rate and
+        calibration of the setting, as in the application), then the frame rate
+        is limited to the --fps value.
+        """
+        self.stop_worker()
+        window = self.window
+        camera = window.camera
+        if window.camera_acquiring:
+            camera.stop_acquisition()
+            window.camera_acquiring = False
+        camera.sensor_width, camera.sensor_height = size
+        # New sensor size : the settings are created again
+        window.sensor = SensorSettings(camera)
+        max_frame_rate = window.sensor.apply(binning=binning, full_sensor=True)
+        camera.set_frame_rate(min(self.fps, max_frame_rate))
+        self.controller.update_calibration()
+        window.acquisition_parameters.update(nb_averaged=averaging)
+
+    def run_live(self, duration: float) -> dict:
+        """Measure the live mode during duration seconds."""
+        self.controller.start_live()
+        self.wait(0.5)      # warm-up (allocations)
+        self.timings.reset()
+        ring = self.window.frame_ring
+        first_frame = ring.frame_number
+        start = time.perf_counter()
+        self.wait(duration)
+        elapsed = time.perf_counter() - start
+        nb_oct = ring.frame_number - first_frame
+        # Each 'grab' is the averaging of nb_averaged frames
+        nb_averaged = self.window.acquisition_parameters.snapshot.nb_averaged
+        result = {
+            'frames/s': self.timings.statistics('grab')['count'] * nb_averaged / elapsed,
+            'OCT/s': nb_oct / elapsed,
+            'display/s': self.timings.statistics('qimage')['count'] / elapsed,
+        }
+        self.stop_worker()
+        return result
+
+    def run_acquisition(self, nb_steps: int, timeout: float) -> dict:
+        """Measure a z-stack acquisition of nb_steps slices."""
+        window = self.window
+        window.acquisition_parameters.update(nb_slices=nb_steps)
+        window.file_name = f'bench_{int(time.time() * 1000)}'
+        self.controller.start_live()
+        self.timings.reset()
+        self.acquisition_done = False
+        start = time.perf_counter()
+        self.controller.handle_acquisition('Start=')
+        self.wait(timeout, lambda: self.acquisition_done)
+        elapsed = time.perf_counter() - start
+        # Return of the motor and restart of the live mode (end_acquisition)
+        self.wait(timeout, lambda: self.controller.mode == 'live')
+        result = {
+            'scan time (s)': elapsed,
+            'slices/s': nb_steps / elapsed,
+        }
+        self.stop_worker()
+        return result
+
+    def stage_columns(self) -> dict:
+        columns = {}
+        for stage in self.timings.stages():
+            stats = self.timings.statistics(stage)
+            columns[f'{stage} p50 (ms)'] = stats['p50']
+            columns[f'{stage} p90 (ms)'] = stats['p90']
+            columns[f'{stage} p99 (ms)'] = stats['p99']
+        return columns
+
+    def close(self):
+        self.stop_worker()
+
+
+def parse_list(text: str, cast=int) -> list:
+    return [cast(value) for value in text.split(',') if value != '']
+
+
+def parse_size(text: str) -> tuple:
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the OCT live and acquisition loops.')
+    parser.add_argument('--duration', type=float, default=5, help='Duration of each live measurement, in s.')
+    parser.add_argument('--sizes', type=str, default='1280x1024', help='Sensor sizes, e.g. 1280x1024,640x512.')
+    parser.add_argument('--binning', type=str, default='2', help='Binning values, e.g. 1,2,4.')
+    parser.add_argument('--averaging', type=str, default='1,10', help='Numbers of averaged images.')
+    parser.add_argument('--fps', type=float, default=80, help='Frame rate of the simulated camera.')
+    parser.add_argument('--display-rate', type=float, default=30, help='Maximum refresh rate of the display, in Hz.')
+    parser.add_argument('--steps', type=int, default=10, help='Number of slices of the z-stack (0 : no acquisition).')
+    parser.add_argument('--timeout', type=float, default=300, help='Timeout of one acquisition, in s.')
+    parser.add_argument('--csv', type=str, default='', help='CSV file to write the results in.')
+    parser.add_argument('--gui', action='store_true', help='Show the main window during the benchmark.')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    benchmark = OCTBenchmark(app, args.fps, args.display_rate)
+    if args.gui:
+        benchmark.window.show()
+    results = []
+    try:
+        for size in [parse_size(text) for text in args.sizes.split(',')]:
+            for binning in parse_list(args.binning):
+                for averaging in parse_list(args.averaging):
+                    benchmark.configure(size, binning, averaging)
+                    row = {'mode': 'live', 'size': f'{size[0]}x{size[1]}', 'binning': binning,
+                           'averaging': averaging}
+                    row.update(benchmark.run_live(args.duration))
+                    row.update(benchmark.stage_columns())
+                    row['peak RSS (MB)'] = peak_rss_mb()
+                    results.append(row)
+                    print_row(row)
+                    if args.steps > 0:
+                        row = {'mode': 'acquisition', 'size': f'{size[0]}x{size[1]}', 'binning': binning,
+                               'averaging': averaging}
+                        row.update(benchmark.run_acquisition(args.steps, args.timeout))
+                        row.update(benchmark.stage_columns())
+                        row['peak RSS (MB)'] = peak_rss_mb()
+                        results.append(row)
+                        print_row(row)
+    finally:
+        benchmark.close()
+
+    if args.csv != '':
+        fields = []
+        for row in results:
+            fields += [key for key in row if key not in fields]
+        with open(args.csv, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fields, delimiter=';')
+            writer.writeheader()
+            writer.writerows(results)
+        print(f'Results written in {args.csv}')
+
+
+def print_row(row: dict):
+    """Print the results of one measurement."""
+    header = f"{row['mode']} / {row['size']} / binning {row['binning']} / averaging {row['averaging']}"
+    print(header)
+    print('-' * len(header))
+    for key, value in row.items():
+        if key in ['mode', 'size', 'binning', 'averaging']:
+            continue
+        if isinstance(value, float):
+            print(f'  {key:24s} {value:10.2f}')
+        else:
+            print(f'  {key:24s} {value}')
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@ from fontTools.merge.util import avg_int
 from models.motor_control import *
 import numpy as np
 from lensecam.basler.camera_basler import CameraBasler
+from models.frame_buffers import FrameAccumulator
+from models.phase_shifting import PhaseShiftingDemodulator
 import matplotlib.pyplot as plt
 import sys
 import time
@@ -26,6 +28,8 @@ class cameraControl(QWidget):
         print(cam_connected)
 
         self.exposure = 1500
+        self.accumulator = FrameAccumulator()
+        self.demodulator = PhaseShiftingDemodulator('2-step')
         self.piezo = Piezo()
         self.motor = Motor()
 
@@ -36,19 +40,13 @@ class cameraControl(QWidget):
         return image
 
     def avg_images(self, N):
-        images = self.cam.get_images(N)
-        return np.mean(images, axis = 0)
+        return self.accumulator.acquire(self.cam, N)
 
     def acquisition_sequence(self, step_size, V0, N):
-        images_1 = self.avg_images(N)
-        self.piezo.set_voltage_piezo(step_size + V0)
-        images_2 = self.avg_images(N)
-        self.piezo.set_zero_piezo(V0)
-        image1 = np.mean(images_1, axis=0)
-        image2 = np.mean(images_2, axis=0)
-
-        image = np.sqrt((image1 - image2)**2)
-        return image1, image2, image
+        image, _ = self.demodulator.acquire(self.piezo, self.cam, self.accumulator, V0, step_size, N)
+        self.piezo.set_zero_piezo()
+        # Outputs of the demodulator are reused at each call
+        return self.demodulator.stack[0].copy(), self.demodulator.stack[1].copy(), image.copy()
 
     def live_sequence(self, step_size = 0.6, V0 = 0):
         self.piezo.set_voltage_piezo(V0)
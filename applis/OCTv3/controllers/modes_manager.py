@@ -1,20 +1,23 @@
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 import time
 import numpy as np
-from PIL import Image
-from PyQt6.QtCore import QThread
+from PyQt6.QtCore import QThread, QTimer
+from PyQt6.QtGui import QShortcut, QKeySequence
 from PyQt6.QtWidgets import QFileDialog, QMessageBox
-from models.images_acquisition import ImageLive, ImageAcquisition
+from models.images_acquisition import ImageLive, ImageAcquisition, ImageFlyScan
+from models.volume_storage import VolumeWriter, VolumeWriterThread
+from models.motion import TOLERANCE
+from lense_common.display_mapping import DisplayMapping
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from oct_lab_app import MainWindow
 
-### Timings of the motor during acquisition phase
-TOLERANCE = 0.01 #(tolerance in position in um)
-TIMEOUT = 3 #(motor displacement timeout in s)
+# Refresh period of the performance overlay, in ms
+HUD_PERIOD = 500
 
 
 class ModesController:
@@ -32,20 +35,35 @@ class ModesController:
         self.thread = QThread()
         self.worker = None
         self.dialog = None
+        # Conversion of the images to 8 bits : fixed window for the camera images, auto-contrast for OCT
+        self.raw_mapping = DisplayMapping(self.main_app.image_bits_depth)
+        self.oct_mapping = DisplayMapping(self.main_app.image_bits_depth, auto_contrast=True)
+        # Z-stack of the current acquisition, written in a background thread
+        self.volume_writer = None
+        self.acquisition_error = None   # message of the error that stopped the last acquisition
+        self.return_error = None        # message shown when the motor is back to the first slice
 
         ### Initial values
-        self.number_samples = int(self.main_app.init_acq_step_num)
-        self.acq_stepper_step_size = float(self.main_app.init_acq_step_size) * 0.001
         self.position = float(self.main_app.stepper_init_value)
 
         # Signals management
         camera_widget = self.main_app.central_widget.mini_camera.camera_params_widget
         camera_widget.camera_exposure_changed.connect(self.handle_camera_exposure)
+        camera_widget.sensor_changed.connect(self.handle_sensor)
+        camera_widget.calibration_requested.connect(self.handle_calibration)
+        self.main_app.central_widget.image_oct_graph.roi_selected.connect(self.handle_roi)
+        if self.main_app.sensor is not None:
+            camera_widget.update_frame_rate(self.main_app.sensor.max_frame_rate)
+        self.update_calibration()
         motor_widget = self.main_app.central_widget.motors_options
         motor_widget.motor_changed.connect(self.handle_stepper_move)
         acq_widget = self.main_app.central_widget.acquisition_options
         acq_widget.filename_changed.connect(self.handle_folder)
         acq_widget.acqThread.connect(self.handle_acquisition)
+        self.main_app.motion.move_done.connect(self.update_motor_position)
+        self.main_app.motion.move_done.connect(self.handle_return_done)
+        self.main_app.motion.move_failed.connect(self.handle_return_failed)
+        self.main_app.acquisition_parameters.changed.connect(self.update_parameters)
 
         # Variables
         self.stepper_z_step = float(self.main_app.stepper_step) * 0.001
@@ -54,75 +72,134 @@ class ModesController:
         new_position = np.round(self.main_app.step_motor.get_position(), 3)
         motors.changeZ(new_position)
 
+        # Display of the latest published frame, at display_max_rate at most
+        self.display_timer = QTimer()
+        self.display_timer.setInterval(int(1000 / self.main_app.display_max_rate))
+        self.display_timer.timeout.connect(self.update_display)
+        self.display_timer.start()
+
+        # Performance overlay (F3 to show / hide), refreshed every HUD_PERIOD ms
+        self.hud_timer = QTimer()
+        self.hud_timer.setInterval(HUD_PERIOD)
+        self.hud_timer.timeout.connect(self.update_performance_hud)
+        self.hud_shortcut = QShortcut(QKeySequence('F3'), self.main_app)
+        self.hud_shortcut.activated.connect(self.toggle_performance_hud)
+        if self.main_app.performance_hud:
+            self.toggle_performance_hud()
+
         # Start first mode : Live
         self.mode = 'live'
         self.start_live()
 
 
     def start_live(self):
-        self.worker = ImageLive(self.main_app)
+        self.worker = ImageLive(self.main_app, self.main_app.acquisition_parameters.snapshot)
         self.worker.moveToThread(self.thread)
 
         # Connexions
         self.thread.started.connect(self.worker.run)
-        self.worker.images_ready.connect(self.display_live_images)
+        self.worker.exposure_changed.connect(self.update_exposure)
         self.worker.finished.connect(self.thread.quit)
         self.thread.start()
 
 
     def start_acquisition(self):
-        self.worker = ImageAcquisition(self.main_app)
-        self.worker.moveToThread(self.thread)
-
         # Motor displacement
         self.position = self.main_app.step_motor.get_position()
         self.moderate_interactions(False)
 
+        parameters = self.main_app.acquisition_parameters.snapshot
+        if parameters.mode == 'fly':
+            self.worker = ImageFlyScan(self.main_app, self.position, parameters, self.volume_writer)
+        else:
+            self.worker = ImageAcquisition(self.main_app, self.position, parameters, self.volume_writer)
+        self.worker.moveToThread(self.thread)
+        self.acquisition_error = None
+
         # Connexions
         self.thread.started.connect(self.worker.run)
-        self.worker.images_ready.connect(self.store_acquisition_images)
+        self.worker.error.connect(self.handle_acquisition_error)
         self.worker.finished.connect(self.stop_acquisition)
         self.thread.start()
 
     def stop_acquisition(self):
+        """
+        End of the acquisition (last slice, error or Stop button) : the volume is closed
+        and the motor returns to the first slice, without waiting in the GUI thread.
+        The live mode is restarted at the end of the move (end_acquisition).
+        """
+        if self.mode != 'acq':
+            # Already ended by the Stop button, before the finished signal of the worker
+            return
         acquisition = self.main_app.central_widget.acquisition_options
         self.worker.stop()
         self.thread.quit()
         self.thread.wait()
 
-        z0 = self.position
-        self.main_app.acquisition_update(z0, TOLERANCE, TIMEOUT)
+        self.return_error = self.close_volume() or self.acquisition_error
+        # Last slice of the acquisition
+        self.store_acquisition_images()
+        self.mode = 'return'
+        acquisition.set_stop_enabled(False)
+        self.main_app.motion.move_to(self.position, TOLERANCE)
+
+    def handle_return_done(self, result):
+        """Action performed when a move of the motor is finished : end of the return to the first slice."""
+        if self.mode == 'return' and result.target == self.position:
+            self.end_acquisition()
+
+    def handle_return_failed(self, message: str):
+        """Action performed when a move of the motor failed : the return to the first slice is abandoned."""
+        if self.mode == 'return':
+            print(f'Acquisition / return to {self.position} mm : {message}')
+            self.end_acquisition()
+
+    def end_acquisition(self):
+        """Restart the live mode and the interactions, then report the error of the acquisition."""
+        acquisition = self.main_app.central_widget.acquisition_options
+        self.mode = 'live'
         acquisition.set_start_enabled(True)
         acquisition.set_stop_enabled(False)
 
         self.moderate_interactions(True)
 
         self.start_live()
+        error, self.return_error = self.return_error, None
+        if error is not None:
+            QMessageBox.warning(self.main_app, "Acquisition", f"The acquisition is incomplete.\n\n{error}")
+
+    def handle_acquisition_error(self, message: str):
+        """Action performed when the acquisition worker stops on an error (reported by stop_acquisition)."""
+        print(f'Acquisition / {message}')
+        self.acquisition_error = message
+
+    def update_display(self):
+        """
+        Display the latest frame of the frame ring (display timer).
+        Frames published between two ticks are dropped by the ring.
+        """
+        if self.mode == 'acq':
+            self.store_acquisition_images()
+        else:
+            self.display_live_images()
 
     def store_acquisition_images(self):
-        """Store and display images."""
-        self.display_live_images()
-        z0 = self.position
-        z_step = self.acq_stepper_step_size
-        image_number = self.worker.number_of_samples
-        print(f'Acq N-{image_number}')
-        # Store images in
-        image_float64 = self.main_app.image_oct.astype(np.uint16)
-        img = Image.fromarray(image_float64 * 16)
-        dir_name = self.main_app.dir_images+'/'+self.main_app.file_name+'/'
-        name = dir_name+self.main_app.file_name+f'_{image_number}.tiff'
-        img.save(name)
-        # Move motor to new position
-        self.main_app.acquisition_update(z0 + image_number * z_step, TOLERANCE, TIMEOUT)
+        """Display images and the progression of the acquisition (slices are stored by the worker)."""
+        ring = self.main_app.frame_ring
+        slot = ring.read_latest()
+        if slot is None:
+            return
+        self.display_slot(slot)
+        image_number = slot.sample_number
+        print(f'Acq N-{image_number} / z = {slot.z} mm / motor wait = {slot.motor_wait*1000:.1f} ms')
+        ring.release(slot)
+        writer = self.volume_writer
+        if writer is not None:
+            self.main_app.central_widget.acquisition_options.update_writer_status(
+                writer.queue_depth, writer.max_queue, writer.throughput)
 
         # Update Progression bar !
-        nb_images_text = self.main_app.central_widget.acquisition_options.step_num.text()
-        try:
-            nb_images = int(nb_images_text)
-        except Exception as e:
-            print(e)
-            nb_images = 1
-
+        nb_images = self.main_app.acquisition_parameters.snapshot.nb_slices
         progress = image_number/nb_images
         if 1 >= progress >= 0:
             self.main_app.central_widget.acquisition_options.update_progress_bar(progress)
@@ -131,19 +208,53 @@ class ModesController:
         else:
             self.main_app.central_widget.acquisition_options.update_progress_bar(1.)
 
-    def convertTo_uint8(self, image):
-        type = image.dtype
-        if type == "uint8":
-            return image
-        if type == "float16":
-            image_float32 = image.astype(np.float32)
-        elif type == "float32":
-            image_float32 = image
-        elif type == "float64":
-            image_float32 = image.astype(np.float32)
-        image_normalized = image_float32/16 # - np.min(image_float32)) / (np.max(image_float32) - np.min(image_float32) + 1e-8)
-        image_uint8 = image_normalized.astype(np.uint8) # (image_normalized * 255).astype(np.uint8)
-        return image_uint8
+    def open_volume(self, dir_name: str, file_name: str):
+        """
+        Create the volume file of a new z-stack acquisition.
+        :param dir_name: Directory of the acquisition.
+        :param file_name: Name of the acquisition.
+        """
+        snapshot = self.main_app.acquisition_parameters.snapshot
+        parameters = snapshot.as_dict()
+        parameters['z0'] = self.main_app.step_motor.get_position()
+        parameters['date'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        volume = VolumeWriter(os.path.join(dir_name, file_name), snapshot.nb_slices, parameters)
+        self.volume_writer = VolumeWriterThread(volume, timings=self.main_app.timings)
+        self.volume_writer.start()
+
+    def close_volume(self) -> str:
+        """
+        Write the remaining slices of the current volume on the disk.
+        :return: Error message of the volume writer, None if all the slices are written.
+        """
+        writer = self.volume_writer
+        if writer is None:
+            return None
+        self.volume_writer = None
+        writer.stop()
+        self.main_app.central_widget.acquisition_options.update_writer_status(
+            writer.queue_depth, writer.max_queue, writer.throughput)
+        if writer.error is not None:
+            print(f'Volume NOT saved : {writer.writer.data_path} ({writer.nb_written} slices) / {writer.error}')
+            return f'Volume writer : {writer.error} ({writer.nb_written} slices written)'
+        print(f'Volume saved : {writer.writer.data_path} ({writer.nb_written} slices)')
+        return None
+
+    def display_slot(self, slot):
+        """
+        Display the images of a slot of the frame ring, owned by the GUI thread.
+        :param slot: Slot obtained by frame_ring.read_latest().
+        """
+        image_view = self.main_app.central_widget
+        timings = self.main_app.timings
+        with timings.measure('uint8'):
+            self.raw_mapping.apply(slot.image1, out=slot.display1)
+            self.raw_mapping.apply(slot.image2, out=slot.display2)
+            self.oct_mapping.apply(slot.image_oct, out=slot.display_oct)
+        with timings.measure('qimage'):
+            image_view.image1_widget.set_image_from_array(slot.display1, 'Image 1')
+            image_view.image2_widget.set_image_from_array(slot.display2, 'Image 2')
+            image_view.image_oct_graph.set_image_from_array(slot.display_oct, 'OCT')
 
     def display_live_images(self):
         """
@@ -152,18 +263,32 @@ class ModesController:
         image_view = self.main_app.central_widget
         piezo = self.main_app.piezo
         if piezo is not None and self.main_app.camera_connected:
-            self.main_app.image1 = self.convertTo_uint8(self.main_app.image1)
-            self.main_app.image2 = self.convertTo_uint8(self.main_app.image2)
-
-            image_view.image1_widget.set_image_from_array(self.main_app.image1, 'Image 1')
-            image_view.image2_widget.set_image_from_array(self.main_app.image2, 'Image 2')
-            image_view.image_oct_graph.set_image_from_array(self.convertTo_uint8(self.main_app.image_oct), 'OCT')
+            ring = self.main_app.frame_ring
+            slot = ring.read_latest()
+            if slot is None:
+                return
+            self.display_slot(slot)
+            ring.release(slot)
         else:
             black = np.random.normal(size=(100, 100))
             image_view.image1_widget.set_image_from_array(black, "No Piezo or camera")
             image_view.image2_widget.set_image_from_array(black, "No Piezo or camera")
             image_view.image_oct_graph.set_image_from_array(black, "No Piezo or camera")
 
+    def toggle_performance_hud(self):
+        """Show or hide the performance overlay."""
+        visible = not self.hud_timer.isActive()
+        if visible:
+            self.hud_timer.start()
+            self.update_performance_hud()
+        else:
+            self.hud_timer.stop()
+        self.main_app.central_widget.show_performance_hud(visible)
+
+    def update_performance_hud(self):
+        """Display the rolling statistics of the pipeline stages in the overlay."""
+        self.main_app.central_widget.set_performance_hud(self.main_app.timings.summary())
+
     def handle_camera_exposure(self, event):
         """Action performed when camera exposure time slider changed."""
         source_event = event.split("=")
@@ -171,35 +296,142 @@ class ModesController:
         message = source_event[1]
         if source == "int":
             self.main_app.camera.set_exposure(int(message))
+            self.main_app.acquisition_parameters.update(exposure=message)
+            if self.main_app.sensor is not None:
+                frame_rate = self.main_app.sensor.update_frame_rate()
+                self.main_app.central_widget.mini_camera.camera_params_widget.update_frame_rate(frame_rate)
+            self.update_calibration()
         if source == "num":
-            self.worker.stop()
-            time.sleep(0.1)
-            self.thread.quit()
-            self.thread.wait()
-            self.main_app.number_avgd_images = int(message)
-            self.start_live()
+            # The live worker uses the new value from its next images (update_parameters)
+            self.main_app.acquisition_parameters.update(nb_averaged=message)
+        if source == "auto":
+            self.main_app.acquisition_parameters.update(auto_exposure=(message == "1"))
+
+    def update_exposure(self, exposure: float):
+        """Action performed when the auto-exposure of the live worker changed the exposure time."""
+        camera_widget = self.main_app.central_widget.mini_camera.camera_params_widget
+        camera_widget.set_exposure(exposure)
+        self.main_app.acquisition_parameters.update(exposure=exposure)
+        if self.main_app.sensor is not None:
+            camera_widget.update_frame_rate(self.main_app.sensor.update_frame_rate())
+        self.update_calibration()
+
+    def handle_sensor(self, event):
+        """Action performed when the binning or the AOI of the sensor is changed."""
+        source, message = event.split("=")
+        if source == "binning":
+            self.configure_sensor(binning=int(message))
+        elif source == "aoi" and message == "select":
+            # The AOI is dragged on the OCT image (handle_roi)
+            self.main_app.central_widget.image_oct_graph.set_roi_selection(True)
+        elif source == "aoi" and message == "reset":
+            self.configure_sensor(full_sensor=True)
+
+    def handle_roi(self, rect):
+        """Action performed when a region is dragged on the OCT image : new AOI of the sensor."""
+        if self.main_app.sensor is not None:
+            self.configure_sensor(aoi=self.main_app.sensor.image_to_sensor(*rect))
+
+    def configure_sensor(self, **settings):
+        """
+        Apply new sensor settings (see SensorSettings.apply).
+        The camera cannot change its binning or its AOI while acquiring :
+        the live worker and the acquisition of the camera are restarted.
+        """
+        sensor = self.main_app.sensor
+        if sensor is None or self.mode != 'live':
+            return
+        self.worker.stop()
+        self.thread.quit()
+        self.thread.wait()
+        camera = self.main_app.camera
+        if self.main_app.camera_acquiring:
+            camera.stop_acquisition()
+            self.main_app.camera_acquiring = False
+        try:
+            frame_rate = sensor.apply(**settings)
+            self.main_app.central_widget.mini_camera.camera_params_widget.update_frame_rate(frame_rate)
+            print(f'Sensor : binning {sensor.binning}, AOI {sensor.aoi}, {frame_rate:.1f} fps')
+        except Exception as e:
+            print(f'Sensor settings / {e}')
+        self.update_calibration()
+        self.start_live()
+
+    def handle_calibration(self, kind):
+        """
+        Capture a calibration image of the current camera setting.
+        :param kind: 'dark' (no light) or 'flat' (reference arm only).
+        """
+        cache = self.main_app.calibration_cache
+        sensor = self.main_app.sensor
+        if cache is None or sensor is None or self.mode != 'live':
+            return
+        if kind == 'dark':
+            text = "Block the light source, then click OK."
+        else:
+            text = "Block the sample arm (reference arm only), then click OK."
+        reply = QMessageBox.information(self.main_app, "Calibration", text,
+                                        QMessageBox.StandardButton.Ok | QMessageBox.StandardButton.Cancel)
+        if reply != QMessageBox.StandardButton.Ok:
+            return
+        self.worker.stop()
+        self.thread.quit()
+        self.thread.wait()
+        camera = self.main_app.camera
+        if not self.main_app.camera_acquiring:
+            camera.alloc_memory()
+            camera.start_acquisition()
+            self.main_app.camera_acquiring = True
+        try:
+            exposure = self.main_app.acquisition_parameters.snapshot.exposure
+            path = cache.capture(kind, camera, sensor.binning, sensor.aoi, exposure)
+            print(f'Calibration saved : {path}')
+        except Exception as e:
+            print(f'Calibration / {e}')
+        self.update_calibration()
+        self.start_live()
+
+    def update_calibration(self):
+        """Select the calibration of the current camera setting (binning, AOI and exposure time)."""
+        cache = self.main_app.calibration_cache
+        sensor = self.main_app.sensor
+        if cache is None or sensor is None:
+            return
+        exposure = self.main_app.acquisition_parameters.snapshot.exposure
+        self.main_app.calibration = cache.get(sensor.binning, sensor.aoi, exposure)
+        if self.main_app.calibration is None:
+            text = "none"
+        else:
+            text = ", ".join(kind for kind, image in [('dark', self.main_app.calibration.dark),
+                                                      ('flat', self.main_app.calibration.gain)] if image is not None)
+        self.main_app.central_widget.mini_camera.camera_params_widget.update_calibration(text)
+
+    def update_parameters(self, parameters):
+        """Send new acquisition parameters to the live worker (a z-stack keeps its parameters)."""
+        if self.mode == 'live' and self.worker is not None:
+            self.worker.set_parameters(parameters)
 
     def handle_stepper_move(self, event):
         """Action performed when Up or Down button is clicked."""
-        motors = self.main_app.central_widget.motors_options
         source_event = event.split("=")
         source = source_event[0]
         message = source_event[1]
         if source == "stepz":
             self.stepper_z_step = float(message) * 0.001
         elif source == "up":
-            self.main_app.step_motor.set_motor_displacement(1, self.stepper_z_step)
-            new_position = np.round(self.main_app.step_motor.get_position(), 3)
-            motors.changeZ(new_position)
-            # Update widget ?
+            # The Z position is updated when the move is done (update_motor_position)
+            self.main_app.motion.move_to(self.main_app.step_motor.get_position() + self.stepper_z_step)
         elif source == "down":
-            self.main_app.step_motor.set_motor_displacement(0, self.stepper_z_step)
-            new_position = np.round(self.main_app.step_motor.get_position(), 3)
-            motors.changeZ(new_position)
+            self.main_app.motion.move_to(self.main_app.step_motor.get_position() - self.stepper_z_step)
         elif source == "deltaV":
-            self.v_step = float(message)
+            self.main_app.acquisition_parameters.update(piezo_dv=message)
         elif source == "V0":
-            self.main_app.piezo_V0 = int(message)
+            self.main_app.acquisition_parameters.update(piezo_v0=message)
+
+    def update_motor_position(self, result):
+        """Action performed when a move of the step motor is done."""
+        motors = self.main_app.central_widget.motors_options
+        motors.changeZ(np.round(result.position, 3))
 
     def handle_folder(self, event):
         """Action performed when Up or Down button is clicked."""
@@ -246,11 +478,13 @@ class ModesController:
         source_event = event.split("=")
         source = source_event[0]
         message = source_event[1]
-        # Stop all threads
-        self.worker.stop()
-        time.sleep(0.1)
-        self.thread.quit()
-        self.thread.wait()
+        parameters = self.main_app.acquisition_parameters
+        if source in ['Start', 'Stop']:
+            # Stop all threads
+            self.worker.stop()
+            time.sleep(0.1)
+            self.thread.quit()
+            self.thread.wait()
         # Restart in the good mode
         if source == 'Start':
             dir_images = self.main_app.dir_images
@@ -271,25 +505,21 @@ class ModesController:
                 self.start_live()
                 return
             self.mode = 'acq'
-            self.worker.images_ready.disconnect(self.display_live_images)
             print('Start Acq')
             acquisition.set_start_enabled(False)
             acquisition.set_stop_enabled(True)
             self.main_app.stepper_init_value = self.main_app.step_motor.get_position()
+            self.open_volume(dir_images+'/'+file_name, file_name)
             self.start_acquisition()
         elif source == 'Stop':
-            self.mode = 'live'
-            self.worker.images_ready.disconnect(self.store_acquisition_images)
             print('Stop Acq')
-            acquisition.set_start_enabled(True)
-            acquisition.set_stop_enabled(False)
-            self.start_live()
+            self.stop_acquisition()
         elif source == "StepNum":
-            self.number_samples = int(message)
-            print(event)
-            self.start_live()
+            parameters.update(nb_slices=message)
+        elif source == "Mode":
+            parameters.update(mode=message)
         elif source == "StepSize":
-            self.acq_stepper_step_size = float(message) * 0.001
-            print(self.main_app.stepper_step)
-            print(event)
-            self.start_live()
+            try:
+                parameters.update(z_step=float(message) * 0.001)
+            except ValueError as e:
+                print(f'Acquisition parameters / {e}')
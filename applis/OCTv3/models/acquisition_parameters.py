@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""*acquisition_parameters.py* file.
+
+./models/acquisition_parameters.py contains AcquisitionParameters class, an
+immutable snapshot of the parameters of the acquisition (averaging, z-stack,
+piezo, exposure), and AcquisitionParametersModel class, owned by the GUI
+thread, which replaces the snapshot and emits a signal when a parameter changes.
+
+The workers never read the widgets : they receive a snapshot when they are
+created, and a new one (set_parameters) when a parameter changes.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+from PyQt6.QtCore import QObject, pyqtSignal
+from models.phase_shifting import PHASE_ALGORITHMS
+
+# Scan modes of a z-stack acquisition
+ACQUISITION_MODES = ['step', 'fly']
+
+
+class AcquisitionParameters:
+    """
+    Immutable snapshot of the acquisition parameters.
+    Values are converted and checked when the snapshot is created ;
+    use replace() to get a snapshot with other values.
+    """
+    __slots__ = ('nb_averaged', 'nb_slices', 'z_step', 'piezo_v0', 'piezo_dv', 'exposure',
+                 'auto_exposure', 'phase_algorithm', 'mode')
+
+    def __init__(self, nb_averaged: int = 1, nb_slices: int = 1, z_step: float = 0.0005,
+                 piezo_v0: float = 0.0, piezo_dv: float = 0.0, exposure: float = None,
+                 auto_exposure: bool = False, phase_algorithm: str = '2-step', mode: str = 'step'):
+        """
+        Default constructor.
+        :param nb_averaged: Number of averaged frames per phase-shifted image.
+        :param nb_slices: Number of slices of a z-stack.
+        :param z_step: Distance between two slices, in mm.
+        :param piezo_v0: Offset voltage of the piezo, in V.
+        :param piezo_dv: Voltage step of the piezo between two phase-shifted images, in V.
+        :param exposure: Exposure time of the camera, in us (None : unknown).
+        :param auto_exposure: If True, the live worker adjusts the exposure time (AutoExposure).
+        :param phase_algorithm: Name of the phase-shifting algorithm, key of PHASE_ALGORITHMS.
+        :param mode: Scan mode of a z-stack ('step' : stop and go, 'fly' : fly-scan).
+        :raise ValueError: If a value is not valid.
+        """
+        values = {
+            'nb_averaged': int(nb_averaged),
+            'nb_slices': int(nb_slices),
+            'z_step': float(z_step),
+            'piezo_v0': float(piezo_v0),
+            'piezo_dv': float(piezo_dv),
+            'exposure': float(exposure) if exposure is not None else None,
+            'auto_exposure': bool(auto_exposure),
+            'phase_algorithm': str(phase_algorithm),
+            'mode': str(mode),
+        }
+        if values['nb_averaged'] < 1:
+            raise ValueError(f'Number of averaged images must be at least 1 ({nb_averaged})')
+        if values['nb_slices'] < 1:
+            raise ValueError(f'Number of slices must be at least 1 ({nb_slices})')
+        if values['z_step'] <= 0:
+            raise ValueError(f'Step size must be positive ({z_step})')
+        if values['phase_algorithm'] not in PHASE_ALGORITHMS:
+            raise ValueError(f'Unknown phase-shifting algorithm {phase_algorithm}')
+        if values['mode'] not in ACQUISITION_MODES:
+            raise ValueError(f'Unknown acquisition mode {mode}')
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('AcquisitionParameters is immutable : use replace()')
+
+    def replace(self, **changes) -> "AcquisitionParameters":
+        """
+        Return a new snapshot with some values changed.
+        :param changes: New values (same names as the constructor parameters).
+        :raise ValueError: If a value is not valid.
+        """
+        values = self.as_dict()
+        for name in changes:
+            if name not in values:
+                raise ValueError(f'Unknown acquisition parameter {name}')
+        values.update(changes)
+        return AcquisitionParameters(**values)
+
+    def as_dict(self) -> dict:
+        """Return the parameters as a dictionary (sidecar file of a volume)."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return isinstance(other, AcquisitionParameters) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={value!r}' for name, value in self.as_dict().items())
+        return f'AcquisitionParameters({values})'
+
+
+class AcquisitionParametersModel(QObject):
+    """
+    Current acquisition parameters, updated by the GUI thread.
+
+    Each update replaces the snapshot (a single reference assignment, so
+    a worker always sees a complete snapshot) and emits changed.
+    """
+    changed = pyqtSignal(object)    # AcquisitionParameters
+
+    def __init__(self, parameters: AcquisitionParameters):
+        """
+        Default constructor.
+        :param parameters: Initial parameters.
+        """
+        super().__init__()
+        self._snapshot = parameters
+
+    @property
+    def snapshot(self) -> AcquisitionParameters:
+        """Current parameters."""
+        return self._snapshot
+
+    def update(self, **changes) -> bool:
+        """
+        Change some parameters. changed is emitted only if a value is different.
+        :param changes: New values (see AcquisitionParameters).
+        :return: False if a value is not valid (the parameters are not changed).
+        """
+        try:
+            snapshot = self._snapshot.replace(**changes)
+        except (ValueError, TypeError) as e:
+            print(f'Acquisition parameters / {e}')
+            return False
+        if snapshot != self._snapshot:
+            self._snapshot = snapshot
+            self.changed.emit(snapshot)
+        return True
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""*auto_exposure.py* file.
+
+./models/auto_exposure.py contains AutoExposure class, a histogram-driven
+exposure controller : the exposure time is adjusted so that a percentile of
+the frames reaches a target gray level, just under saturation.
+
+Keeping the interferometric signal close to saturation maximizes the SNR of
+each frame, so fewer frames have to be averaged.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import time
+import numpy as np
+
+# Percentile of the histogram driven to the target level
+AUTO_EXPOSURE_PERCENTILE = 99.5
+# Target level of the percentile, as a fraction of the maximum gray level
+AUTO_EXPOSURE_TARGET = 0.85
+# Damping of the correction : exposure *= (target / level) ** AUTO_EXPOSURE_DAMPING
+AUTO_EXPOSURE_DAMPING = 0.5
+# Relative corrections smaller than AUTO_EXPOSURE_DEADBAND are not applied
+AUTO_EXPOSURE_DEADBAND = 0.03
+# Minimum time between two writes of the exposure time in the camera, in s
+AUTO_EXPOSURE_INTERVAL = 0.25
+# Correction applied when the percentile is saturated (the true level is unknown)
+SATURATION_CORRECTION = 0.5
+# The histogram is computed on 1 pixel out of AUTO_EXPOSURE_DECIMATION in each direction
+AUTO_EXPOSURE_DECIMATION = 8
+
+
+class AutoExposure:
+    """
+    Exposure controller driven by the histogram of the frames.
+
+    update() computes the histogram of a decimated frame and returns a new
+    exposure time when a correction is needed, at most once every
+    interval seconds, so the camera is not written at the frame rate.
+    """
+
+    def __init__(self, min_exposure: float, max_exposure: float, bits_depth: int = 12,
+                 percentile: float = AUTO_EXPOSURE_PERCENTILE, target: float = AUTO_EXPOSURE_TARGET,
+                 damping: float = AUTO_EXPOSURE_DAMPING, interval: float = AUTO_EXPOSURE_INTERVAL):
+        """
+        Default constructor.
+        :param min_exposure: Minimum exposure time, in us.
+        :param max_exposure: Maximum exposure time, in us.
+        :param bits_depth: Bits depth of the frames.
+        :param percentile: Percentile of the histogram driven to the target level.
+        :param target: Target level, as a fraction of the maximum gray level.
+        :param damping: Exponent of the correction (1 : full correction in one step).
+        :param interval: Minimum time between two corrections, in s.
+        """
+        self.min_exposure = float(min_exposure)
+        self.max_exposure = float(max_exposure)
+        self.max_level = 2 ** bits_depth - 1
+        self.percentile = percentile
+        self.target = target
+        self.damping = damping
+        self.interval = interval
+        self.level = None
+        self._last_update = 0.0
+
+    def measure(self, frame: np.ndarray) -> int:
+        """
+        Return the gray level of the percentile of a decimated frame.
+        :param frame: Camera frame (integer gray levels).
+        """
+        sample = np.squeeze(frame)[::AUTO_EXPOSURE_DECIMATION, ::AUTO_EXPOSURE_DECIMATION]
+        sample = np.clip(sample, 0, self.max_level).astype(np.intp).ravel()
+        if sample.size == 0:
+            return 0
+        cumulative = np.cumsum(np.bincount(sample, minlength=self.max_level + 1))
+        return int(np.searchsorted(cumulative, cumulative[-1] * self.percentile / 100))
+
+    def update(self, frame: np.ndarray, exposure: float) -> float:
+        """
+        Compute the correction of the exposure time from a frame.
+        :param frame: Last camera frame.
+        :param exposure: Current exposure time, in us.
+        :return: New exposure time, in us, or None if the camera must not be changed.
+        """
+        now = time.perf_counter()
+        if now - self._last_update < self.interval:
+            return None
+        self.level = self.measure(frame)
+        if self.level >= self.max_level:
+            correction = SATURATION_CORRECTION
+        else:
+            correction = (self.target * self.max_level / max(self.level, 1)) ** self.damping
+        new_exposure = float(np.clip(exposure * correction, self.min_exposure, self.max_exposure))
+        if abs(new_exposure - exposure) <= AUTO_EXPOSURE_DEADBAND * exposure:
+            return None
+        self._last_update = now
+        return new_exposure
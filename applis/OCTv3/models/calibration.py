@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""*calibration.py* file.
+
+./models/calibration.py contains FrameCalibration class to correct the
+averaged camera frames (dark frame and flat-field gain), and CalibrationCache
+class to capture the calibration frames and store them on the disk.
+
+Calibration files are .npy float32 images, one per camera, binning, AOI,
+exposure time and kind ('dark' or 'gain') :
+    <serial>_bin<binning>_aoi<x0>-<y0>-<width>-<height>_exp<exposure>_<kind>.npy
+They are loaded in memory the first time they are used, so no file stays
+open and a calibration can be captured again while the previous one is in use.
+
+Correction of an averaged frame : (frame - dark) * gain, with
+gain = mean(flat - dark) / (flat - dark), flat being the mean of frames of
+the reference arm only.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import os
+import re
+import numpy as np
+from models.frame_buffers import FrameAccumulator
+
+# Number of averaged frames of a calibration image
+CALIBRATION_FRAMES = 32
+# A calibration is used for exposure times within EXPOSURE_TOLERANCE (relative) of its exposure time
+EXPOSURE_TOLERANCE = 0.1
+# Pixels of the flat-field whose signal is below GAIN_MIN_SIGNAL (fraction of the mean) are not corrected
+GAIN_MIN_SIGNAL = 0.05
+CALIBRATION_KINDS = ['dark', 'gain']
+_FILE_PATTERN = re.compile(r'^(?P<key>.+)_exp(?P<exposure>\d+)_(?P<kind>dark|gain)\.npy$')
+
+
+class FrameCalibration:
+    """Dark frame and flat-field gain of a camera setting, applied in place to averaged frames."""
+
+    def __init__(self, dark: np.ndarray = None, gain: np.ndarray = None):
+        """
+        Default constructor.
+        :param dark: Dark frame, subtracted from the frames (None : no dark correction).
+        :param gain: Flat-field gain, multiplying the frames (None : no flat-field correction).
+        """
+        self.dark = dark
+        self.gain = gain
+
+    def apply(self, image: np.ndarray) -> bool:
+        """
+        Correct an image in place.
+        :param image: float32 image (averaged frame).
+        :return: False if the shape of the calibration is not the shape of the image.
+        """
+        for calibration in [self.dark, self.gain]:
+            if calibration is not None and calibration.shape != image.shape:
+                return False
+        if self.dark is not None:
+            np.subtract(image, self.dark, out=image)
+        if self.gain is not None:
+            np.multiply(image, self.gain, out=image)
+        return True
+
+    def __repr__(self):
+        kinds = [kind for kind, image in zip(CALIBRATION_KINDS, [self.dark, self.gain]) if image is not None]
+        return f'FrameCalibration({", ".join(kinds)})'
+
+
+def compute_gain(flat: np.ndarray, dark: np.ndarray = None) -> np.ndarray:
+    """
+    Compute the flat-field gain from the mean of reference-arm-only frames.
+    :param flat: Averaged frame of the reference arm only.
+    :param dark: Dark frame of the same setting (None : no dark).
+    :return: float32 gain, normalized to a mean of 1.
+    """
+    signal = np.array(flat, dtype=np.float32)
+    if dark is not None:
+        signal -= dark
+    mean = float(signal.mean())
+    valid = signal > GAIN_MIN_SIGNAL * mean
+    gain = np.ones(signal.shape, dtype=np.float32)
+    np.divide(mean, signal, out=gain, where=valid)
+    return gain
+
+
+class CalibrationCache:
+    """
+    Calibration files of a camera.
+
+    The directory is indexed when the cache is created, and each file is
+    loaded the first time it is used. Files are written to a temporary file
+    then replaced, so an image in use (FrameCalibration) is never modified.
+    """
+
+    def __init__(self, directory: str, serial: str):
+        """
+        Default constructor.
+        :param directory: Directory of the calibration files.
+        :param serial: Serial number of the camera.
+        """
+        self.directory = directory
+        self.serial = str(serial)
+        self._files = {}        # (key, kind) : {exposure : path}
+        self._loaded = {}       # path : loaded image
+        os.makedirs(self.directory, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        """Index the calibration files of the directory."""
+        self._files = {}
+        for file_name in os.listdir(self.directory):
+            match = _FILE_PATTERN.match(file_name)
+            if match is None:
+                continue
+            files = self._files.setdefault((match['key'], match['kind']), {})
+            files[int(match['exposure'])] = os.path.join(self.directory, file_name)
+
+    def settings_key(self, binning: int, aoi: tuple = None) -> str:
+        """
+        Return the key of a camera setting.
+        :param binning: Binning of the camera.
+        :param aoi: (x0, y0, width, height) in sensor pixels (None : full sensor).
+        """
+        aoi_text = 'full' if aoi is None else '-'.join(str(int(value)) for value in aoi)
+        return f'{self.serial}_bin{int(binning)}_aoi{aoi_text}'
+
+    def _find(self, key: str, kind: str, exposure: float) -> np.ndarray:
+        """Return the image of the nearest exposure time (within tolerance), or None."""
+        files = self._files.get((key, kind))
+        if not files or exposure is None:
+            return None
+        nearest = min(files, key=lambda value: abs(value - exposure))
+        if abs(nearest - exposure) > EXPOSURE_TOLERANCE * exposure:
+            return None
+        path = files[nearest]
+        if path not in self._loaded:
+            self._loaded[path] = np.load(path)
+        return self._loaded[path]
+
+    def get(self, binning: int, aoi: tuple, exposure: float) -> FrameCalibration:
+        """
+        Return the calibration of a camera setting.
+        :param binning: Binning of the camera.
+        :param aoi: (x0, y0, width, height) in sensor pixels (None : full sensor).
+        :param exposure: Exposure time, in us.
+        :return: FrameCalibration, None if there is no calibration file for this setting.
+        """
+        key = self.settings_key(binning, aoi)
+        dark = self._find(key, 'dark', exposure)
+        gain = self._find(key, 'gain', exposure)
+        if dark is None and gain is None:
+            return None
+        return FrameCalibration(dark, gain)
+
+    def save(self, kind: str, image: np.ndarray, binning: int, aoi: tuple, exposure: float) -> str:
+        """
+        Write a calibration image on the disk.
+        :param kind: 'dark' or 'gain'.
+        :param image: Calibration image.
+        :param binning: Binning of the camera.
+        :param aoi: (x0, y0, width, height) in sensor pixels (None : full sensor).
+        :param exposure: Exposure time, in us.
+        :return: Path of the file.
+        """
+        key = self.settings_key(binning, aoi)
+        exposure = int(round(exposure))
+        path = os.path.join(self.directory, f'{key}_exp{exposure}_{kind}.npy')
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            np.save(file, np.asarray(image, dtype=np.float32))
+        os.replace(temporary_path, path)
+        self._loaded.pop(path, None)
+        self._files.setdefault((key, kind), {})[exposure] = path
+        return path
+
+    def capture(self, kind: str, camera, binning: int, aoi: tuple, exposure: float,
+                nb_frames: int = CALIBRATION_FRAMES) -> str:
+        """
+        Average frames of the camera and store them as a calibration file.
+        :param kind: 'dark' (no light) or 'flat' (reference arm only, stored as a 'gain' file).
+        :param camera: Camera, acquiring.
+        :param binning: Binning of the camera.
+        :param aoi: (x0, y0, width, height) in sensor pixels (None : full sensor).
+        :param exposure: Exposure time, in us.
+        :param nb_frames: Number of averaged frames.
+        :return: Path of the file.
+        """
+        image = FrameAccumulator().acquire(camera, nb_frames)
+        if kind == 'dark':
+            return self.save('dark', image, binning, aoi, exposure)
+        dark = self._find(self.settings_key(binning, aoi), 'dark', exposure)
+        return self.save('gain', compute_gain(image, dark), binning, aoi, exposure)
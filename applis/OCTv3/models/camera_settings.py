@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""*camera_settings.py* file.
+
+./models/camera_settings.py contains SensorSettings class to set the binning
+and the area of interest (AOI) of the camera (CameraBasler or SimulatedCamera),
+and to set the frame rate to the maximum reachable with these settings.
+
+Reading only the rows of the sample region increases the frame rate, so
+more frames can be averaged per second.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+
+# Binning values available in the interface (same value in both directions)
+BINNING_VALUES = [1, 2, 4]
+# Offsets and sizes of the AOI are multiples of AOI_ALIGNMENT pixels (binned pixels)
+AOI_ALIGNMENT = 8
+# Minimum size of the AOI, in binned pixels
+AOI_MIN_SIZE = 64
+
+
+class SensorSettings:
+    """
+    Binning and AOI of the camera sensor.
+
+    The AOI is stored in sensor pixels (binning 1), so it stays the same
+    area of the sample when the binning changes. The camera must not be
+    acquiring when the settings are applied.
+    """
+
+    def __init__(self, camera):
+        """
+        Default constructor. Set the binning to 1 and the AOI to the full sensor.
+        :param camera: Camera (CameraBasler or SimulatedCamera).
+        """
+        self.camera = camera
+        self.set_binning(1)
+        self.camera.reset_aoi()
+        self.sensor_size = tuple(int(size) for size in self.camera.get_sensor_size())
+        self.binning = 1
+        self.aoi = None     # (x0, y0, width, height) in sensor pixels, None : full sensor
+        self.max_frame_rate = None
+
+    def set_binning(self, binning: int):
+        """Set the binning of the camera (camera_device nodes, not available in CameraBasler)."""
+        device = self.camera.camera_device
+        was_open = device.IsOpen()
+        if not was_open:
+            device.Open()
+        device.BinningVertical.Value = binning
+        device.BinningHorizontal.Value = binning
+        if not was_open:
+            device.Close()
+
+    def apply(self, binning: int = None, aoi: tuple = None, full_sensor: bool = False) -> float:
+        """
+        Set the binning and the AOI of the camera, then the maximum frame rate.
+        :param binning: Binning value. Default : current binning.
+        :param aoi: (x0, y0, width, height) in sensor pixels. Default : current AOI.
+        :param full_sensor: If True, the AOI is reset to the full sensor.
+        :return: Maximum frame rate, in frames/s.
+        """
+        if binning is not None:
+            self.binning = int(binning)
+        if full_sensor:
+            self.aoi = None
+        elif aoi is not None:
+            self.aoi = aoi
+        # reset_aoi sets the sensor size without binning (CameraBasler) : binning 1 first
+        self.set_binning(1)
+        self.camera.reset_aoi()
+        self.set_binning(self.binning)
+        if self.aoi is not None:
+            x0, y0, width, height = self._binned_aoi(self.aoi)
+            self.camera.set_aoi(x0, y0, width, height)
+            self.aoi = (x0 * self.binning, y0 * self.binning, width * self.binning, height * self.binning)
+        return self.update_frame_rate()
+
+    def _binned_aoi(self, aoi: tuple) -> tuple:
+        """Convert an AOI in sensor pixels to binned pixels, aligned and inside the sensor."""
+        max_width = self.sensor_size[0] // self.binning
+        max_height = self.sensor_size[1] // self.binning
+        x0, y0, width, height = [int(value) // self.binning for value in aoi]
+        width = min(max(width, AOI_MIN_SIZE), max_width) // AOI_ALIGNMENT * AOI_ALIGNMENT
+        height = min(max(height, AOI_MIN_SIZE), max_height) // AOI_ALIGNMENT * AOI_ALIGNMENT
+        x0 = min(max(x0, 0), max_width - width) // AOI_ALIGNMENT * AOI_ALIGNMENT
+        y0 = min(max(y0, 0), max_height - height) // AOI_ALIGNMENT * AOI_ALIGNMENT
+        return x0, y0, width, height
+
+    def image_to_sensor(self, x: float, y: float, width: float, height: float) -> tuple:
+        """
+        Convert a rectangle of the current images to sensor pixels.
+        :param x: Left of the rectangle, in image pixels.
+        :param y: Top of the rectangle, in image pixels.
+        :param width: Width of the rectangle, in image pixels.
+        :param height: Height of the rectangle, in image pixels.
+        :return: (x0, y0, width, height) in sensor pixels.
+        """
+        aoi_x0, aoi_y0 = (self.aoi[0], self.aoi[1]) if self.aoi is not None else (0, 0)
+        return (aoi_x0 + int(x * self.binning), aoi_y0 + int(y * self.binning),
+                int(width * self.binning), int(height * self.binning))
+
+    def update_frame_rate(self) -> float:
+        """
+        Set the frame rate of the camera to the maximum reachable with the
+        current binning, AOI and exposure time (ResultingFrameRate node).
+        :return: Maximum frame rate, in frames/s.
+        """
+        device = self.camera.camera_device
+        was_open = device.IsOpen()
+        if not was_open:
+            device.Open()
+        try:
+            device.AcquisitionFrameRateEnable.Value = False
+            self.max_frame_rate = float(device.ResultingFrameRate.Value)
+        except Exception as e:
+            print(f'Sensor settings / {e}')
+            self.max_frame_rate = float(self.camera.get_frame_rate())
+        if not was_open:
+            device.Close()
+        self.camera.set_frame_rate(self.max_frame_rate)
+        return self.max_frame_rate
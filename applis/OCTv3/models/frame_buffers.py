@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""*frame_buffers.py* file.
+
+./models/frame_buffers.py contains iter_frames function to stream frames
+from a single grab session, FrameAccumulator class to average camera frames
+without storing them, and FrameSlot and FrameRing classes to share
+preallocated frames between the acquisition worker and the display.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import threading
+import numpy as np
+
+# Timeout of the retrieval of a frame from a pylon grab session, in ms
+GRAB_TIMEOUT_MS = 3000
+
+# States of a FrameSlot
+SLOT_FREE = 0
+SLOT_WRITING = 1
+SLOT_READY = 2
+SLOT_READING = 3
+
+
+def iter_frames(camera, nb_images: int = None):
+    """
+    Stream nb_images frames from a single grab session of the camera.
+
+    CameraBasler.get_image() starts and stops a grab session for each frame,
+    so the frame period would be set by the start-up of the grab and not by
+    the sensor. Here the frames come from one StartGrabbingMax(nb_images)
+    session of the pylon device (camera_device), or from one continuous
+    StartGrabbing session if nb_images is None, stopped when the generator is closed.
+    Cameras with an iter_images() method (SimulatedCamera) stream their own frames.
+    :param camera: Camera (CameraBasler or SimulatedCamera).
+    :param nb_images: Number of frames (None : continuous stream).
+    :return: Generator of frames (copies of the grab buffers).
+    """
+    if hasattr(camera, 'iter_images'):
+        yield from camera.iter_images(nb_images)
+        return
+    from pypylon import pylon
+    device = camera.camera_device
+    if not device.IsOpen():
+        device.Open()
+    if device.IsGrabbing():
+        device.StopGrabbing()
+    if nb_images is None:
+        device.StartGrabbing(pylon.GrabStrategy_OneByOne)
+    else:
+        device.StartGrabbingMax(nb_images)
+    try:
+        while device.IsGrabbing():
+            result = device.RetrieveResult(GRAB_TIMEOUT_MS, pylon.TimeoutHandling_ThrowException)
+            try:
+                if result.GrabSucceeded():
+                    array = result.Array
+                else:
+                    print(f'Grab / {result.GetErrorDescription()}')
+                    array = None
+            finally:
+                result.Release()
+            if array is not None:
+                yield array
+    finally:
+        if device.IsGrabbing():
+            device.StopGrabbing()
+
+
+class FrameAccumulator:
+    """
+    Sum of camera frames in a preallocated float32 buffer.
+
+    Frames are added one by one as soon as they are grabbed, so averaging
+    N frames uses the memory of a single frame whatever N is.
+    If calibration is set (FrameCalibration), the dark and flat-field
+    corrections are applied in place to the mean.
+    """
+
+    def __init__(self, shape: tuple = None, dtype=np.float32):
+        """
+        Default constructor.
+        :param shape: Shape of the frames (height, width). If None, the buffer
+            is allocated when the first frame is added.
+        :param dtype: Type of the accumulation buffer.
+        """
+        self.dtype = dtype
+        self.shape = None
+        self.count = 0
+        self.last_frame = None
+        self.calibration = None
+        self._sum = None
+        if shape is not None:
+            self._allocate(shape)
+
+    def _allocate(self, shape: tuple):
+        """Allocate the accumulation buffer (only when the shape changes)."""
+        self.shape = tuple(shape)
+        self._sum = np.zeros(self.shape, dtype=self.dtype)
+
+    def reset(self):
+        """Clear the accumulated sum, keeping the buffer."""
+        if self._sum is not None:
+            self._sum.fill(0)
+        self.count = 0
+
+    def add(self, frame: np.ndarray):
+        """
+        Add a frame to the sum.
+        :param frame: Frame to add, of any numeric type.
+        """
+        frame = np.squeeze(frame)
+        if self._sum is None or frame.shape != self.shape:
+            self._allocate(frame.shape)
+            self.count = 0
+        np.add(self._sum, frame, out=self._sum, casting='unsafe')
+        self.count += 1
+        self.last_frame = frame
+
+    def mean(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Return the mean of the accumulated frames.
+        :param out: Optional array to write the result in (same shape).
+        :return: Averaged frame (float32).
+        """
+        if self._sum is None:
+            return None
+        if out is None:
+            out = np.empty(self.shape, dtype=self.dtype)
+        np.multiply(self._sum, 1.0 / max(self.count, 1), out=out, casting='unsafe')
+        if self.calibration is not None:
+            self.calibration.apply(out)
+        return out
+
+    def grab(self, camera, nb_images: int):
+        """
+        Grab and sum nb_images frames from a camera, in a single grab session.
+        Each frame is added to the sum as soon as it is retrieved.
+        :param camera: Camera (CameraBasler or SimulatedCamera, see iter_frames).
+        :param nb_images: Number of frames to sum.
+        """
+        self.reset()
+        for frame in iter_frames(camera, max(int(nb_images), 1)):
+            self.add(frame)
+
+    def acquire(self, camera, nb_images: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        Grab and average nb_images frames from a camera.
+        :param camera: Camera (CameraBasler or SimulatedCamera, see iter_frames).
+        :param nb_images: Number of frames to average.
+        :param out: Optional array to write the result in.
+        :return: Averaged frame (float32).
+        """
+        self.grab(camera, nb_images)
+        return self.mean(out)
+
+
+class FrameSlot:
+    """
+    Set of preallocated arrays for one live OCT iteration.
+
+    stack is the (N, H, W) float32 stack of phase-shifted images written by
+    the worker; image1 and image2 are views of its first two images.
+    image_oct (amplitude) and phase are float32 arrays written by the worker.
+    display1, display2 and display_oct are uint8 arrays written by the display.
+    piezo_v0, piezo_dv, exposure and nb_averaged are the acquisition parameters
+    of the images, z (motor position) and motor_wait are set by the acquisition worker.
+    """
+
+    def __init__(self, index: int):
+        """
+        Default constructor.
+        :param index: Index of the slot in its ring.
+        """
+        self.index = index
+        self.state = SLOT_FREE
+        self.shape = None
+        self.nb_steps = 0
+        self.frame_number = 0
+        self.sample_number = 0
+        self.piezo_v0 = 0.0
+        self.piezo_dv = 0.0
+        self.exposure = None
+        self.nb_averaged = 0
+        self.z = None
+        self.motor_wait = 0.0
+        self.stack = None
+        self.image1 = None
+        self.image2 = None
+        self.image_oct = None
+        self.phase = None
+        self.display1 = None
+        self.display2 = None
+        self.display_oct = None
+
+    def ensure_shape(self, shape: tuple, nb_steps: int = 2):
+        """Allocate the arrays of the slot, only if the shape or the number of steps changed."""
+        shape = tuple(shape)
+        if shape == self.shape and nb_steps == self.nb_steps:
+            return
+        self.shape = shape
+        self.nb_steps = nb_steps
+        self.stack = np.zeros((max(nb_steps, 2),) + shape, dtype=np.float32)
+        self.image1 = self.stack[0]
+        self.image2 = self.stack[1]
+        self.image_oct = np.zeros(shape, dtype=np.float32)
+        self.phase = np.zeros(shape, dtype=np.float32)
+        self.display1 = np.zeros(shape, dtype=np.uint8)
+        self.display2 = np.zeros(shape, dtype=np.uint8)
+        self.display_oct = np.zeros(shape, dtype=np.uint8)
+
+
+class FrameRing:
+    """
+    Fixed-size ring of FrameSlot shared by one writer and one reader.
+
+    Ownership rule of a slot :
+    - FREE : nobody owns it, the writer can take it with get_write_slot().
+    - WRITING : owned by the writer (worker thread) until publish().
+    - READY : latest published slot. It becomes FREE again if a newer slot
+      is published before the reader takes it (stale frames are dropped).
+    - READING : owned by the reader (GUI thread) until release().
+
+    With 3 slots or more, the writer always finds a FREE slot and never
+    waits for the reader. Arrays are only allocated when the frame shape
+    changes, so a live session allocates nothing per frame.
+    """
+
+    def __init__(self, nb_slots: int = 3):
+        """
+        Default constructor.
+        :param nb_slots: Number of slots (at least 3).
+        """
+        self.slots = [FrameSlot(k) for k in range(max(nb_slots, 3))]
+        self._lock = threading.Lock()
+        self._ready = None
+        self.frame_number = 0
+
+    def get_write_slot(self, shape: tuple, nb_steps: int = 2) -> FrameSlot:
+        """
+        Take a FREE slot for writing (writer side).
+        :param shape: Shape of the frames to write.
+        :param nb_steps: Number of phase-shifted images of the slot.
+        :return: Slot owned by the writer.
+        """
+        with self._lock:
+            for slot in self.slots:
+                if slot.state == SLOT_FREE:
+                    slot.state = SLOT_WRITING
+                    break
+            else:
+                raise RuntimeError('FrameRing : no free slot')
+        slot.ensure_shape(shape, nb_steps)
+        return slot
+
+    def publish(self, slot: FrameSlot):
+        """
+        Make a written slot the latest frame (writer side).
+        :param slot: Slot obtained by get_write_slot().
+        """
+        with self._lock:
+            if self._ready is not None:
+                self._ready.state = SLOT_FREE
+            self.frame_number += 1
+            slot.frame_number = self.frame_number
+            slot.state = SLOT_READY
+            self._ready = slot
+
+    def cancel(self, slot: FrameSlot):
+        """Give back a slot taken for writing without publishing it."""
+        with self._lock:
+            slot.state = SLOT_FREE
+
+    def read_latest(self) -> FrameSlot:
+        """
+        Take the latest published slot (reader side).
+        :return: Slot owned by the reader, or None if no new frame is ready.
+        """
+        with self._lock:
+            slot = self._ready
+            if slot is not None:
+                slot.state = SLOT_READING
+                self._ready = None
+            return slot
+
+    def release(self, slot: FrameSlot):
+        """
+        Give back a slot after reading it (reader side).
+        :param slot: Slot obtained by read_latest().
+        """
+        with self._lock:
+            slot.state = SLOT_FREE
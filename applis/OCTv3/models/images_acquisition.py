@@ -5,22 +5,200 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
 from PyQt6.QtCore import QObject, QThread, pyqtSignal
 import numpy as np
 import time
+import queue
+import threading
+from models.frame_buffers import FrameAccumulator, FrameSlot, FrameRing, iter_frames
+from models.phase_shifting import PhaseShiftingDemodulator
+from models.timing import StageTimings
+from models.acquisition_parameters import AcquisitionParameters
+from models.auto_exposure import AutoExposure
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from oct_lab_app import MainWindow
 
+### Pipeline between capture and processing stages
+PIPELINE_QUEUE_SIZE = 1
+# Slots of the frame ring : capture + queue + processing + ready + display
+FRAME_RING_SIZE = PIPELINE_QUEUE_SIZE + 4
+### Fly-scan
+# Duration of the run-up before the first slice and after the last one (acceleration of the motor), in s
+FLY_RUN_UP_TIME = 0.2
+# Extra time allowed to a fly-scan, in s
+FLY_TIMEOUT_MARGIN = 2.0
+# Refresh period of the polled position of the motor (Kinesis polling), in s
+FLY_POSITION_REFRESH = 0.25
+
+
+def acquire_phase_images(main_app: "MainWindow", accumulator: FrameAccumulator,
+                         parameters: AcquisitionParameters, demodulator: PhaseShiftingDemodulator) -> FrameSlot:
+    """
+    Acquire the N phase-shifted images into a slot of the frame ring.
+    :param main_app: Main window of the application (piezo, camera, calibration and frame ring).
+    :param accumulator: Accumulator used to average (and calibrate) the frames.
+    :param parameters: Acquisition parameters (number of averaged frames, piezo voltages).
+    :param demodulator: Phase-shifting demodulator giving the piezo voltages.
+    :return: Slot owned by the caller, with its stack filled.
+    :raise RuntimeError: If frames of a phase step could not be grabbed. On any error,
+        the slot is given back to the frame ring before the exception is raised again.
+    """
+    piezo = main_app.piezo
+    camera = main_app.camera
+    timings = main_app.timings
+    accumulator.calibration = main_app.calibration
+    nb_averaged = max(int(parameters.nb_averaged), 1)
+    slot = None
+    try:
+        for k, voltage in enumerate(demodulator.voltages(parameters.piezo_v0, parameters.piezo_dv)):
+            with timings.measure('piezo'):
+                piezo.set_voltage_piezo(voltage)
+            with timings.measure('grab'):
+                accumulator.grab(camera, nb_averaged)
+            if accumulator.count < nb_averaged:
+                raise RuntimeError(f'Phase step {k} : {accumulator.count}/{nb_averaged} frames grabbed')
+            if slot is None:
+                slot = main_app.frame_ring.get_write_slot(accumulator.shape, demodulator.nb_steps)
+            with timings.measure('averaging'):
+                accumulator.mean(out=slot.stack[k])
+    except Exception:
+        if slot is not None:
+            main_app.frame_ring.cancel(slot)
+        raise
+    slot.piezo_v0 = parameters.piezo_v0
+    slot.piezo_dv = parameters.piezo_dv
+    slot.exposure = parameters.exposure
+    slot.nb_averaged = accumulator.count
+    return slot
+
+
+def compute_oct(slot: FrameSlot, demodulator: PhaseShiftingDemodulator, timings: StageTimings = None):
+    """
+    Compute the OCT amplitude (and phase) images of a slot from its phase-shifted images.
+    :param slot: Slot with its stack filled.
+    :param demodulator: Phase-shifting demodulator.
+    :param timings: Optional StageTimings to add the duration of the demodulation in.
+    """
+    start = time.perf_counter()
+    demodulator.demodulate(slot.stack, slot.image_oct, slot.phase)
+    if timings is not None:
+        timings.add('demodulation', time.perf_counter() - start)
+
+
+def acquire_oct_slot(main_app: "MainWindow", accumulator: FrameAccumulator,
+                     parameters: AcquisitionParameters, demodulator: PhaseShiftingDemodulator) -> FrameSlot:
+    """
+    Acquire the phase-shifted images and the OCT image into a slot of the frame ring.
+    :param main_app: Main window of the application (piezo, camera and frame ring).
+    :param accumulator: Accumulator used to average the frames.
+    :param parameters: Acquisition parameters (number of averaged frames, piezo voltages).
+    :param demodulator: Phase-shifting demodulator.
+    :return: Slot owned by the caller, to publish in main_app.frame_ring.
+    """
+    slot = acquire_phase_images(main_app, accumulator, parameters, demodulator)
+    compute_oct(slot, demodulator, main_app.timings)
+    return slot
+
+
+class OCTProcessingStage(threading.Thread):
+    """
+    Processing stage of the live pipeline.
+
+    Slots filled by the capture stage are received through a bounded queue.
+    The OCT image of step k is computed here while the capture stage is
+    acquiring step k+1. Each processed slot is published in the frame ring,
+    which is the (1-deep, drop stale) link to the display stage.
+    """
+
+    def __init__(self, ring: FrameRing, demodulator: PhaseShiftingDemodulator, on_ready,
+                 max_queue: int = PIPELINE_QUEUE_SIZE, on_processed=None, timings: StageTimings = None):
+        """
+        Default constructor.
+        :param ring: Frame ring where processed slots are published.
+        :param demodulator: Phase-shifting demodulator (used only by this stage).
+        :param on_ready: Function called after each publication (signal emit).
+        :param max_queue: Maximum number of slots waiting for processing.
+        :param on_processed: Optional function called with each processed slot, before its publication.
+        :param timings: Optional StageTimings to add the duration of the demodulation in.
+        """
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.demodulator = demodulator
+        self.on_ready = on_ready
+        self.on_processed = on_processed
+        self.timings = timings
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def submit(self, slot: FrameSlot) -> bool:
+        """
+        Send a captured slot to the processing stage.
+        Block while the queue is full (backpressure on the capture stage).
+        :param slot: Slot with image1 and image2 filled.
+        :return: False if the processing stage is not running anymore.
+        """
+        while self.is_alive():
+            try:
+                self.queue.put(slot, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        self.ring.cancel(slot)
+        return False
+
+    def run(self):
+        while True:
+            slot = self.queue.get()
+            if slot is None:
+                break
+            try:
+                compute_oct(slot, self.demodulator, self.timings)
+                if self.on_processed is not None:
+                    self.on_processed(slot)
+                self.ring.publish(slot)
+                self.on_ready()
+            except Exception as e:
+                print(f'OCT processing / {e}')
+                self.ring.cancel(slot)
+
+    def stop(self):
+        """Process the remaining slots and stop the stage."""
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
 
 class ImageLive(QObject):
     images_ready = pyqtSignal()
     finished = pyqtSignal()
+    exposure_changed = pyqtSignal(float)     # exposure time set by the auto-exposure, in us
 
-    def __init__(self, main_app: "MainWindow"):
+    def __init__(self, main_app: "MainWindow", parameters: AcquisitionParameters):
+        """
+        Default constructor.
+        :param main_app: Main window of the application.
+        :param parameters: Acquisition parameters (snapshot, replaced by set_parameters).
+        """
         super().__init__()
         self.main_app = main_app
         self._running = True
+        self.accumulator = FrameAccumulator()
+        self.parameters = parameters
+
+    def set_parameters(self, parameters: AcquisitionParameters):
+        """
+        Use new acquisition parameters, from the next phase-shifted images.
+        Called from the GUI thread : the snapshot is immutable, so replacing
+        the reference is enough.
+        """
+        self.parameters = parameters
 
     def run(self):
+        # Capture stage runs in this thread, processing stage in its own thread
+        demodulator = PhaseShiftingDemodulator(self.parameters.phase_algorithm)
+        processing = OCTProcessingStage(self.main_app.frame_ring, demodulator, self.images_ready.emit,
+                                        timings=self.main_app.timings)
+        processing.start()
+        auto_exposure = AutoExposure(self.main_app.min_expo_value, self.main_app.max_expo_value,
+                                     self.main_app.image_bits_depth)
         while self._running:
             # Get images
             piezo = self.main_app.piezo
@@ -32,25 +210,25 @@ class ImageLive(QObject):
                     camera.start_acquisition()
                     self.main_app.camera_acquiring = True
 
-                nb_images_text = self.main_app.central_widget.mini_camera.camera_params_widget.num_value.text()
+                parameters = self.parameters
                 try:
-                    nb_images = int(nb_images_text)
+                    slot = acquire_phase_images(self.main_app, self.accumulator, parameters, demodulator)
                 except Exception as e:
-                    print(e)
-                    nb_images = 1
-
-                piezo.set_voltage_piezo(self.main_app.piezo_V0)
-                images_list = camera.get_images(nb_images)
-                self.main_app.image1 = np.mean(images_list, axis = 0)
-
-                piezo.set_voltage_piezo(self.main_app.piezo_step_size + self.main_app.piezo_V0)
-                images_list = camera.get_images(nb_images)
-                self.main_app.image2 = np.mean(images_list, axis = 0)
-
-                self.main_app.image_oct = np.sqrt((self.main_app.image1 - self.main_app.image2) ** 2)
-
-            time.sleep(0.01)
-            self.images_ready.emit()
+                    # Failed grab (timeout of the camera...) : the live mode goes on with the next images
+                    print(f'Live / {e}')
+                    time.sleep(0.01)
+                    continue
+                processing.submit(slot)
+                if parameters.auto_exposure and parameters.exposure is not None:
+                    # Last frame of the last phase step, camera written at most every AutoExposure.interval
+                    exposure = auto_exposure.update(self.accumulator.last_frame, parameters.exposure)
+                    if exposure is not None:
+                        camera.set_exposure(exposure)
+                        self.exposure_changed.emit(exposure)
+            else:
+                time.sleep(0.01)
+                self.images_ready.emit()
+        processing.stop()
         self.finished.emit()
 
     def stop(self):
@@ -60,34 +238,48 @@ class ImageLive(QObject):
 class ImageAcquisition(QObject):
     images_ready = pyqtSignal()
     finished = pyqtSignal()
+    error = pyqtSignal(str)     # the acquisition stops : message of the error
 
-    def __init__(self, main_app: "MainWindow"):
+    def __init__(self, main_app: "MainWindow", z0: float, parameters: AcquisitionParameters,
+                 volume_writer=None):
+        """
+        Default constructor.
+        :param main_app: Main window of the application.
+        :param z0: Position of the first slice, in mm.
+        :param parameters: Acquisition parameters, fixed for the whole z-stack.
+        :param volume_writer: VolumeWriterThread receiving the slices (None : no storage).
+        """
         super().__init__()
         self.main_app = main_app
         self._running = True
+        self.accumulator = FrameAccumulator()
+        self.parameters = parameters
+        self.demodulator = PhaseShiftingDemodulator(parameters.phase_algorithm)
+        self.z0 = z0
+        self.z_step = parameters.z_step
+        self.volume_writer = volume_writer
         self.number_of_samples = 0
 
     def run(self):
-        while self._running:
-            # Get images
-            piezo = self.main_app.piezo
-            camera = self.main_app.camera
-            nb_avg_images_text = self.main_app.central_widget.mini_camera.camera_params_widget.num_value.text()
-
-            try:
-                nb_avg_images = int(nb_avg_images_text)
-            except Exception as e:
-                print(e)
-                nb_avg_images = 1
-
-            nb_images_text = self.main_app.central_widget.acquisition_options.step_num.text()
+        nb_images = self.parameters.nb_slices
+        print(nb_images)
+        motion = self.main_app.motion
+        next_move = motion.move_to(self.z0)
+        while self._running and self.number_of_samples < nb_images:
+            # Wait for the motor at the position of the slice
+            wait_start = time.perf_counter()
             try:
-                nb_images = int(nb_images_text)
+                motion_result = next_move.result()
             except Exception as e:
-                print(e)
-                nb_images = 1
+                print(f'Acquisition / {e}')
+                break
+            motor_wait = time.perf_counter() - wait_start
+            self.main_app.timings.add('motor', motion_result.duration)
+            self.main_app.timings.add('motor wait', motor_wait)
 
-            print(nb_images)
+            # Get images
+            piezo = self.main_app.piezo
+            camera = self.main_app.camera
             if piezo is not None and self.main_app.camera_connected:
                 if not self.main_app.camera_acquiring:
                     print("Start ACQUISITION")
@@ -95,32 +287,234 @@ class ImageAcquisition(QObject):
                     camera.start_acquisition()
                     self.main_app.camera_acquiring = True
 
-                piezo.set_voltage_piezo(self.main_app.piezo_V0)
-                images_list = camera.get_images(nb_avg_images)
-                self.main_app.image1 = np.mean(images_list, axis = 0)
+                try:
+                    slot = acquire_phase_images(self.main_app, self.accumulator, self.parameters, self.demodulator)
+                except Exception as e:
+                    print(f'Acquisition / {e}')
+                    self._running = False
+                    self.error.emit(f'Slice {self.number_of_samples + 1} not acquired : {e}')
+                    break
+                # The last frame is captured : the motor moves to the next slice during the processing
+                next_move = self.move_to_next_slice(nb_images)
+                compute_oct(slot, self.demodulator, self.main_app.timings)
+            else:
+                slot = self.main_app.frame_ring.get_write_slot((50, 100))
+                slot.image_oct[:] = np.random.randint(0, 256, (50, 100))
+                next_move = self.move_to_next_slice(nb_images)
 
-                piezo.set_voltage_piezo(self.main_app.piezo_step_size + self.main_app.piezo_V0)
-                images_list = camera.get_images(nb_avg_images)
-                self.main_app.image2 = np.mean(images_list, axis = 0)
+            self.number_of_samples += 1
+            slot.sample_number = self.number_of_samples
+            slot.z = motion_result.position
+            slot.motor_wait = motor_wait
+            self.store(slot)
+            self.main_app.frame_ring.publish(slot)
+            print(f'Sample nb = {self.number_of_samples}')
+            self.images_ready.emit()
 
-                self.main_app.image_oct = np.sqrt((self.main_app.image1 - self.main_app.image2) ** 2)
+        self.finished.emit()
 
-                self.number_of_samples += 1
-                print(f'Sample nb = {self.number_of_samples}')
+    def move_to_next_slice(self, nb_images: int):
+        """
+        Start the move of the motor to the next slice.
+        :param nb_images: Number of slices of the acquisition.
+        :return: Future of the move, None after the last slice.
+        """
+        next_sample = self.number_of_samples + 1
+        if next_sample >= nb_images or not self._running:
+            return None
+        return self.main_app.motion.move_to(self.z0 + next_sample * self.z_step)
 
-            else:
-                self.main_app.image_oct = np.random.randint(0, 256, (50, 100), dtype=np.uint8)
-                self.number_of_samples += 1
-                print(f'Sample nb = {self.number_of_samples}')
+    def store(self, slot: FrameSlot):
+        """
+        Send the OCT image of a slot and its metadata to the volume writer.
+        If the writer failed, the acquisition is stopped and error is emitted.
+        """
+        writer = self.volume_writer
+        if writer is None:
+            return
+        written = writer.submit(slot.image_oct, z=slot.z, sample_number=slot.sample_number,
+                                piezo_v0=slot.piezo_v0, piezo_dv=slot.piezo_dv,
+                                exposure=slot.exposure, averaging=slot.nb_averaged,
+                                motor_wait=slot.motor_wait)
+        if not written and self._running:
+            self._running = False
+            reason = writer.error if writer.error is not None else 'volume writer stopped'
+            self.error.emit(f'Slice {slot.sample_number} not saved : {reason}')
 
-            self.images_ready.emit()
+    def stop(self):
+        self._running = False
+
+
+class ImageFlyScan(ImageAcquisition):
+    """
+    Fly-scan z acquisition.
 
-            if self.number_of_samples >= nb_images:
-                self.number_of_samples = 0
-                self._running = False
+    The motor moves at constant velocity while the camera streams from a
+    single continuous grab session (iter_frames) and the piezo cycles
+    through the phase steps, one step per frame. Frames are timed from
+    their index in the stream (the sensor streams at the frame period) and
+    tagged with the position of the commanded trajectory at the middle of
+    their exposure (start of the move and velocity applied by the motor).
+    Polled positions of the motor are only used to check this trajectory,
+    since they are refreshed at the polling rate of the controller.
+    Slices are centred on z0 + n.z_step : when the trajectory leaves the bin
+    of a slice, the slice is sent to the processing stage (demodulation and
+    storage). The velocity gives nb_avg_images frames per phase step in each
+    bin, or more if it is limited by the motor.
+
+    The phase step of a frame is its index in the stream, and the piezo is
+    moved to the next step as soon as a frame is received : this mode assumes
+    that the exposures do not overlap the readout (frame period longer than
+    exposure time + readout + settling of the piezo), and that the stream is
+    read without delay (late frames are counted and reported).
+    """
+
+    def run(self):
+        piezo = self.main_app.piezo
+        camera = self.main_app.camera
+        if piezo is None or not self.main_app.camera_connected:
+            # Nothing to stream : stop and go acquisition
+            super().run()
+            return
+        if not self.main_app.camera_acquiring:
+            print("Start ACQUISITION")
+            camera.alloc_memory()
+            camera.start_acquisition()
+            self.main_app.camera_acquiring = True
+
+        parameters = self.parameters
+        nb_avg_images, nb_images = parameters.nb_averaged, parameters.nb_slices
+        nb_steps = self.demodulator.nb_steps
+        voltages = self.demodulator.voltages(parameters.piezo_v0, parameters.piezo_dv)
+        frame_period = 1 / float(camera.get_frame_rate())
+        exposure = float(camera.get_exposure()) * 1e-6
+        motion = self.main_app.motion
+        velocity = motion.fly_velocity(self.z_step / (frame_period * nb_steps * max(nb_avg_images, 1)))
+        run_up = velocity * FLY_RUN_UP_TIME
+        z_first = self.z0 - self.z_step / 2
+        z_last = self.z0 + (nb_images - 0.5) * self.z_step
+        z_end = z_last + run_up
+        if motion.max_position is not None and z_end > motion.max_position:
+            if z_last > motion.max_position:
+                message = f'Fly-scan : last slice at {z_last:.4f} mm, out of the travel of the stage ' \
+                          f'({motion.max_position} mm)'
+                print(message)
+                self.error.emit(message)
                 self.finished.emit()
+                return
+            z_end = motion.max_position
+
+        try:
+            z_start = motion.move_to(max(z_first - run_up, 0)).result().position
+            start_time, velocity = motion.start_fly(z_end, velocity).result()
+        except Exception as e:
+            print(f'Fly-scan / {e}')
+            self.finished.emit()
+            return
+        deadline = start_time + (z_end - z_start) / velocity + FLY_TIMEOUT_MARGIN
+        frames_per_step = self.z_step / (velocity * frame_period * nb_steps)
+        print(f'Fly-scan : {velocity:.4f} mm/s from {z_first:.4f} to {z_last:.4f} mm, '
+              f'{frames_per_step:.1f} frames per phase step and slice')
 
+        processing = OCTProcessingStage(self.main_app.frame_ring, self.demodulator, self.images_ready.emit,
+                                        on_processed=self.store, timings=self.main_app.timings)
+        processing.start()
+        accumulators = [FrameAccumulator() for _ in range(nb_steps)]
+        for accumulator in accumulators:
+            accumulator.calibration = self.main_app.calibration
+        current_bin = None
+        z = z_start
+        z_sum = 0.0
+        nb_frames = 0
+        frame_index = 0
+        anchor_time, anchor_index = None, 0
+        late_frames = 0
+        next_check = start_time
+        max_drift = 0.0
+        piezo.set_voltage_piezo(voltages[0])
+        timings = self.main_app.timings
+        frames = iter_frames(camera)
+        try:
+            while self._running:
+                with timings.measure('grab'):
+                    frame = next(frames)
+                received_time = time.perf_counter() - exposure / 2
+                # Time of the frame from its index, re-anchored if it is later than the reception of the frame
+                frame_time = None if anchor_time is None else anchor_time + (frame_index - anchor_index) * frame_period
+                if frame_time is None or frame_time > received_time:
+                    anchor_time, anchor_index = received_time, frame_index
+                    frame_time = received_time
+                elif received_time - frame_time > frame_period:
+                    late_frames += 1
+                phase_step = frame_index % nb_steps
+                frame_index += 1
+                with timings.measure('piezo'):
+                    piezo.set_voltage_piezo(voltages[frame_index % nb_steps])
+                if frame_time > deadline:
+                    break
+                z = min(z_start + velocity * (frame_time - start_time), z_end)
+                if frame_time >= next_check:
+                    now = time.perf_counter()
+                    commanded = min(z_start + velocity * (now - start_time), z_end)
+                    max_drift = max(max_drift, abs(self.main_app.step_motor.get_position() - commanded))
+                    next_check = now + FLY_POSITION_REFRESH
+                if z >= z_last:
+                    break
+                z_bin = int(np.floor((z - self.z0) / self.z_step + 0.5))
+                if z_bin != current_bin:
+                    if current_bin is not None and nb_frames > 0:
+                        self.submit_slice(processing, current_bin, accumulators, z_sum / nb_frames)
+                    for accumulator in accumulators:
+                        accumulator.reset()
+                    current_bin = z_bin
+                    z_sum = 0.0
+                    nb_frames = 0
+                if 0 <= z_bin < nb_images:
+                    accumulators[phase_step].add(frame)
+                    z_sum += z
+                    nb_frames += 1
+        finally:
+            frames.close()
+        if current_bin is not None and nb_frames > 0:
+            self.submit_slice(processing, current_bin, accumulators, z_sum / nb_frames)
+        processing.stop()
+        try:
+            motion.end_fly(stop=True).result()
+        except Exception as e:
+            print(f'Fly-scan / {e}')
+        if late_frames > 0:
+            print(f'Fly-scan / {late_frames} frames read late : their phase step may be wrong')
+        # The polled position lags by up to the polling period of the controller
+        if max_drift > self.z_step / 2 + velocity * FLY_POSITION_REFRESH:
+            print(f'Fly-scan / polled position up to {max_drift:.4f} mm away from the commanded trajectory')
+        if self._running and z < z_last:
+            message = f'Fly-scan : stopped at {z:.4f} mm before the last slice ({z_last:.4f} mm)'
+            print(message)
+            self.error.emit(message)
         self.finished.emit()
 
-    def stop(self):
-        self._running = False
\ No newline at end of file
+    def submit_slice(self, processing: OCTProcessingStage, z_bin: int, accumulators: list, z: float):
+        """
+        Send the averaged phase-shifted images of a z bin to the processing stage.
+        :param processing: Processing stage (demodulation, storage and publication).
+        :param z_bin: Index of the slice.
+        :param accumulators: One FrameAccumulator per phase step.
+        :param z: Mean position of the frames of the slice, in mm.
+        """
+        counts = [accumulator.count for accumulator in accumulators]
+        if min(counts) == 0:
+            print(f'Fly-scan / slice {z_bin + 1} skipped : missing phase steps ({counts})')
+            return
+        slot = self.main_app.frame_ring.get_write_slot(accumulators[0].shape, len(accumulators))
+        for k, accumulator in enumerate(accumulators):
+            accumulator.mean(out=slot.stack[k])
+        slot.piezo_v0 = self.parameters.piezo_v0
+        slot.piezo_dv = self.parameters.piezo_dv
+        slot.exposure = self.parameters.exposure
+        slot.nb_averaged = min(counts)
+        slot.z = z
+        slot.motor_wait = 0.0
+        self.number_of_samples += 1
+        slot.sample_number = z_bin + 1
+        processing.submit(slot)
+        print(f'Sample nb = {slot.sample_number} / z = {z:.4f} mm / {sum(counts)} frames')
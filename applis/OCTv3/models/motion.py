@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""*motion.py* file.
+
+./models/motion.py contains MotorMotion class to move the step motor
+asynchronously. Each move returns a future, completed when the move is
+finished and the position is within tolerance, and emits a Qt signal.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from PyQt6.QtCore import QObject, pyqtSignal
+
+### Default values of the motion
+TOLERANCE = 0.01 #(tolerance in position in mm)
+TIMEOUT = 3 #(motor displacement timeout in s)
+# Interval between two position readings, if the stage is not within tolerance at the end of the move
+SETTLING_INTERVAL = 0.005
+# Maximum velocity of a fly-scan, in mm/s
+FLY_MAX_VELOCITY = 2.0
+
+
+class MotionResult:
+    """Result of a move of the step motor."""
+
+    def __init__(self, target: float, position: float, start_time: float, end_time: float):
+        """
+        Default constructor.
+        :param target: Requested position, in mm.
+        :param position: Position at the end of the move, in mm.
+        :param start_time: time.perf_counter() value at the start of the move.
+        :param end_time: time.perf_counter() value when the position is within tolerance.
+        """
+        self.target = target
+        self.position = position
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @property
+    def duration(self) -> float:
+        """Duration of the move, in s."""
+        return self.end_time - self.start_time
+
+    def __repr__(self):
+        return f'MotionResult(target={self.target}, position={self.position}, duration={self.duration:.3f}s)'
+
+
+class MotorMotion(QObject):
+    """
+    Asynchronous moves of a step motor (Motor or SimulatedMotor).
+
+    The blocking move_motor() of the motor runs in a single background
+    thread, so the moves are executed in the order they are requested.
+    """
+    move_done = pyqtSignal(object)      # MotionResult
+    move_failed = pyqtSignal(str)
+
+    def __init__(self, motor, max_position: float = None, tolerance: float = TOLERANCE,
+                 timeout: float = TIMEOUT):
+        """
+        Default constructor.
+        :param motor: Step motor (move_motor, get_position).
+        :param max_position: Maximum position of the motor, in mm (None : no limit).
+        :param tolerance: Maximum distance to the target at the end of a move, in mm.
+        :param timeout: Maximum time to reach the tolerance after the end of move_motor, in s.
+        """
+        super().__init__()
+        self.motor = motor
+        self.max_position = max_position
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='motor')
+        self._last_move = None
+        self._velocity = None
+
+    def move_to(self, position: float, tolerance: float = None) -> Future:
+        """
+        Start a move of the motor.
+        :param position: Requested position, in mm.
+        :param tolerance: Maximum distance to the target, in mm. Default : self.tolerance.
+        :return: Future whose result is a MotionResult.
+        """
+        if tolerance is None:
+            tolerance = self.tolerance
+        if position < 0 or (self.max_position is not None and position > self.max_position):
+            future = Future()
+            future.set_exception(ValueError(f'Motor position {position} out of range [0, {self.max_position}]'))
+        else:
+            future = self._executor.submit(self._move, position, tolerance)
+        future.add_done_callback(self._emit_result)
+        self._last_move = future
+        return future
+
+    def _move(self, position: float, tolerance: float) -> MotionResult:
+        """Move the motor and wait until the position is within tolerance (motor thread)."""
+        start_time = time.perf_counter()
+        self.motor.move_motor(position)
+        deadline = time.perf_counter() + self.timeout
+        current = self.motor.get_position()
+        while abs(current - position) > tolerance:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f'Motor at {current} mm, target {position} mm')
+            time.sleep(SETTLING_INTERVAL)
+            current = self.motor.get_position()
+        return MotionResult(position, current, start_time, time.perf_counter())
+
+    def _emit_result(self, future: Future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.move_done.emit(future.result())
+        else:
+            print(f'Motor motion / {error}')
+            self.move_failed.emit(str(error))
+
+    @staticmethod
+    def fly_velocity(velocity: float) -> float:
+        """Return the velocity applied by start_fly for a requested velocity, in mm/s."""
+        return min(velocity, FLY_MAX_VELOCITY)
+
+    def start_fly(self, position: float, velocity: float) -> Future:
+        """
+        Start a constant-velocity move (fly-scan), without waiting for its end.
+        The velocity of the motor is restored by end_fly().
+        :param position: End position of the move, in mm.
+        :param velocity: Requested velocity of the move, in mm/s (limited to FLY_MAX_VELOCITY).
+        :return: Future whose result is (start_time, velocity) : time.perf_counter() value
+            at the start of the move and velocity actually applied, in mm/s.
+        """
+        future = self._executor.submit(self._start_fly, position, self.fly_velocity(velocity))
+        self._last_move = future
+        return future
+
+    def _start_fly(self, position: float, velocity: float) -> tuple:
+        self._velocity = self.motor.get_velocity()
+        self.motor.set_velocity(velocity)
+        self.motor.start_move(position)
+        return time.perf_counter(), velocity
+
+    def end_fly(self, stop: bool = False) -> Future:
+        """
+        Wait for the end of a fly-scan move and restore the velocity of the motor.
+        :param stop: If True, stop the motor immediately.
+        :return: Future whose result is a MotionResult.
+        """
+        future = self._executor.submit(self._end_fly, stop)
+        future.add_done_callback(self._emit_result)
+        self._last_move = future
+        return future
+
+    def _end_fly(self, stop: bool) -> MotionResult:
+        start_time = time.perf_counter()
+        if stop:
+            self.motor.stop_motor()
+        while self.motor.is_moving():
+            time.sleep(SETTLING_INTERVAL)
+        self.motor.set_velocity(self._velocity)
+        position = self.motor.get_position()
+        return MotionResult(position, position, start_time, time.perf_counter())
+
+    def is_moving(self) -> bool:
+        """Return True if a move is running or waiting."""
+        return self._last_move is not None and not self._last_move.done()
+
+    def wait(self, timeout: float = None) -> MotionResult:
+        """
+        Wait for the end of the last requested move.
+        :param timeout: Maximum waiting time, in s (None : no limit).
+        :return: Result of the last move, None if no move was requested.
+        """
+        if self._last_move is None:
+            return None
+        return self._last_move.result(timeout)
+
+    def shutdown(self):
+        """Wait for the running moves and stop the motor thread."""
+        self._executor.shutdown(wait=True)
@@ -1,10 +1,10 @@
 import os
 import time
 import sys
-import clr
 #from win32cryptcon import SCHANNEL_ENC_KEY
 
 if os.path.exists("C:\\Program Files\\Thorlabs\\Kinesis\\"):
+    import clr  # pythonnet, only required with Kinesis
     clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\Thorlabs.MotionControl.DeviceManagerCLI.dll")
     clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\Thorlabs.MotionControl.GenericMotorCLI.dll")
     clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\ThorLabs.MotionControl.Benchtop.StepperMotorCLI.dll")
@@ -87,6 +87,37 @@ if os.path.exists("C:\\Program Files\\Thorlabs\\Kinesis\\"):
             else:
                 print(f"la position choisie doit être comprise entre 0 et {round(float(self.parent.motor_max_pos), 3)}mm")
 
+        def start_move(self, position:float, offset:float = 0):
+            """
+            Start a move of the motor to the position, without waiting for its end.
+            :param position: desired position, in mm.
+            """
+            if float(self.parent.motor_max_pos) >= position >= 0:
+                self.channel.MoveTo(Decimal(position - offset), 0)  # 0 : no wait
+            else:
+                print(f"la position choisie doit être comprise entre 0 et {round(float(self.parent.motor_max_pos), 3)}mm")
+
+        def stop_motor(self):
+            """
+            Stop the current move.
+            """
+            self.channel.StopImmediate()
+
+        def is_moving(self):
+            return self.channel.IsDeviceBusy
+
+        def get_velocity(self):
+            return Decimal.ToDouble(self.channel.GetVelocityParams().MaxVelocity)
+
+        def set_velocity(self, velocity:float):
+            """
+            Set the velocity of the next moves.
+            :param velocity: Velocity, in mm/s.
+            """
+            velocity_params = self.channel.GetVelocityParams()
+            velocity_params.MaxVelocity = Decimal(velocity)
+            self.channel.SetVelocityParams(velocity_params)
+
         def set_motor_displacement(self, direction : bool, delta_z : float):
             """
             direction = 1 : up
@@ -118,8 +149,8 @@ if os.path.exists("C:\\Program Files\\Thorlabs\\Kinesis\\"):
             self.device.Disconnect()
 
         def get_position(self):
-            position = str(self.channel.DevicePosition).replace(',','.')
-            return float(position)
+            # .NET Decimal to float, without string parsing (decimal separator depends on the locale)
+            return Decimal.ToDouble(self.channel.DevicePosition)
 
         def find_motor(self):
             self.device.Connect(self.serial_no)
@@ -211,12 +242,29 @@ else:
         Class for controlling Thorlabs BSC20x step motor, through a DRV208 controller.
         """
 
-        def __init__(self, serial_no="40897338"):
+        def __init__(self, parent=None, serial_no="40897338"):
+            self.parent = parent
             self.serial_no = serial_no
             self.position = 3
+            self.velocity = 2.0
+
+        def move_motor(self, position: float, offset: float = 0, sleep_time=0.1):
+            self.position = position - offset
+
+        def start_move(self, position: float, offset: float = 0):
+            self.position = position - offset
+
+        def stop_motor(self):
+            pass
+
+        def is_moving(self):
+            return False
+
+        def get_velocity(self):
+            return self.velocity
 
-        def move_motor(self, position: float, sleep_time=0.1):
-            self.position = position
+        def set_velocity(self, velocity: float):
+            self.velocity = velocity
 
         def set_motor_displacement(self, direction: bool, delta_z: float):
             if direction == 1:
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""*phase_shifting.py* file.
+
+./models/phase_shifting.py contains PhaseShiftingDemodulator class to compute
+amplitude and phase maps from N phase-shifted interferograms.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import numpy as np
+
+# Each algorithm computes phase = atan2(num, den) and amplitude = scale * sqrt(num**2 + den**2),
+# num and den being linear combinations of the N images I_k = A + B.cos(phi + k.step).
+# 'weights' contains the coefficients of num (1st row) and den (2nd row).
+PHASE_ALGORITHMS = {
+    # Difference of 2 images, as in the first version of the application (no phase)
+    '2-step': {'weights': [[0, 0], [1, -1]], 'scale': 1.0, 'step': np.pi, 'phase': False},
+    # 3 images, step = pi/2
+    '3-step': {'weights': [[1, -2, 1], [1, 0, -1]], 'scale': 0.5, 'step': np.pi/2, 'phase': True},
+    # 4 images, step = pi/2
+    '4-step': {'weights': [[0, -1, 0, 1], [1, 0, -1, 0]], 'scale': 0.5, 'step': np.pi/2, 'phase': True},
+    # 5 images, step = 2.pi/5 (N-bucket)
+    '5-step': {'weights': [(-np.sin(2*np.pi*np.arange(5)/5)).tolist(), np.cos(2*np.pi*np.arange(5)/5).tolist()],
+               'scale': 2/5, 'step': 2*np.pi/5, 'phase': True},
+    # Hariharan (Schwider-Hariharan), 5 images, step = pi/2, insensitive to piezo miscalibration
+    'hariharan': {'weights': [[0, -2, 0, 2, 0], [1, 0, -2, 0, 1]], 'scale': 0.25, 'step': np.pi/2, 'phase': True},
+}
+
+
+class PhaseShiftingDemodulator:
+    """
+    N-step phase-shifting demodulation.
+
+    The N images are stored in a (N, H, W) float32 stack. num and den are
+    computed in one matrix product over the whole stack, then amplitude and
+    phase maps are written in preallocated arrays.
+    """
+
+    def __init__(self, algorithm: str = '2-step'):
+        """
+        Default constructor.
+        :param algorithm: Name of the algorithm, key of PHASE_ALGORITHMS.
+        """
+        if algorithm not in PHASE_ALGORITHMS:
+            raise ValueError(f'Unknown phase-shifting algorithm : {algorithm}')
+        params = PHASE_ALGORITHMS[algorithm]
+        self.algorithm = algorithm
+        self.weights = np.array(params['weights'], dtype=np.float32)
+        self.scale = params['scale']
+        self.phase_step = params['step']
+        self.has_phase = params['phase']
+        self.nb_steps = self.weights.shape[1]
+        self.shape = None
+        self.stack = None
+        self.amplitude = None
+        self.phase = None
+        self._num_den = None
+
+    def voltages(self, v0: float, dv: float) -> list:
+        """
+        Return the list of piezo voltages of one acquisition.
+        :param v0: Initial voltage of the piezo, in V.
+        :param dv: Voltage step between two images, in V. It must correspond
+            to the phase step of the algorithm (phase_step).
+        :return: List of nb_steps voltages.
+        """
+        return [v0 + k * dv for k in range(self.nb_steps)]
+
+    def allocate(self, shape: tuple):
+        """
+        Allocate the stack and the output maps (only if the shape changed).
+        :param shape: Shape of one image (height, width).
+        """
+        shape = tuple(shape)
+        if shape == self.shape:
+            return
+        self.shape = shape
+        self.stack = np.zeros((self.nb_steps,) + shape, dtype=np.float32)
+        self.amplitude = np.zeros(shape, dtype=np.float32)
+        self.phase = np.zeros(shape, dtype=np.float32)
+
+    def demodulate(self, stack: np.ndarray = None, amplitude: np.ndarray = None,
+                   phase: np.ndarray = None):
+        """
+        Compute the amplitude and the phase maps.
+        :param stack: (N, H, W) float32 contiguous stack. Default : self.stack.
+        :param amplitude: (H, W) float32 array to write the amplitude in. Default : self.amplitude.
+        :param phase: (H, W) float32 array to write the phase in (rad). Default : self.phase.
+            Not computed by the 2-step algorithm.
+        :return: amplitude and phase arrays.
+        """
+        if stack is None:
+            stack = self.stack
+        if amplitude is None or phase is None:
+            self.allocate(stack.shape[1:])
+        if amplitude is None:
+            amplitude = self.amplitude
+        if phase is None:
+            phase = self.phase
+        nb_pixels = stack.shape[1] * stack.shape[2]
+        if self._num_den is None or self._num_den.shape[1] != nb_pixels:
+            self._num_den = np.zeros((2, nb_pixels), dtype=np.float32)
+        num_den = self._num_den
+        np.matmul(self.weights, stack.reshape(self.nb_steps, -1), out=num_den)
+        num, den = num_den
+        if self.has_phase:
+            np.arctan2(num, den, out=phase.reshape(-1))
+        np.hypot(num, den, out=amplitude.reshape(-1))
+        if self.scale != 1.0:
+            amplitude *= self.scale
+        return amplitude, phase
+
+    def acquire(self, piezo, camera, accumulator, v0: float, dv: float, nb_images: int):
+        """
+        Drive the piezo through the voltage list, acquire and demodulate the images.
+        :param piezo: Piezo object (set_voltage_piezo).
+        :param camera: Camera (see frame_buffers.iter_frames).
+        :param accumulator: FrameAccumulator used to average the frames.
+        :param v0: Initial voltage of the piezo, in V.
+        :param dv: Voltage step between two images, in V.
+        :param nb_images: Number of averaged frames per image.
+        :return: amplitude and phase arrays.
+        """
+        for k, voltage in enumerate(self.voltages(v0, dv)):
+            piezo.set_voltage_piezo(voltage)
+            accumulator.grab(camera, nb_images)
+            self.allocate(accumulator.shape)
+            accumulator.mean(out=self.stack[k])
+        return self.demodulate()
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+"""*simulation.py* file.
+
+./models/simulation.py contains SimulatedCamera, SimulatedPiezo and SimulatedMotor
+classes, a hardware-free backend compatible with CameraBasler, Piezo and Motor.
+
+The camera renders synthetic full-field OCT interferograms of a layered sample
+from the current piezo voltage and motor position, with a limited frame rate,
+exposure-driven shot noise and a motion latency for the piezo and the motor.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import time
+import threading
+import numpy as np
+
+### Optical parameters of the simulated setup
+WAVELENGTH = 0.8e-3         # central wavelength, in mm
+COHERENCE_LENGTH = 5e-3     # coherence length of the source, in mm
+PIEZO_DISPLACEMENT = 0.1e-3 # displacement of the reference mirror, in mm/V
+### Sensor
+SENSOR_WIDTH = 1280
+SENSOR_HEIGHT = 1024
+MAX_GRAY_LEVEL = 4095       # Mono12
+FLUX = 1.3                  # mean signal of the reference arm, in gray levels per us of exposure
+READ_NOISE = 2.0            # in gray levels
+ROW_TIME = 9.5e-6           # readout time of a row of the sensor, in s (about 100 frames/s on the full sensor)
+
+
+class _SimulatedNode:
+    """Parameter of the simulated device (as pylon nodes : node.Value)."""
+
+    def __init__(self, value):
+        self.Value = value
+
+
+class _SimulatedBinningNode:
+    """Binning node of the simulated device : the AOI is rescaled when the binning changes, as on the camera."""
+
+    def __init__(self, device: "_SimulatedDevice", vertical: bool):
+        self.device = device
+        self.vertical = vertical
+        self._value = 1
+
+    @property
+    def Value(self) -> int:
+        return self._value
+
+    @Value.setter
+    def Value(self, value: int):
+        previous, self._value = self._value, int(value)
+        if self.device.camera is not None and previous != self._value:
+            self.device.camera.rescale_aoi(self.vertical, previous, self._value)
+
+
+class _SimulatedDevice:
+    """Minimal stand-in of the pylon InstantCamera (camera_device)."""
+
+    def __init__(self, camera: "SimulatedCamera" = None):
+        self.camera = camera
+        self.BinningVertical = _SimulatedBinningNode(self, vertical=True)
+        self.BinningHorizontal = _SimulatedBinningNode(self, vertical=False)
+        self.AcquisitionFrameRateEnable = _SimulatedNode(True)
+        self.is_open = False
+
+    @property
+    def ResultingFrameRate(self) -> _SimulatedNode:
+        return _SimulatedNode(self.camera.get_max_frame_rate())
+
+    def Open(self):
+        self.is_open = True
+
+    def Close(self):
+        self.is_open = False
+
+    def IsOpen(self) -> bool:
+        return self.is_open
+
+
+class SimulatedPiezo:
+    """
+    Simulated Thorlabs KPZ101 piezo controller.
+    The output voltage reaches its target with a first order response.
+    """
+
+    def __init__(self, serial_no: str = "SIM-PIEZO", settling_time: float = 0.002):
+        """
+        Default constructor.
+        :param serial_no: Serial number of the simulated device.
+        :param settling_time: Time constant of the piezo response, in s.
+        """
+        self.serial_no = serial_no
+        self.max_voltage = 75
+        self.settling_time = settling_time
+        self._lock = threading.Lock()
+        self._start_voltage = 0.0
+        self._target_voltage = 0.0
+        self._start_time = time.perf_counter()
+
+    def set_voltage_piezo(self, voltage: float, SleepTime=0.3):
+        """
+        Set a voltage to the piezo controller.
+        :param voltage: voltage, in V.
+        """
+        if 0 <= voltage <= self.max_voltage:
+            with self._lock:
+                self._start_voltage = self._voltage_at(time.perf_counter())
+                self._target_voltage = float(voltage)
+                self._start_time = time.perf_counter()
+
+    def _voltage_at(self, now: float) -> float:
+        """Effective voltage of the piezo at a given time."""
+        if self.settling_time <= 0:
+            return self._target_voltage
+        ratio = np.exp(-(now - self._start_time) / self.settling_time)
+        return self._target_voltage + (self._start_voltage - self._target_voltage) * ratio
+
+    def set_zero_piezo(self):
+        self.set_voltage_piezo(0)
+
+    def disconnect_piezo(self):
+        pass
+
+    def get_voltage(self) -> float:
+        with self._lock:
+            return self._voltage_at(time.perf_counter())
+
+    def find_piezo(self):
+        pass
+
+
+class SimulatedMotor:
+    """
+    Simulated Thorlabs BSC20x step motor.
+    The stage moves at a constant velocity and settles before the end of a move.
+    As with the real motor, move_motor is blocking.
+    """
+
+    def __init__(self, parent, serial_no: str = "SIM-MOTOR", velocity: float = 2.0,
+                 settling_time: float = 0.05, position: float = 0.0):
+        """
+        Default constructor.
+        :param parent: Main window of the application (motor_max_pos).
+        :param serial_no: Serial number of the simulated device.
+        :param velocity: Velocity of the stage, in mm/s.
+        :param settling_time: Settling time at the end of a move, in s.
+        :param position: Initial position, in mm.
+        """
+        self.parent = parent
+        self.serial_no = serial_no
+        self.velocity = velocity
+        self.settling_time = settling_time
+        self._lock = threading.Lock()
+        self._start_position = float(position)
+        self._target_position = float(position)
+        self._start_time = time.perf_counter()
+        self._duration = 0.0
+        self.pos = float(position)
+
+    def _start_move(self, position: float) -> float:
+        """Start a move to position and return its duration, in s."""
+        with self._lock:
+            now = time.perf_counter()
+            self._start_position = self._position_at(now)
+            self._target_position = float(position)
+            self._start_time = now
+            distance = abs(self._target_position - self._start_position)
+            self._duration = distance / self.velocity + self.settling_time
+            return self._duration
+
+    def _position_at(self, now: float) -> float:
+        """Position of the stage at a given time."""
+        travel_time = max(self._duration - self.settling_time, 0.0)
+        elapsed = now - self._start_time
+        if travel_time <= 0 or elapsed >= travel_time:
+            return self._target_position
+        return self._start_position + (self._target_position - self._start_position) * elapsed / travel_time
+
+    def is_moving(self) -> bool:
+        """Return True if the stage is moving or settling."""
+        with self._lock:
+            return time.perf_counter() - self._start_time < self._duration
+
+    def move_motor(self, position: float, offset: float = 0, sleep_time=0.1):
+        """
+        Move the motor to the position.
+        :param position: desired position, in mm.
+        """
+        if float(self.parent.motor_max_pos) >= position >= 0:
+            duration = self._start_move(position - offset)
+            time.sleep(duration)
+            self.pos = self.get_position()
+        else:
+            print(f"la position choisie doit être comprise entre 0 et {round(float(self.parent.motor_max_pos), 3)}mm")
+
+    def start_move(self, position: float, offset: float = 0):
+        """
+        Start a move of the motor to the position, without waiting for its end.
+        :param position: desired position, in mm.
+        """
+        if float(self.parent.motor_max_pos) >= position >= 0:
+            self._start_move(position - offset)
+        else:
+            print(f"la position choisie doit être comprise entre 0 et {round(float(self.parent.motor_max_pos), 3)}mm")
+
+    def stop_motor(self):
+        """Stop the current move."""
+        with self._lock:
+            now = time.perf_counter()
+            self._target_position = self._position_at(now)
+            self._start_position = self._target_position
+            self._start_time = now
+            self._duration = 0.0
+
+    def get_velocity(self) -> float:
+        return self.velocity
+
+    def set_velocity(self, velocity: float):
+        """
+        Set the velocity of the next moves.
+        :param velocity: Velocity, in mm/s.
+        """
+        self.velocity = float(velocity)
+
+    def set_motor_displacement(self, direction: bool, delta_z: float):
+        """
+        direction = 1 : up
+        direction = 0 : down
+        """
+        self.pos = self.get_position()
+        if direction:
+            self.move_motor(self.pos + delta_z)
+        else:
+            self.move_motor(self.pos - delta_z)
+
+    def home_motor(self, sleep_time=0.1):
+        self.move_motor(0)
+
+    def disconnect_motor(self):
+        pass
+
+    def get_position(self) -> float:
+        with self._lock:
+            return self._position_at(time.perf_counter())
+
+    def find_motor(self):
+        pass
+
+
+class SimulatedCamera:
+    """
+    Simulated Basler camera, compatible with lensecam CameraBasler.
+    Images are synthetic full-field OCT interferograms of a 3-layer sample.
+    """
+
+    def __init__(self, piezo: SimulatedPiezo = None, motor: SimulatedMotor = None,
+                 sample_position: float = 3.2, seed: int = 0):
+        """
+        Default constructor.
+        :param piezo: Piezo moving the reference mirror.
+        :param motor: Motor moving the sample.
+        :param sample_position: Motor position where the first layer is in focus, in mm.
+        :param seed: Seed of the noise generator.
+        """
+        self.piezo = piezo
+        self.motor = motor
+        self.sample_position = sample_position
+        self.camera_device = _SimulatedDevice(self)
+        self.sensor_width = SENSOR_WIDTH
+        self.sensor_height = SENSOR_HEIGHT
+        self.aoi = None             # (x0, y0, width, height) in binned pixels, None : full sensor
+        self.color_mode = 'Mono12'
+        self.exposure = 1000        # in us
+        self.frame_rate = 80.0      # in frames/s
+        self.acquiring = False
+        self.rng = np.random.default_rng(seed)
+        self._next_frame_time = 0.0
+        self._shape = None
+        self._illumination = None
+        self._layers = []
+        self._signal = None
+        self._noise = None
+
+    def set_devices(self, piezo: SimulatedPiezo, motor: SimulatedMotor):
+        """Set the piezo and the motor whose positions are used to render the images."""
+        self.piezo = piezo
+        self.motor = motor
+
+    # Camera management
+    def find_first_camera(self) -> bool:
+        return True
+
+    def init_camera(self, cam_dev=None):
+        pass
+
+    def get_cam_info(self) -> tuple:
+        return 'SIM-CAMERA', 'Simulated Camera'
+
+    def get_sensor_size(self) -> tuple:
+        """Return the size of the sensor with the current binning (as WidthMax, HeightMax)."""
+        height, width = self._binned_shape()
+        return width, height
+
+    def alloc_memory(self):
+        pass
+
+    def start_acquisition(self):
+        self.acquiring = True
+        self._next_frame_time = time.perf_counter()
+
+    def stop_acquisition(self):
+        self.acquiring = False
+
+    def disconnect(self):
+        self.acquiring = False
+
+    # Parameters
+    def set_color_mode(self, colormode: str):
+        self.color_mode = colormode
+
+    def get_color_mode(self) -> str:
+        return self.color_mode
+
+    def set_exposure(self, exposure: float):
+        """Set the exposure time, in us."""
+        self.exposure = float(exposure)
+
+    def get_exposure(self) -> float:
+        return self.exposure
+
+    def get_exposure_range(self) -> tuple:
+        return 20, 1000000
+
+    def set_frame_rate(self, fps: float):
+        self.frame_rate = float(fps)
+
+    def get_frame_rate(self) -> float:
+        """Return the frame rate that can be reached with the current settings."""
+        return min(self.frame_rate, self.get_max_frame_rate())
+
+    def get_max_frame_rate(self) -> float:
+        """Return the maximum frame rate : exposure time or readout of the rows of the AOI."""
+        rows = self._image_shape()[0] * int(self.camera_device.BinningVertical.Value)
+        return 1 / max(self.exposure * 1e-6, rows * ROW_TIME)
+
+    def set_aoi(self, x0: int, y0: int, w: int, h: int) -> bool:
+        """Set the area of interest, in binned pixels."""
+        height, width = self._binned_shape()
+        if x0 < 0 or y0 < 0 or x0 + w > width or y0 + h > height:
+            return False
+        self.aoi = (int(x0), int(y0), int(w), int(h))
+        return True
+
+    def get_aoi(self) -> tuple:
+        if self.aoi is None:
+            height, width = self._binned_shape()
+            return 0, 0, width, height
+        return self.aoi
+
+    def reset_aoi(self) -> bool:
+        """
+        Set the AOI to the sensor size without binning, as CameraBasler.reset_aoi
+        (width_max and height_max read at binning 1) : refused with binning.
+        """
+        return self.set_aoi(0, 0, self.sensor_width, self.sensor_height)
+
+    def rescale_aoi(self, vertical: bool, previous: int, binning: int):
+        """Rescale the AOI to a new binning in one direction, inside the binned sensor."""
+        if self.aoi is None:
+            return
+        x0, y0, width, height = self.aoi
+        max_height, max_width = self._binned_shape()
+        if vertical:
+            height = min(height * previous // binning, max_height)
+            y0 = min(y0 * previous // binning, max_height - height)
+        else:
+            width = min(width * previous // binning, max_width)
+            x0 = min(x0 * previous // binning, max_width - width)
+        self.aoi = (x0, y0, width, height)
+
+    def set_black_level(self, black_level: int):
+        pass
+
+    def get_black_level(self) -> int:
+        return 0
+
+    # Images
+    def _binned_shape(self) -> tuple:
+        binning_v = int(self.camera_device.BinningVertical.Value)
+        binning_h = int(self.camera_device.BinningHorizontal.Value)
+        return self.sensor_height // binning_v, self.sensor_width // binning_h
+
+    def _image_shape(self) -> tuple:
+        if self.aoi is None:
+            return self._binned_shape()
+        return self.aoi[3], self.aoi[2]
+
+    def _aoi_window(self) -> tuple:
+        """Slices of the AOI in the binned sensor."""
+        if self.aoi is None:
+            return slice(None), slice(None)
+        x0, y0, width, height = self.aoi
+        return slice(y0, y0 + height), slice(x0, x0 + width)
+
+    def _build_sample(self, shape: tuple):
+        """Build the illumination and the layers of the sample for a (binned) sensor shape."""
+        self._shape = shape
+        height, width = shape
+        y, x = np.mgrid[-1:1:height * 1j, -1:1:width * 1j].astype(np.float32)
+        self._illumination = (0.6 + 0.4 * np.exp(-(x**2 + y**2) / 0.8)).astype(np.float32)
+        z0 = self.sample_position
+        # Each layer : (depth map in mm, fringe visibility map)
+        surface = z0 + 0.002 * x + 0.001 * np.exp(-((x - 0.3)**2 + (y + 0.2)**2) / 0.05)
+        inner = z0 + 0.010 + 0.003 * np.sin(3 * x)
+        bottom = z0 + 0.025 + 0 * x
+        visibility_inner = 0.3 * (np.sin(8 * x) * np.sin(8 * y) > 0)
+        visibility_bottom = 0.2 * ((x**2 + y**2) < 0.3)
+        self._layers = [
+            (surface.astype(np.float32), np.full(shape, 0.4, dtype=np.float32)),
+            (inner.astype(np.float32), visibility_inner.astype(np.float32)),
+            (bottom.astype(np.float32), visibility_bottom.astype(np.float32)),
+        ]
+
+    def _wait_next_frame(self):
+        """Wait for the next frame, at the frame rate of the camera."""
+        period = 1.0 / self.get_frame_rate()
+        now = time.perf_counter()
+        if now < self._next_frame_time:
+            time.sleep(self._next_frame_time - now)
+            now = self._next_frame_time
+        self._next_frame_time = now + period
+
+    def render(self, piezo_voltage: float, motor_position: float) -> np.ndarray:
+        """
+        Render an interferogram.
+        :param piezo_voltage: Voltage of the piezo, in V.
+        :param motor_position: Position of the motor, in mm.
+        :return: uint16 image (Mono12 gray levels).
+        """
+        shape = self._binned_shape()
+        if shape != self._shape:
+            self._build_sample(shape)
+        window = self._aoi_window()
+        image_shape = self._image_shape()
+        if self._signal is None or self._signal.shape != image_shape:
+            self._signal = np.zeros(image_shape, dtype=np.float32)
+            self._noise = np.zeros(image_shape, dtype=np.float32)
+        signal = self._signal
+        signal.fill(1.0)
+        reference_shift = 4 * np.pi * piezo_voltage * PIEZO_DISPLACEMENT / WAVELENGTH
+        for depth, visibility in self._layers:
+            depth = depth[window]
+            visibility = visibility[window]
+            delta = depth - np.float32(motor_position)
+            if np.min(np.abs(delta)) > 4 * COHERENCE_LENGTH:
+                continue
+            envelope = np.exp(-(delta / COHERENCE_LENGTH)**2)
+            signal += visibility * envelope * np.cos(4 * np.pi * delta / WAVELENGTH + reference_shift)
+        counts = signal
+        counts *= self._illumination[window]
+        counts *= FLUX * self.exposure
+        # Shot noise (gain of 1 gray level per electron) and read noise
+        self.rng.standard_normal(out=self._noise, dtype=np.float32)
+        counts += self._noise * np.sqrt(np.maximum(counts, 0) + READ_NOISE**2)
+        np.clip(counts, 0, MAX_GRAY_LEVEL, out=counts)
+        return counts.astype(np.uint16)
+
+    def get_image(self) -> np.ndarray:
+        """Return the next image of the camera."""
+        self._wait_next_frame()
+        voltage = self.piezo.get_voltage() if self.piezo is not None else 0.0
+        position = self.motor.get_position() if self.motor is not None else self.sample_position
+        return self.render(float(voltage), float(position))
+
+    def get_images(self, nb_images: int = 1) -> list:
+        return [self.get_image() for _ in range(nb_images)]
+
+    def iter_images(self, nb_images: int = None):
+        """Stream nb_images images (None : continuous), at the frame rate of the camera (see frame_buffers.iter_frames)."""
+        count = 0
+        while nb_images is None or count < nb_images:
+            count += 1
+            yield self.get_image()
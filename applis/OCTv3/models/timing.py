@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""*timing.py* file.
+
+./models/timing.py contains StageTimings class to measure the duration of the
+stages of the OCT pipeline (piezo, grab, averaging, demodulation, conversion,
+display, save, motor), with rolling statistics and session histograms.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import csv
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+# Stages of the pipeline, in display order
+STAGES = ['piezo', 'grab', 'averaging', 'demodulation', 'uint8', 'qimage', 'save', 'motor', 'motor wait']
+# Number of durations kept for the rolling statistics of each stage
+ROLLING_LENGTH = 500
+# Bins of the session histograms, in s (log scale, from 10 us to 10 s)
+HISTOGRAM_BINS = np.logspace(-5, 1, 31)
+
+
+class StageTimings:
+    """
+    Durations of the stages of the OCT pipeline.
+
+    Each stage keeps its last ROLLING_LENGTH durations (rolling percentiles)
+    and a histogram of all the durations of the session (CSV export).
+    Durations can be added from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rolling = {}
+        self._histograms = {}
+        self._totals = {}
+        self.session_start = time.time()
+
+    def reset(self):
+        """Clear the durations of all the stages and start a new session."""
+        with self._lock:
+            self._rolling = {}
+            self._histograms = {}
+            self._totals = {}
+            self.session_start = time.time()
+
+    def add(self, stage: str, duration: float):
+        """
+        Add a duration to a stage.
+        :param stage: Name of the stage.
+        :param duration: Duration, in s.
+        """
+        with self._lock:
+            if stage not in self._rolling:
+                self._rolling[stage] = deque(maxlen=ROLLING_LENGTH)
+                self._histograms[stage] = np.zeros(len(HISTOGRAM_BINS) + 1, dtype=np.int64)
+                self._totals[stage] = 0.0
+            self._rolling[stage].append(duration)
+            self._histograms[stage][np.searchsorted(HISTOGRAM_BINS, duration)] += 1
+            self._totals[stage] += duration
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Measure the duration of a block of code.
+        Usage : with timings.measure('grab'): ...
+        :param stage: Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def stages(self) -> list:
+        """Return the measured stages, in pipeline order."""
+        with self._lock:
+            measured = list(self._rolling)
+        return [stage for stage in STAGES if stage in measured] + \
+               [stage for stage in measured if stage not in STAGES]
+
+    def statistics(self, stage: str) -> dict:
+        """
+        Return the statistics of a stage (durations in ms).
+        :param stage: Name of the stage.
+        :return: Dictionary : count (session), mean (session), p50, p90, p99 and max (rolling).
+        """
+        with self._lock:
+            values = np.array(self._rolling.get(stage, []))
+            count = int(self._histograms[stage].sum()) if stage in self._histograms else 0
+            total = self._totals.get(stage, 0.0)
+        if len(values) == 0:
+            return {'count': 0, 'mean': np.nan, 'p50': np.nan, 'p90': np.nan, 'p99': np.nan, 'max': np.nan}
+        p50, p90, p99 = np.percentile(values * 1000, [50, 90, 99])
+        return {'count': count, 'mean': total / count * 1000, 'p50': p50, 'p90': p90, 'p99': p99,
+                'max': values.max() * 1000}
+
+    def summary(self) -> str:
+        """Return a text table of the rolling statistics of all the stages."""
+        lines = [f"{'stage':13s}{'p50':>8s}{'p90':>8s}{'p99':>8s}  ms"]
+        for stage in self.stages():
+            stats = self.statistics(stage)
+            lines.append(f"{stage:13s}{stats['p50']:8.2f}{stats['p90']:8.2f}{stats['p99']:8.2f}")
+        return '\n'.join(lines)
+
+    def export_csv(self, file_path: str):
+        """
+        Write the statistics and the session histogram of each stage in a CSV file.
+        :param file_path: Path of the CSV file.
+        """
+        edges = [f'<{edge * 1000:.3g}ms' for edge in HISTOGRAM_BINS] + [f'>={HISTOGRAM_BINS[-1] * 1000:.3g}ms']
+        with open(file_path, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(['session start', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.session_start))])
+            writer.writerow(['stage', 'count', 'mean (ms)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)'] + edges)
+            for stage in self.stages():
+                stats = self.statistics(stage)
+                with self._lock:
+                    histogram = self._histograms[stage].tolist()
+                writer.writerow([stage, stats['count']] +
+                                [f"{stats[key]:.3f}" for key in ['mean', 'p50', 'p90', 'p99', 'max']] + histogram)
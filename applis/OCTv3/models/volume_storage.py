@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""*volume_storage.py* file.
+
+./models/volume_storage.py contains VolumeWriter class and load_volume function
+to store an OCT z-stack in a single memory-mapped .npy file (float32 data)
+with a JSON sidecar file (acquisition parameters and per-slice metadata),
+and VolumeWriterThread class to write the slices in a background thread.
+
+Files of a volume named 'sample' :
+    sample.npy  : (nb_slices, height, width) float32 array
+    sample.json : {'format', 'version', 'shape', 'dtype', 'nb_slices_written',
+                   'parameters' : {...}, 'slices' : [{'index', 'z', 'piezo_v0', ...}, ...]}
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+VOLUME_FORMAT = 'OCT volume'
+VOLUME_VERSION = 1
+# The sidecar file is rewritten every SIDECAR_PERIOD slices (and when the volume is closed)
+SIDECAR_PERIOD = 10
+# Maximum number of slices waiting to be written by VolumeWriterThread
+WRITER_QUEUE_SIZE = 8
+
+
+class VolumeWriter:
+    """
+    Append the slices of a z-stack to a single memory-mapped .npy file.
+    The file is created when the first slice is appended (its shape is known then).
+    """
+
+    def __init__(self, file_path: str, nb_slices: int, parameters: dict = None):
+        """
+        Default constructor.
+        :param file_path: Path of the volume, without extension.
+        :param nb_slices: Maximum number of slices of the volume.
+        :param parameters: Acquisition parameters to store in the sidecar file.
+        """
+        self.file_path = os.path.splitext(file_path)[0]
+        self.nb_slices = int(nb_slices)
+        self.parameters = parameters if parameters is not None else {}
+        self.slices = []
+        self.volume = None
+
+    @property
+    def data_path(self) -> str:
+        return self.file_path + '.npy'
+
+    @property
+    def sidecar_path(self) -> str:
+        return self.file_path + '.json'
+
+    @property
+    def nb_slices_written(self) -> int:
+        return len(self.slices)
+
+    def append(self, image: np.ndarray, **metadata):
+        """
+        Append a slice to the volume.
+        :param image: 2D image of the slice (stored as float32, without quantization).
+        :param metadata: Metadata of the slice (z, piezo_v0, piezo_dv, exposure, averaging...).
+        """
+        index = self.nb_slices_written
+        if index >= self.nb_slices:
+            raise IndexError(f'VolumeWriter : the volume is limited to {self.nb_slices} slices')
+        if self.volume is None:
+            self.volume = np.lib.format.open_memmap(self.data_path, mode='w+', dtype=np.float32,
+                                                    shape=(self.nb_slices,) + image.shape)
+        self.volume[index] = image
+        slice_metadata = {'index': index}
+        slice_metadata.update({key: _to_json(value) for key, value in metadata.items()})
+        self.slices.append(slice_metadata)
+        if self.nb_slices_written % SIDECAR_PERIOD == 0:
+            self.flush()
+
+    def flush(self):
+        """Write the data on the disk and update the sidecar file."""
+        if self.volume is not None:
+            self.volume.flush()
+        sidecar = {
+            'format': VOLUME_FORMAT,
+            'version': VOLUME_VERSION,
+            'data': os.path.basename(self.data_path),
+            'dtype': 'float32',
+            'shape': list(self.volume.shape) if self.volume is not None else [],
+            'nb_slices_written': self.nb_slices_written,
+            'parameters': {key: _to_json(value) for key, value in self.parameters.items()},
+            'slices': self.slices,
+        }
+        with open(self.sidecar_path, 'w', encoding='utf-8') as file:
+            json.dump(sidecar, file, indent=1)
+
+    def close(self):
+        """Flush and close the volume."""
+        self.flush()
+        self.volume = None
+
+
+class VolumeWriterThread(threading.Thread):
+    """
+    Background writer of a VolumeWriter.
+
+    Slices are copied in pooled buffers and sent through a bounded queue,
+    so the caller (GUI thread) never waits for the disk, except when the
+    queue is full (backpressure). stop() writes all the queued slices
+    before closing the volume.
+    """
+
+    def __init__(self, writer: VolumeWriter, max_queue: int = WRITER_QUEUE_SIZE, timings=None):
+        """
+        Default constructor.
+        :param writer: Volume to write the slices in.
+        :param max_queue: Maximum number of slices waiting to be written.
+        :param timings: Optional StageTimings to add the duration of each write in ('save').
+        """
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.max_queue = max_queue
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._free_buffers = queue.Queue()
+        self.nb_written = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+        self.error = None           # exception of the writing, the writer stops at the first error
+        self.timings = timings
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of slices waiting to be written."""
+        return self.queue.qsize()
+
+    @property
+    def throughput(self) -> float:
+        """Writing throughput, in MB/s (0 before the first slice)."""
+        if self.write_time == 0:
+            return 0.0
+        return self.bytes_written / self.write_time / 1024**2
+
+    def submit(self, image: np.ndarray, **metadata) -> bool:
+        """
+        Send a slice to the writer. The image is copied, so the caller can reuse it.
+        Block while the queue is full (backpressure).
+        :param image: 2D image of the slice.
+        :param metadata: Metadata of the slice (see VolumeWriter.append).
+        :return: False if the writer is not running anymore (see error), the slice is not written.
+        """
+        if self.error is not None:
+            return False
+        try:
+            buffer = self._free_buffers.get_nowait()
+        except queue.Empty:
+            buffer = None
+        if buffer is None or buffer.shape != image.shape:
+            buffer = np.empty(image.shape, dtype=np.float32)
+        np.copyto(buffer, image, casting='unsafe')
+        while self.is_alive():
+            try:
+                self.queue.put((buffer, metadata), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                buffer, metadata = item
+                start = time.perf_counter()
+                self.writer.append(buffer, **metadata)
+                duration = time.perf_counter() - start
+                self.write_time += duration
+                if self.timings is not None:
+                    self.timings.add('save', duration)
+                self.nb_written += 1
+                self.bytes_written += buffer.nbytes
+                self._free_buffers.put(buffer)
+        except Exception as e:
+            self.error = e
+            print(f'Volume writer / {e}')
+        finally:
+            self.writer.close()
+
+    def stop(self):
+        """Write the remaining slices and close the volume."""
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+
+def _to_json(value):
+    """Convert numpy scalars to Python types."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def load_volume(file_path: str, mode: str = 'r'):
+    """
+    Open a volume written by VolumeWriter.
+    :param file_path: Path of the volume (with or without extension).
+    :param mode: Memory-map mode ('r', 'r+' or 'c').
+    :return: (volume, sidecar) : memory-mapped array of the written slices and sidecar dictionary.
+    """
+    file_path = os.path.splitext(file_path)[0]
+    with open(file_path + '.json', 'r', encoding='utf-8') as file:
+        sidecar = json.load(file)
+    volume = np.load(file_path + '.npy', mmap_mode=mode)
+    return volume[:sidecar['nb_slices_written']], sidecar
+
+
+def export_tiff(file_path: str, directory: str = None, scale: float = 16):
+    """
+    Export a volume as one 16-bit TIFF file per slice (for ImageJ).
+    :param file_path: Path of the volume (with or without extension).
+    :param directory: Destination directory. Default : directory of the volume.
+    :param scale: Factor applied before the conversion to uint16.
+    """
+    from PIL import Image
+    file_path = os.path.splitext(file_path)[0]
+    volume, sidecar = load_volume(file_path)
+    if directory is None:
+        directory = os.path.dirname(file_path)
+    name = os.path.basename(file_path)
+    for k in range(volume.shape[0]):
+        image = np.clip(volume[k] * scale, 0, 65535).astype(np.uint16)
+        Image.fromarray(image).save(os.path.join(directory, f'{name}_{k + 1}.tiff'))
@@ -15,8 +15,11 @@ https://iogs-lense-ressources.github.io/camera-gui/
 .. moduleauthor:: Julien MOREAU () <julien.moreau@institutoptique.fr>
 """
 import sys, os
+import time
 import numpy as np
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
+# Modules shared by the applications (lense_common)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from lensepy import load_dictionary, translate, dictionary
 from PyQt6.QtWidgets import (
     QWidget, QPushButton,
@@ -28,7 +31,15 @@ from lensepy.pyqt6.widget_image_display import ImageDisplayWidget
 from views.main_view import MainView
 from lensecam.basler.camera_basler import CameraBasler, get_bits_per_pixel
 from models.motor_control import *
+from models.simulation import SimulatedCamera, SimulatedPiezo, SimulatedMotor
+from models.motion import MotorMotion
+from models.camera_settings import SensorSettings
+from models.calibration import CalibrationCache
 from controllers.modes_manager import ModesController
+from models.frame_buffers import FrameRing
+from models.images_acquisition import FRAME_RING_SIZE
+from models.timing import StageTimings
+from models.acquisition_parameters import AcquisitionParameters, AcquisitionParametersModel
 
 def load_default_dictionary(language: str) -> bool:
     """Initialize default dictionary from default_config.txt file"""
@@ -76,31 +87,53 @@ class MainWindow(QMainWindow):
         QMainWindow (class): QMainWindow can contain several widgets.
     """
 
-    def __init__(self):
+    def __init__(self, parameters: dict = None):
         """
         Initialisation of the main Window.
+        :param parameters: Parameters overriding the ones of the config.txt file.
         """
         super().__init__()
         load_default_dictionary('FR')
         # Read default parameters
         self.default_parameters = load_default_parameters('./assets/config.txt')
+        if parameters is not None:
+            self.default_parameters.update(parameters)
 
         # Main objects
         # ------------
         self.piezo = None
         self.step_motor = None
+        self.motion = None
         self.camera = None
+        self.sensor = None
+        # Dark and flat-field calibration of the current camera setting (FrameCalibration or None)
+        self.calibration_cache = None
+        self.calibration = None
         self.camera_connected = False
         self.camera_acquiring = False
-        self.image1 = None
-        self.image2 = None
-        self.image_oct = None
+        # Simulated camera, piezo and step motor (no hardware required)
+        self.simulated_devices = self.default_parameters.get('SimulatedDevices', '0') == '1'
+        # Preallocated frames shared by the acquisition worker and the display
+        self.frame_ring = FrameRing(FRAME_RING_SIZE)
+        # Durations of the pipeline stages (overlay and CSV export at the end of the session)
+        self.timings = StageTimings()
+        self.performance_hud = self.default_parameters.get('PerformanceHUD', '0') == '1'
+        self.timings_export = self.default_parameters.get('TimingsExport', '0') == '1'
 
         self.image_bits_depth = 12
+        self.binning = 2
+        if 'Binning' in self.default_parameters:
+            self.binning = int(self.default_parameters['Binning'])
 
         # Main variables
         if 'PiezoDV' in self.default_parameters:
             self.piezo_step_size = float(self.default_parameters['PiezoDV'])
+        self.phase_algorithm = '2-step'
+        if 'PhaseAlgorithm' in self.default_parameters:
+            self.phase_algorithm = self.default_parameters['PhaseAlgorithm']
+        self.display_max_rate = 30
+        if 'DisplayMaxRate' in self.default_parameters:
+            self.display_max_rate = float(self.default_parameters['DisplayMaxRate'])
         if 'PiezoV0' in self.default_parameters:
             self.piezo_V0 = float(self.default_parameters['PiezoV0'])
         if 'StepperInitPosition' in self.default_parameters:
@@ -113,6 +146,7 @@ class MainWindow(QMainWindow):
             self.min_expo_value = self.default_parameters['MinExpoTime']
         if 'ExposureTime' in self.default_parameters:
             self.ini_expo_value = self.default_parameters['ExposureTime']
+        self.auto_exposure = self.default_parameters.get('AutoExposure', '0') == '1'
         if 'NumberAvgdImages' in self.default_parameters:
             self.number_avgd_images = self.default_parameters['NumberAvgdImages']
         if 'MotorMaxPos' in self.default_parameters:
@@ -142,6 +176,10 @@ class MainWindow(QMainWindow):
                                 padding: 8px 16px;
                             }"""
 
+        self.calibration_dir = './calibration'
+        if 'CalibrationDir' in self.default_parameters:
+            self.calibration_dir = self.default_parameters['CalibrationDir']
+
         self.dir_images = os.path.expanduser("~")
         if 'DirImages' in self.default_parameters:
             self.dir_images = self.default_parameters['DirImages']
@@ -153,6 +191,7 @@ class MainWindow(QMainWindow):
 
         # Initialization
         self.init_app()
+        self.acquisition_parameters = AcquisitionParametersModel(self.init_acquisition_parameters())
         self.controller = ModesController(self)
 
     def init_app(self):
@@ -162,7 +201,10 @@ class MainWindow(QMainWindow):
         # Initialization of the camera
         # ----------------------------
         print('Camera Initialization')
-        self.camera = CameraBasler()
+        if self.simulated_devices:
+            self.camera = SimulatedCamera()
+        else:
+            self.camera = CameraBasler()
         self.camera_connected = self.camera.find_first_camera()
         if self.camera_connected:
             self.camera.init_camera()
@@ -171,15 +213,12 @@ class MainWindow(QMainWindow):
                 self.camera.set_exposure(float(self.default_parameters['Exposure Time'])*1000)  # in us
             else:
                 self.camera.set_exposure(1000) # in us
-            self.camera.set_frame_rate(80)
-
-            print(f'FPS = {self.camera.get_frame_rate()}')
             self.image_bits_depth = get_bits_per_pixel(self.camera.get_color_mode())
-            # Binning 2x2
-            self.camera.camera_device.Open()
-            self.camera.camera_device.BinningVertical.Value = 2
-            self.camera.camera_device.BinningHorizontal.Value = 2
-            self.camera.camera_device.Close()
+            # Binning and AOI, at the maximum frame rate
+            self.sensor = SensorSettings(self.camera)
+            self.sensor.apply(binning=self.binning)
+            print(f'FPS = {self.camera.get_frame_rate()}')
+            self.calibration_cache = CalibrationCache(self.calibration_dir, self.camera.get_cam_info()[0])
 
             print(f'Color mode = {self.image_bits_depth}')
         else:
@@ -196,7 +235,9 @@ class MainWindow(QMainWindow):
         # Initialization of the piezo
         # ---------------------------
         print('Piezo Initialization')
-        if 'PiezoSN' in self.default_parameters:
+        if self.simulated_devices:
+            self.piezo = SimulatedPiezo()
+        elif 'PiezoSN' in self.default_parameters:
             self.piezo = Piezo(serial_no=self.default_parameters['PiezoSN'])
         else:
             self.piezo = Piezo()
@@ -206,7 +247,10 @@ class MainWindow(QMainWindow):
         # Initialization of the step motor
         # --------------------------------
         print('Step Motor Initialization')
-        if 'StepSN' in self.default_parameters:
+        if self.simulated_devices:
+            self.step_motor = SimulatedMotor(self)
+            self.camera.set_devices(self.piezo, self.step_motor)
+        elif 'StepSN' in self.default_parameters:
             self.step_motor = Motor(self, serial_no=self.default_parameters['StepSN'])
         else:
             self.step_motor = Motor(self)
@@ -216,19 +260,39 @@ class MainWindow(QMainWindow):
             position = float(self.default_parameters['StepperInitPosition'])
         else:
             position = 3.2
-        self.step_motor.move_motor(position)
-        new_position = self.step_motor.get_position()
-        print(f'Step Motor moved to position {new_position} mm')
+        self.motion = MotorMotion(self.step_motor, float(self.motor_max_pos))
+        result = self.acquisition_update(position)
+        if result is not None:
+            print(f'Step Motor moved to position {result.position} mm')
 
         # At the end, start LIVE mode
 
+    def init_acquisition_parameters(self) -> AcquisitionParameters:
+        """Return the initial acquisition parameters (config.txt file and camera)."""
+        if self.camera_connected:
+            exposure = self.camera.get_exposure()
+        else:
+            exposure = float(self.ini_expo_value)
+        return AcquisitionParameters(nb_averaged=int(self.number_avgd_images),
+                                     nb_slices=int(self.init_acq_step_num),
+                                     z_step=float(self.init_acq_step_size) * 0.001,
+                                     piezo_v0=self.piezo_V0, piezo_dv=self.piezo_step_size,
+                                     exposure=exposure, auto_exposure=self.auto_exposure,
+                                     phase_algorithm=self.phase_algorithm)
+
     def acquisition_update(self,consigne, tolerance = 0.1, timeout = 300):
-        self.step_motor.move_motor(consigne)
-        a = 0
-        print(consigne)
-        while(self.step_motor.get_position() - consigne > tolerance and a < timeout):
-            a+=1
-            time.sleep(0.01)
+        """
+        Move the step motor and wait until its position is within tolerance.
+        :param consigne: Requested position, in mm.
+        :param tolerance: Maximum distance to the requested position, in mm.
+        :param timeout: Maximum duration of the move, in s.
+        :return: MotionResult of the move, None if the move failed.
+        """
+        try:
+            return self.motion.move_to(consigne, tolerance).result(timeout)
+        except Exception as e:
+            print(f'Step Motor / {e}')
+            return None
 
 
     def resizeEvent(self, event):
@@ -258,6 +322,11 @@ class MainWindow(QMainWindow):
                 self.camera.disconnect()
             if self.piezo is not None:
                 self.piezo.disconnect_piezo()
+            if self.timings_export:
+                file_name = time.strftime('timings_%Y%m%d_%H%M%S.csv', time.localtime(self.timings.session_start))
+                self.timings.export_csv(os.path.join(self.dir_images, file_name))
+            if self.motion is not None:
+                self.motion.shutdown()
             if self.step_motor is not None:
                 self.step_motor.disconnect_motor()
             event.accept()
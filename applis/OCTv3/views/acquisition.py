@@ -4,7 +4,7 @@ import sys
 from lensepy.css import *
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout,
-    QLabel,  QPushButton,
+    QLabel,  QPushButton, QComboBox,
     QSizePolicy, QProgressBar, QHBoxLayout, QApplication, QLineEdit)
 from PyQt6.QtCore import Qt, pyqtSignal
 
@@ -30,6 +30,7 @@ class AcquisitionView(QWidget):
         name_layout = QHBoxLayout()
         step_size_layout = QHBoxLayout()
         step_num_layout = QHBoxLayout()
+        mode_layout = QHBoxLayout()
         buttons_layout = QHBoxLayout()
 
         self.title = QLabel("Acquisition Mode")
@@ -98,6 +99,20 @@ class AcquisitionView(QWidget):
         step_num_layout.addWidget(self.step_num_label)
         step_num_layout.addWidget(self.step_num)
 
+        ### Mode : stop and go or fly-scan
+
+        self.mode_label = QLabel("Scan mode : ")
+        self.mode_label.setStyleSheet(styleH3)
+        self.mode_label.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
+
+        self.mode = QComboBox()
+        self.mode.addItem("Step", "step")
+        self.mode.addItem("Fly-scan", "fly")
+        self.mode.currentIndexChanged.connect(self.step_action)
+
+        mode_layout.addWidget(self.mode_label)
+        mode_layout.addWidget(self.mode)
+
         ### start/stop
 
         self.start_button = QPushButton("Start")
@@ -121,14 +136,19 @@ class AcquisitionView(QWidget):
         self.progress_bar.setStyleSheet(StyleSheet)
         self.progress_bar.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
+        self.writer_status = QLabel("")
+        self.writer_status.setStyleSheet(styleH3)
+
         layout.addWidget(self.title)
         layout.addLayout(directory_layout)
         layout.addWidget(self.directory)
         layout.addLayout(name_layout)
         layout.addLayout(step_size_layout)
         layout.addLayout(step_num_layout)
+        layout.addLayout(mode_layout)
         layout.addLayout(buttons_layout)
         layout.addWidget(self.progress_bar)
+        layout.addWidget(self.writer_status)
         layout.addSpacing(40)
 
         self.setLayout(layout)
@@ -142,6 +162,15 @@ class AcquisitionView(QWidget):
         bar_progress = int(progression * 100)
         self.progress_bar.setValue(bar_progress)
 
+    def update_writer_status(self, queue_depth: int, max_queue: int, throughput: float):
+        """
+        Display the state of the disk writer.
+        :param queue_depth: Number of slices waiting to be written.
+        :param max_queue: Maximum number of waiting slices.
+        :param throughput: Writing throughput in MB/s.
+        """
+        self.writer_status.setText(f"Disk queue : {queue_depth}/{max_queue} - {throughput:.1f} MB/s")
+
     def set_start_enabled(self, value: bool):
         """Set the start button enabled."""
         if value:
@@ -177,6 +206,9 @@ class AcquisitionView(QWidget):
         elif sender == self.step_num:
             self.acqThread.emit("StepNum=" + self.step_num.text())
             print(f"the number of steps has been updated")
+        elif sender == self.mode:
+            self.acqThread.emit("Mode=" + self.mode.currentData())
+            print(f"the scan mode has been updated")
         elif sender == self.start_button:
             self.acqThread.emit("Start=")
             print(f"the acquisition has begun")
@@ -189,6 +221,7 @@ class AcquisitionView(QWidget):
         self.search.setEnabled(activation)
         self.step_size.setEnabled(activation)
         self.step_num.setEnabled(activation)
+        self.mode.setEnabled(activation)
 
 
 if __name__ == "__main__":
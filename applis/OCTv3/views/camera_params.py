@@ -4,7 +4,7 @@ import sys
 from PyQt6.QtWidgets import (
     QWidget, QGridLayout, QVBoxLayout,
     QLabel, QComboBox, QPushButton, QFrame,
-    QSizePolicy, QSpacerItem, QMainWindow, QHBoxLayout, QApplication, QSlider, QLineEdit)
+    QSizePolicy, QSpacerItem, QMainWindow, QHBoxLayout, QApplication, QSlider, QLineEdit, QCheckBox)
 from PyQt6.QtCore import Qt, pyqtSignal
 from lensepy.css import *
 
@@ -16,6 +16,8 @@ if __name__ == '__main__':
 class CameraParamsView(QWidget):
 
     camera_exposure_changed = pyqtSignal(str)
+    sensor_changed = pyqtSignal(str)
+    calibration_requested = pyqtSignal(str)
 
     def __init__(self, parent = None):
         super().__init__()
@@ -44,8 +46,13 @@ class CameraParamsView(QWidget):
         self.int_time_value.setFixedWidth(50)  # largeur fixe pour garder l'alignement stable
         self.int_time_value.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
 
+        self.auto_exposure = QCheckBox("Auto")
+        self.auto_exposure.setChecked(bool(self.parent.auto_exposure))
+        self.auto_exposure.toggled.connect(self.update_auto_exposure)
+
         layout_int_time.addWidget(self.int_time_label)
         layout_int_time.addWidget(self.int_time_value)
+        layout_int_time.addWidget(self.auto_exposure)
 
         self.num_label = QLabel("Number of images (mean) : ")
         self.num_label.setStyleSheet(styleH3)
@@ -58,6 +65,42 @@ class CameraParamsView(QWidget):
         layout_num.addWidget(self.num_label)
         layout_num.addWidget(self.num_value)
 
+        ### Binning and AOI of the sensor
+        layout_binning = QHBoxLayout()
+        layout_aoi = QHBoxLayout()
+        self.binning_label = QLabel("Binning : ")
+        self.binning_label.setStyleSheet(styleH3)
+        self.binning_label.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
+        self.binning = QComboBox()
+        for binning in [1, 2, 4]:
+            self.binning.addItem(f"{binning}x{binning}", binning)
+        self.binning.setCurrentIndex(max(self.binning.findData(int(self.parent.binning)), 0))
+        self.binning.currentIndexChanged.connect(self.sensor_action)
+
+        layout_binning.addWidget(self.binning_label)
+        layout_binning.addWidget(self.binning)
+
+        self.aoi_select = QPushButton("Select AOI")
+        self.aoi_select.clicked.connect(self.sensor_action)
+        self.aoi_reset = QPushButton("Full sensor")
+        self.aoi_reset.clicked.connect(self.sensor_action)
+        layout_aoi.addWidget(self.aoi_select)
+        layout_aoi.addWidget(self.aoi_reset)
+
+        self.frame_rate_label = QLabel("Max frame rate : -")
+        self.frame_rate_label.setStyleSheet(styleH3)
+
+        ### Dark and flat-field calibration
+        layout_calibration = QHBoxLayout()
+        self.dark_button = QPushButton("Dark")
+        self.dark_button.clicked.connect(self.calibration_action)
+        self.flat_button = QPushButton("Reference arm")
+        self.flat_button.clicked.connect(self.calibration_action)
+        layout_calibration.addWidget(self.dark_button)
+        layout_calibration.addWidget(self.flat_button)
+        self.calibration_label = QLabel("Calibration : none")
+        self.calibration_label.setStyleSheet(styleH3)
+
         # Créer un slider horizontal
         self.slider = QSlider(Qt.Orientation.Horizontal)
         self.slider.setMinimum(self.min_expo_value)
@@ -66,12 +109,18 @@ class CameraParamsView(QWidget):
         self.slider.setTickPosition(QSlider.TickPosition.TicksBelow)
         self.slider.setTickInterval(int((self.max_expo_value - self.min_expo_value)/20))
         self.slider.valueChanged.connect(self.update_slider)
+        self.slider.setEnabled(not self.auto_exposure.isChecked())
 
         # Ajouter le slider au layout
         layout.addWidget(self.title)
         layout.addLayout(layout_int_time)
         layout.addWidget(self.slider)
         layout.addLayout(layout_num)
+        layout.addLayout(layout_binning)
+        layout.addLayout(layout_aoi)
+        layout.addWidget(self.frame_rate_label)
+        layout.addLayout(layout_calibration)
+        layout.addWidget(self.calibration_label)
         layout.addSpacing(40)
 
         # Appliquer le layout à la fenêtre
@@ -85,15 +134,56 @@ class CameraParamsView(QWidget):
             print("integration time changed")
         self.camera_exposure_changed.emit("int=" + str(tint))
 
+    def update_auto_exposure(self, checked: bool):
+        self.slider.setEnabled(not checked)
+        self.camera_exposure_changed.emit("auto=" + ("1" if checked else "0"))
+
+    def set_exposure(self, exposure: float):
+        """Display an exposure time set by the auto-exposure, without emitting a change."""
+        self.slider.blockSignals(True)
+        self.slider.setValue(int(exposure))
+        self.slider.blockSignals(False)
+        self.int_time_value.setText(str(int(exposure)) + " us")
+
     def update_num(self):
         if __name__ == "__main__":
             print("Number of averaged images changed")
         self.camera_exposure_changed.emit("num=" + self.num_value.text())
 
+    def sensor_action(self):
+        sender = self.sender()
+        if sender == self.binning:
+            self.sensor_changed.emit("binning=" + str(self.binning.currentData()))
+        elif sender == self.aoi_select:
+            self.sensor_changed.emit("aoi=select")
+        elif sender == self.aoi_reset:
+            self.sensor_changed.emit("aoi=reset")
+
+    def calibration_action(self):
+        sender = self.sender()
+        if sender == self.dark_button:
+            self.calibration_requested.emit("dark")
+        elif sender == self.flat_button:
+            self.calibration_requested.emit("flat")
+
+    def update_calibration(self, text: str):
+        """Display the calibration of the current camera setting."""
+        self.calibration_label.setText(f"Calibration : {text}")
+
+    def update_frame_rate(self, frame_rate: float):
+        """Display the maximum frame rate of the camera."""
+        self.frame_rate_label.setText(f"Max frame rate : {frame_rate:.1f} fps")
+
     def moderate_interactions(self, activation : bool):
         self.int_time_value.setEnabled(activation)
-        self.slider.setEnabled(activation)
+        self.slider.setEnabled(activation and not self.auto_exposure.isChecked())
+        self.auto_exposure.setEnabled(activation)
         self.num_value.setEnabled(activation)
+        self.binning.setEnabled(activation)
+        self.aoi_select.setEnabled(activation)
+        self.aoi_reset.setEnabled(activation)
+        self.dark_button.setEnabled(activation)
+        self.flat_button.setEnabled(activation)
 
 
 if __name__ == "__main__":
@@ -17,10 +17,67 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QGraphicsView,
                              QGraphicsScene, QGraphicsPixmapItem, QGraphicsTextItem,
                              QVBoxLayout, QWidget)
 from PyQt6.QtGui import QPixmap, QImage, QPainter, QColor, QWheelEvent, QFont
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QObject
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QObject, QRectF
+
+
+class ImageDownsampler:
+    """
+    Box-filter downsampling of uint8 images by an integer factor.
+    The output buffers are cached and reallocated only when the image shape
+    or the factor changes. The last rows and columns that do not fill a
+    block are dropped : factor is the factor applied by the last call.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.factor = 1
+        self._sum = None
+        self._out = None
+
+    def downsample(self, image: np.ndarray, factor: int) -> np.ndarray:
+        """
+        Average each factor x factor block of pixels.
+        :param image: 2D uint8 image.
+        :param factor: Downsampling factor (1 : no downsampling).
+        :return: Downsampled image (cached buffer, valid until the next call).
+        """
+        self.factor = 1
+        if factor <= 1:
+            return image
+        h, w = image.shape
+        hh, ww = h // factor, w // factor
+        if hh == 0 or ww == 0:
+            return image
+        self.factor = factor
+        key = (h, w, factor)
+        if key != self.key:
+            self.key = key
+            self._sum = np.empty((hh, ww), dtype=np.uint32)
+            self._out = np.empty((hh, ww), dtype=np.uint8)
+        blocks = image[:hh * factor, :ww * factor].reshape(hh, factor, ww, factor)
+        np.sum(blocks, axis=(1, 3), dtype=np.uint32, out=self._sum)
+        np.floor_divide(self._sum, factor * factor, out=self._out, casting='unsafe')
+        return self._out
 
 
 class ImageDisplayGraph(QWidget):
+    """
+    Display of an image in a QGraphicsView, with an optional text below it.
+
+    The pixmap item and the text item are created once : each new frame
+    only replaces the pixmap. The view is fitted to the image only when
+    the image size changes or when the widget is resized.
+
+    Images are downsampled to the on-screen size before the QImage
+    conversion. The pixmap item is scaled by the same factor, so scene
+    coordinates are always full-resolution pixels. Full resolution is
+    only used when the view is zoomed in.
+
+    After set_roi_selection(True), a rectangle dragged on the image is
+    emitted by roi_selected, as (x, y, width, height) in image pixels.
+    """
+    roi_selected = pyqtSignal(tuple)
+
     def __init__(self, parent=None, bg_color='white', zoom: bool = True):
         super().__init__(parent)
         self.layout = QVBoxLayout()
@@ -35,25 +92,84 @@ class ImageDisplayGraph(QWidget):
         self.zoom = zoom
         self.zoom_factor = 1.1
 
+        # Items of the scene, reused for each frame
+        self.pixmap_item = QGraphicsPixmapItem()
+        self.scene.addItem(self.pixmap_item)
+        self.text_item = QGraphicsTextItem()
+        self.text_item.setFont(QFont('Arial', 3))
+        self.text_item.setDefaultTextColor(QColor(0, 0, 0))  # Set the color to black
+        self.scene.addItem(self.text_item)
+        self.image_size = None
+        self.downsampler = ImageDownsampler()
+        self.display_factor = 1
+        # Selection of a region of interest (rubber band)
+        self.roi_rect = None
+        self.graphics_view.rubberBandChanged.connect(self.rubber_band_changed)
+
     def set_image_from_array(self, pixels: np.ndarray, text: str = ''):
-        self.scene.clear()
         if pixels is None:
+            self.pixmap_item.setPixmap(QPixmap())
+            self.text_item.setPlainText('')
+            self.image_size = None
             return
-        image = pixels.astype(np.uint8)  # assumes 8-bit depth
+        image = pixels.astype(np.uint8, copy=False)  # assumes 8-bit depth
         h, w = image.shape
-        qimage = QImage(image.data, w, h, QImage.Format.Format_Grayscale8)
-        pixmap = QPixmap.fromImage(qimage)
-        pixmap_item = QGraphicsPixmapItem(pixmap)
-        self.scene.addItem(pixmap_item)
-        self.graphics_view.fitInView(self.scene.sceneRect(), Qt.AspectRatioMode.KeepAspectRatio)
-
-        if text:
-            font = QFont('Arial', 3)  # Choose a font
-            text_item = QGraphicsTextItem(text)  # Create a text item
-            text_item.setFont(font)  # Set the font
-            text_item.setDefaultTextColor(QColor(0, 0, 0))  # Set the color to black
-            text_item.setPos(-3, pixmap.height() - 3)  # Position the text (bottom left)
-            self.scene.addItem(text_item)
+        factor = self.get_display_factor()
+        display = np.ascontiguousarray(self.downsampler.downsample(image, factor))
+        dh, dw = display.shape
+        qimage = QImage(display.data, dw, dh, display.strides[0], QImage.Format.Format_Grayscale8)
+        self.pixmap_item.setPixmap(QPixmap.fromImage(qimage))
+        # Same scale on both axes : a display pixel is a block of factor x factor pixels
+        self.pixmap_item.setScale(self.downsampler.factor)
+        self.display_factor = self.downsampler.factor
+
+        if text != self.text_item.toPlainText():
+            self.text_item.setPlainText(text)
+        if self.image_size != (w, h):
+            self.image_size = (w, h)
+            self.text_item.setPos(-3, h - 3)  # Position the text (bottom left)
+            self.scene.setSceneRect(QRectF(0, 0, w, h))
+            self.fit_image()
+
+    def get_display_factor(self) -> int:
+        """Return the downsampling factor for the current zoom of the view (1 : full resolution)."""
+        scale = self.graphics_view.transform().m11()
+        if self.image_size is None or scale >= 1:
+            return 1
+        return int(1 / scale)
+
+    def fit_image(self):
+        """Fit the view to the image."""
+        if self.image_size is not None:
+            self.graphics_view.fitInView(self.pixmap_item, Qt.AspectRatioMode.KeepAspectRatio)
+
+    def resizeEvent(self, event):
+        """Fit the image again when the widget is resized."""
+        super().resizeEvent(event)
+        self.fit_image()
+
+    def set_roi_selection(self, enabled: bool):
+        """Enable or disable the selection of a region of interest by dragging on the image."""
+        self.roi_rect = None
+        if enabled:
+            self.graphics_view.setDragMode(QGraphicsView.DragMode.RubberBandDrag)
+            self.graphics_view.setCursor(Qt.CursorShape.CrossCursor)
+        else:
+            self.graphics_view.setDragMode(QGraphicsView.DragMode.NoDrag)
+            self.graphics_view.unsetCursor()
+
+    def rubber_band_changed(self, viewport_rect, from_scene, to_scene):
+        """Store the dragged rectangle, and emit it when the mouse is released (empty rectangle)."""
+        if not viewport_rect.isNull():
+            self.roi_rect = QRectF(from_scene, to_scene).normalized()
+            return
+        if self.roi_rect is None or self.image_size is None:
+            return
+        w, h = self.image_size
+        rect = self.roi_rect.intersected(QRectF(0, 0, w, h))
+        self.set_roi_selection(False)
+        if rect.width() >= 1 and rect.height() >= 1:
+            self.roi_selected.emit((rect.x(), rect.y(), rect.width(), rect.height()))
 
     def set_bits_depth(self, value_depth: int):
         """Set the bits depth of the camera pixels."""
@@ -10,6 +10,7 @@ from PyQt6.QtGui import QPixmap, QImage
 import numpy as np
 from controllers import MotCam_control
 from controllers.MotCam_control import cameraControl
+from lense_common.display_mapping import DisplayMapping
 
 
 class liveWidget(QWidget):
@@ -30,13 +31,17 @@ class liveWidget(QWidget):
         self.image1 = None
         self.image2 = None
         self.image = None
+        # Conversion to 8 bits, as ModesController : full range for the raw images,
+        # window following the histogram for the OCT image. Each mapping owns its output buffer.
+        self.raw_mappings = [DisplayMapping(12), DisplayMapping(12)]
+        self.oct_mapping = DisplayMapping(12, auto_contrast=True)
 
     def generate_frame(self, step_size = 1.25, V0 = 12):
         try:
             image1, image2, image = self.control.live_sequence(step_size, V0)
             if image is None:
                 return
-            image = self.convertTo_uint8(image)
+            image = self.convertTo_uint8(image, self.oct_mapping)
 
             h, w = image.shape
             qimage = QImage(image.data, w, h, w, QImage.Format.Format_Grayscale8)
@@ -49,27 +54,19 @@ class liveWidget(QWidget):
             self.timer.stop()
             self.label.setText("Erreur : impossible de lire la caméra.")
 
-    def convertTo_uint8(self, image):
-        type = image.dtype
-        if type == "uint8":
+    def convertTo_uint8(self, image, mapping: DisplayMapping):
+        if image.dtype == np.uint8:
             return image
-        if type == "float16":
-            image_float32 = image.astype(np.float32)
-        elif type == "float32":
-            image_float32 = image
-        image_normalized = (image_float32 - np.min(image_float32)) / (
-                np.max(image_float32) - np.min(image_float32) + 1e-8)
-        image_uint8 = (image_normalized * 255).astype(np.uint8)
-        return image_uint8
+        return mapping.apply(image)
 
     def get_live_sequence(self, step_size, V0):
         image1, image2, image = self.control.live_sequence(step_size, V0)
         if image is None:
             print(f"Pas d'image détectée")
             return
-        self.image1 = self.convertTo_uint8(image1)
-        self.image2 = self.convertTo_uint8(image2)
-        self.image = self.convertTo_uint8(image)
+        self.image1 = self.convertTo_uint8(image1, self.raw_mappings[0])
+        self.image2 = self.convertTo_uint8(image2, self.raw_mappings[1])
+        self.image = self.convertTo_uint8(image, self.oct_mapping)
 
     def if_main_video(self):
         self.label = QLabel("Initialisation")
@@ -15,6 +15,7 @@ from PyQt6.QtWidgets import (
     QLabel
 )
 from PyQt6.QtCore import pyqtSignal
+from PyQt6.QtGui import QFont
 from lensepy import translate
 from views.images_display_view import ImagesDisplayView
 from views.images import ImageDisplayGraph
@@ -124,12 +125,29 @@ class MainView(QWidget):
         self.image2_widget.set_image_from_array(image, 'Image2')
         self.image_oct_graph.set_image_from_array(image, 'OCT')
 
+        # Performance overlay (timings of the pipeline stages), on the OCT image
+        self.performance_hud = QLabel(self.image_oct_graph)
+        self.performance_hud.setFont(QFont('Courier New', 9))
+        self.performance_hud.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: #40ff40; padding: 4px;")
+        self.performance_hud.move(15, 15)
+        self.performance_hud.hide()
 
         self.layout.addLayout(self.left_layout)
         self.layout.addLayout(self.right_layout)
         self.setLayout(self.layout)
 
 
+    def show_performance_hud(self, visible: bool):
+        """Show or hide the performance overlay."""
+        self.performance_hud.setVisible(visible)
+        if visible:
+            self.performance_hud.raise_()
+
+    def set_performance_hud(self, text: str):
+        """Set the text of the performance overlay."""
+        self.performance_hud.setText(text)
+        self.performance_hud.adjustSize()
+
     def update_size(self, aoi: bool = False):
         """
         Update the size of the main widget.
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""*display_mapping.py* file.
+
+./lense_common/display_mapping.py contains DisplayMapping class to convert 12-bit
+(or any n-bit) images to 8-bit images for display, with a window, a level
+and a gamma, through a cached look-up table.
+
+lense_common contains the modules shared by the applications of applis/
+(OCTv3, Base_GUI_with_cam). The directory applis/ is added to sys.path by
+each application that uses it.
+
+.. note:: LEnsE - Institut d'Optique - version 1.0
+
+.. moduleauthor:: Julien VILLEMEJANE (PRAG LEnsE) <julien.villemejane@institutoptique.fr>
+"""
+import numpy as np
+
+# Auto-contrast : percentiles of the histogram mapped to black and white
+AUTO_LOW_PERCENTILE = 0.5
+AUTO_HIGH_PERCENTILE = 99.5
+# Auto-contrast : the histogram is computed on 1 pixel out of AUTO_DECIMATION in each direction
+AUTO_DECIMATION = 8
+
+
+class DisplayMapping:
+    """
+    Window/level/gamma mapping of n-bit images to uint8.
+
+    A 2**bits_depth entries LUT is built when the window or the gamma
+    changes, then each image is converted with a single np.take into a
+    reused uint8 buffer. Values outside [0, 2**bits_depth - 1] are clipped.
+    With auto_contrast, the window follows the percentiles of a decimated
+    histogram of each image.
+    """
+
+    def __init__(self, bits_depth: int = 12, gamma: float = 1.0, auto_contrast: bool = False):
+        """
+        Default constructor.
+        :param bits_depth: Bits depth of the images (size of the LUT : 2**bits_depth).
+        :param gamma: Gamma of the mapping.
+        :param auto_contrast: If True, the window is updated from the histogram of each image.
+        """
+        self.bits_depth = bits_depth
+        self.lut_size = 2 ** bits_depth
+        self.low = 0
+        self.high = self.lut_size - 1
+        self.gamma = gamma
+        self.auto_contrast = auto_contrast
+        self._lut = None
+        self._lut_key = None
+        self._index = None
+        self._out = None
+
+    def set_window(self, low: float, high: float):
+        """
+        Set the input values mapped to black and white.
+        :param low: Value mapped to 0.
+        :param high: Value mapped to 255.
+        """
+        self.low = float(low)
+        self.high = float(max(high, low + 1))
+
+    def set_window_level(self, window: float, level: float):
+        """
+        Set the window (width) and the level (center) of the mapping.
+        :param window: Width of the input range.
+        :param level: Center of the input range.
+        """
+        self.set_window(level - window / 2, level + window / 2)
+
+    def set_gamma(self, gamma: float):
+        self.gamma = float(gamma)
+
+    def set_bits_depth(self, bits_depth: int):
+        """Change the bits depth of the images, and reset the window to the full range."""
+        if bits_depth != self.bits_depth:
+            self.bits_depth = bits_depth
+            self.lut_size = 2 ** bits_depth
+            self.set_window(0, self.lut_size - 1)
+
+    @property
+    def lut(self) -> np.ndarray:
+        """Look-up table of the current window and gamma (built only when they change)."""
+        key = (self.lut_size, self.low, self.high, self.gamma)
+        if key != self._lut_key:
+            values = np.arange(self.lut_size, dtype=np.float32)
+            values = np.clip((values - self.low) / (self.high - self.low), 0, 1)
+            if self.gamma != 1.0:
+                values **= 1 / self.gamma
+            self._lut = (values * 255 + 0.5).astype(np.uint8)
+            self._lut_key = key
+        return self._lut
+
+    def update_auto_contrast(self, image: np.ndarray):
+        """
+        Set the window to the percentiles of the histogram of a decimated image.
+        :param image: Image to analyze.
+        """
+        sample = image[::AUTO_DECIMATION, ::AUTO_DECIMATION]
+        sample = np.clip(sample, 0, self.lut_size - 1).astype(np.intp).ravel()
+        if sample.size == 0:
+            return
+        cumulative = np.cumsum(np.bincount(sample, minlength=self.lut_size))
+        low = np.searchsorted(cumulative, cumulative[-1] * AUTO_LOW_PERCENTILE / 100)
+        high = np.searchsorted(cumulative, cumulative[-1] * AUTO_HIGH_PERCENTILE / 100)
+        self.set_window(low, high)
+
+    def apply(self, image: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        Convert an image to uint8.
+        :param image: Image to convert (integer or float values).
+        :param out: Optional uint8 array to write the result in (same shape).
+            Default : buffer of this object, reused by the next calls.
+        :return: uint8 image.
+        """
+        if self.auto_contrast:
+            self.update_auto_contrast(image)
+        if out is None:
+            if self._out is None or self._out.shape != image.shape:
+                self._out = np.empty(image.shape, dtype=np.uint8)
+            out = self._out
+        if np.issubdtype(image.dtype, np.integer):
+            index = image
+        else:
+            if self._index is None or self._index.shape != image.shape:
+                self._index = np.empty(image.shape, dtype=np.int32)
+            index = self._index
+            np.copyto(index, image, casting='unsafe')
+        np.take(self.lut, index, out=out, mode='clip')
+        return out